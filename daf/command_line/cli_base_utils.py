@@ -1,11 +1,13 @@
 from abc import abstractmethod
 import argparse as ap
+import os
 import sys
 
 import numpy as np
 
 from daf.core.main import DAF
 import daf.utils.dafutilities as du
+from daf.utils.daf_paths import DAFPaths
 from daf.core.matrix_utils import (
     calculate_pseudo_angle_from_motor_angles,
 )
@@ -107,6 +109,10 @@ class CLIBase:
             qaz=self.experiment_file_dict["cons_qaz"],
             naz=self.experiment_file_dict["cons_naz"],
         )
+        exp.set_multi_start(
+            seeds=self.experiment_file_dict.get("solver_seeds"),
+            workers=self.experiment_file_dict.get("solver_workers"),
+        )
 
         exp.set_U(U)
         exp.build_xrd_experiment()
@@ -114,6 +120,18 @@ class CLIBase:
 
         return exp
 
+    def enable_solution_cache(self) -> None:
+        """Reuse the solutions of previous HKL calculations with the same experiment state"""
+        size = self.experiment_file_dict.get("solution_cache_size", 1000)
+        if size and os.path.isdir(DAFPaths.DAF_CONFIGS):
+            self.exp.set_solution_cache(DAFPaths.SOLUTION_CACHE, size)
+
+    def enable_trajectory_cache(self) -> None:
+        """Reuse the scan trajectories already solved with the same inputs and experiment state"""
+        size = self.experiment_file_dict.get("trajectory_cache_size", 100)
+        if size and os.path.isdir(DAFPaths.DAF_CONFIGS):
+            self.exp.set_trajectory_cache(DAFPaths.TRAJECTORY_CACHE, size)
+
     def calculate_hkl_from_angles(self) -> np.array:
         """Calculate current HKL position from diffractometer angles"""
         hkl = self.exp.calc_from_angs(
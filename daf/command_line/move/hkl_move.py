@@ -4,6 +4,7 @@ import argparse as ap
 import numpy as np
 
 from daf.utils.print_utils import format_5_decimals
+from daf.core.solve_stats import format_solve_stats
 from daf.utils.decorators import cli_decorator
 from daf.utils import dafutilities as du
 from daf.command_line.move.move_utils import MoveBase
@@ -16,6 +17,7 @@ class HKLMove(MoveBase):
         daf.mv 1 1 1
         daf.mv 1 0 0 -q
         daf.mv 1 1 1 -m '*' -cm 'I' -s 16
+        daf.mv 1 1 1 --profile
 
         """
 
@@ -24,6 +26,7 @@ class HKLMove(MoveBase):
         self.parsed_args = self.parse_command_line()
         self.parsed_args_dict = vars(self.parsed_args)
         self.exp = self.build_exp()
+        self.enable_solution_cache()
 
     def parse_command_line(self):
         super().parse_command_line()
@@ -58,6 +61,11 @@ class HKLMove(MoveBase):
             help="size of the print, default is 14",
             default=14,
         )
+        self.parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="show how the solver found the angles and the time it took",
+        )
 
         args = self.parser.parse_args()
         return args
@@ -81,7 +89,11 @@ class HKLMove(MoveBase):
                 column_marker=self.parsed_args_dict["column_marker"],
                 space=self.parsed_args_dict["size"],
             )
+            if self.exp.from_cache:
+                print("Solution retrieved from the cache")
             print(self.exp)
+        if self.parsed_args_dict["profile"]:
+            print(format_solve_stats(self.exp.last_solve_stats))
         self.write_angles_if_small_error(error)
 
 
@@ -6,10 +6,14 @@ import daf.utils.dafutilities as du
 from daf.command_line.cli_base_utils import CLIBase
 import daf.command_line.scan.scan_daf as sd
 from daf.command_line.scan.scan_daf import DAFScanInputs
+from daf.core.scan_duration import format_scan_duration
 from daf.utils.daf_paths import DAFPaths as dp
 
 
 class ScanBase(CLIBase):
+    # DAFScanSession shared by the scans run in the same process by daf.queue, None for a session per scan
+    session = None
+
     def __init__(
         self, *args, number_of_motors: int = None, scan_type: str = None, **kwargs
     ):
@@ -24,6 +28,13 @@ class ScanBase(CLIBase):
     def parse_command_line(self):
         """The majority of the scans use this, but some not and have to overwrite this method"""
         super().parse_command_line()
+        self.motor_cli_arguments()
+        self.common_cli_scan_arguments()
+        args = self.parser.parse_args()
+        return args
+
+    def motor_cli_arguments(self) -> None:
+        """Start and end arguments for each motor"""
         for motor in self.experiment_file_dict["motors"].keys():
             self.parser.add_argument(
                 "-" + self.experiment_file_dict["motors"][motor]["cli_abbrev"],
@@ -33,9 +44,6 @@ class ScanBase(CLIBase):
                 nargs=2,
                 help="Start and end for {}".format(motor),
             )
-        self.common_cli_scan_arguments()
-        args = self.parser.parse_args()
-        return args
 
     def common_cli_scan_arguments(self, step=True) -> None:
         """This are the arguments that are common to all daf scans"""
@@ -55,6 +63,16 @@ class ScanBase(CLIBase):
             help="output data to file output-prefix/<fileprefix>_nnnn",
             default=os.getcwd() + "/scan_daf.nxs",
         )
+        self.parser.add_argument(
+            "--dry_run",
+            action="store_true",
+            help="Only print how long the scan would take, from the speed, acceleration and backlash of the motors",
+        )
+        self.parser.add_argument(
+            "--stream_nexus",
+            action="store_true",
+            help="Write the output file while the scan runs, readable with HDF5 SWMR. Area detector images are not written to it",
+        )
 
     def get_inputed_motor_order(self, sysargv: sys.argv) -> list:
         """Method to retrieve the right order that the user input arguments through shell"""
@@ -113,6 +131,24 @@ class ScanBase(CLIBase):
     def run_scan(self) -> None:
         """Perform the scan"""
         scan_inputs = self.configure_scan_input()
+        scan_inputs.setdefault(
+            "point_overhead", self.experiment_file_dict.get("scan_point_overhead")
+        )
+        scan_inputs.setdefault(
+            "stream_nexus", self.parsed_args_dict.get("stream_nexus", False)
+        )
         scan_inputs_obj = DAFScanInputs(**scan_inputs)
-        scan = sd.DAFScan(scan_inputs_obj)
+        if self.parsed_args_dict.get("dry_run"):
+            scan = sd.DAFScan(scan_inputs_obj, dry_run=True)
+            try:
+                estimate = scan.estimate_duration()
+            except ValueError as error:
+                # Time scans run until stopped
+                print(
+                    "The duration of this scan can not be estimated: {}".format(error)
+                )
+                return
+            print(format_scan_duration(estimate))
+            return
+        scan = sd.DAFScan(scan_inputs_obj, session=self.session)
         scan.run()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Stream the bluesky documents of a scan through a single long-lived producer"""
+
+import queue
+import struct
+import threading
+import time
+
+# Documents waiting to be sent before the scan has to wait for the transport
+MAX_QUEUED_DOCUMENTS = 10000
+# Producer settings, messages are grouped for up to LINGER_MS or BATCH_SIZE bytes before being sent
+KAFKA_SETTINGS = {"linger_ms": 20, "batch_size": 256 * 1024, "acks": 1}
+
+
+class KafkaTransport:
+    """Send payloads to a Kafka broker with one KafkaProducer, created when the transport is"""
+
+    def __init__(self, **settings):
+        from kafka import KafkaProducer
+
+        self.producer = KafkaProducer(**{**KAFKA_SETTINGS, **settings})
+
+    def send(self, topic: str, payload: bytes) -> None:
+        """Queue the payload in the producer, it is sent in the background"""
+        self.producer.send(topic, payload)
+
+    def flush(self, timeout=None) -> None:
+        self.producer.flush(timeout=timeout)
+
+    def close(self) -> None:
+        self.producer.close()
+
+
+class MemoryTransport:
+    """Keep the (topic, payload) sent in a list, for tests and in-process consumers"""
+
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def send(self, topic: str, payload: bytes) -> None:
+        with self.lock:
+            self.messages.append((topic, payload))
+
+    def flush(self, timeout=None) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class FileTransport:
+    """Append the payloads to a file, each one preceded by its length as a 4 bytes big-endian integer"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.file = open(self.path, "ab")
+
+    def send(self, topic: str, payload: bytes) -> None:
+        self.file.write(struct.pack(">I", len(payload)) + payload)
+
+    def flush(self, timeout=None) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_file_transport(path) -> list:
+    """Payloads written by a FileTransport"""
+    payloads = []
+    with open(path, "rb") as file:
+        while True:
+            header = file.read(4)
+            if len(header) < 4:
+                return payloads
+            payloads.append(file.read(struct.unpack(">I", header)[0]))
+
+
+class DocumentPublisher:
+    """
+    Bluesky callback sending every (name, doc) to topic through transport, KafkaTransport by default.
+    Other documents of the scan, such as its peak statistics, can share the transport by passing their
+    own topic.
+
+    The documents are serialized, msgpack by default, and queued. A worker thread sends them, so the
+    RunEngine never waits for the network. When max_queued documents are waiting, the callback blocks
+    until there is room for the new one, or drops it if block is False, and the time lost is counted in
+    metrics. Every "stop" document flushes the transport, close flushes and stops the worker.
+    """
+
+    def __init__(
+        self,
+        topic,
+        transport=None,
+        serializer=None,
+        max_queued=MAX_QUEUED_DOCUMENTS,
+        block=True,
+    ):
+        if serializer is None:
+            import msgpack
+
+            serializer = msgpack.dumps
+        self.topic = topic
+        self.transport = transport if transport is not None else KafkaTransport()
+        self.serializer = serializer
+        self.block = block
+        self.queue = queue.Queue(maxsize=max(1, int(max_queued)))
+        self.metrics = {
+            "sent": 0,
+            "dropped": 0,
+            "send_errors": 0,
+            "max_queued": 0,
+            "blocked_time": 0.0,
+        }
+        self.worker = threading.Thread(
+            target=self._send, name="daf-document-publisher", daemon=True
+        )
+        self.worker.start()
+
+    def __call__(self, name: str, doc: dict, topic=None) -> None:
+        payload = (self.topic if topic is None else topic, self.serializer((name, doc)))
+        try:
+            self.queue.put_nowait(payload)
+        except queue.Full:
+            if not self.block:
+                self.metrics["dropped"] += 1
+                return
+            started = time.perf_counter()
+            self.queue.put(payload)
+            self.metrics["blocked_time"] += time.perf_counter() - started
+        self.metrics["max_queued"] = max(self.metrics["max_queued"], self.queue.qsize())
+        if name == "stop":
+            self.flush()
+
+    def _send(self):
+        while True:
+            payload = self.queue.get()
+            try:
+                if payload is None:
+                    return
+                self.transport.send(*payload)
+                self.metrics["sent"] += 1
+            except Exception:
+                self.metrics["send_errors"] += 1
+            finally:
+                self.queue.task_done()
+
+    def flush(self, timeout=None) -> None:
+        """Wait for the queued documents to be handed to the transport and for the transport to send them"""
+        self.queue.join()
+        self.transport.flush(timeout)
+
+    def close(self) -> None:
+        """Send the pending documents and stop"""
+        if not self.worker.is_alive():
+            return
+        self.flush()
+        self.queue.put(None)
+        self.worker.join()
+        self.transport.close()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+from daf.utils.decorators import cli_decorator
+from daf.core.fly_scan import FLY_PERIOD
+from daf.command_line.cli_base_utils import CLIBase
+from daf.command_line.scan.daf_scan_utils import ScanBase
+
+
+class FlyScan(ScanBase):
+
+    DESC = """Perform a fly scan, moving one of the diffractometer motors continuously while the counters are read"""
+    EPI = """
+    Eg:
+        daf.fscan -e 10 20 100 .1
+        daf.fscan --eta 10 20 1000 .01 --period 0.005
+        daf.fscan -e 10 20 100 .1 --monitor -o my_scan
+
+    The motor moves from start to end in (step + 1) * time seconds, and the counters are averaged in
+    step + 1 bins along the way.
+        """
+
+    def __init__(self):
+        super().__init__(number_of_motors=1, scan_type="fly_scan")
+
+    def parse_command_line(self):
+        CLIBase.parse_command_line(self)
+        self.motor_cli_arguments()
+        self.common_cli_scan_arguments()
+        self.parser.add_argument(
+            "--period",
+            metavar="",
+            type=float,
+            default=FLY_PERIOD,
+            help="Time between counter readings in seconds (default is {})".format(
+                FLY_PERIOD
+            ),
+        )
+        self.parser.add_argument(
+            "--monitor",
+            action="store_true",
+            help="record every counter update instead of reading them every period",
+        )
+        args = self.parser.parse_args()
+        return args
+
+    def configure_scan_input(self):
+        if len(self.inputed_motors) != 1:
+            self.parser.error("A fly scan moves exactly one motor")
+        scan_inputs = super().configure_scan_input()
+        motor = self.inputed_motors[0]
+        start, end = self.parsed_args_dict[motor]
+        scan_inputs["scan_data"] = {
+            "start": start,
+            "end": end,
+            "period": self.parsed_args_dict["period"],
+            "monitor": self.parsed_args_dict["monitor"],
+        }
+        return scan_inputs
+
+    def run_cmd(self):
+        """Method to print the user required information"""
+        self.run_scan()
+
+
+@cli_decorator
+def main() -> None:
+    obj = FlyScan()
+    obj.run_cmd()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,51 @@
 #!/usr/bin/env python3
 
+import argparse as ap
+import os
+
 import numpy as np
-import pandas as pd
 
 from daf.utils.decorators import cli_decorator
+from daf.utils.daf_paths import DAFPaths
+from daf.core.trajectory_cache import TrajectoryCache
+from daf.core.trajectory_reader import CHUNK_SIZE, TrajectoryReader
+from daf.core.utils import DIFFRACTOMETER_MOTOR_NAMES
 from daf.command_line.cli_base_utils import CLIBase
 from daf.command_line.scan.daf_scan_utils import ScanBase
 
 
+def column_mapping(text: str) -> dict:
+    """Parse a motor=column command line argument"""
+    motor, sep, column = text.partition("=")
+    if not sep or motor not in DIFFRACTOMETER_MOTOR_NAMES or not column:
+        raise ap.ArgumentTypeError(
+            "expected motor=column with motor one of {}".format(
+                ", ".join(DIFFRACTOMETER_MOTOR_NAMES)
+            )
+        )
+    return {motor: column}
+
+
+class MergeColumns(ap.Action):
+    """Merge the motor=column arguments in a single dict"""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        columns = {}
+        for value in values:
+            columns.update(value)
+        setattr(namespace, self.dest, columns)
+
+
 class FromFileScan(ScanBase):
 
-    DESC = """Perform a scan from a csv file generated by daf.scan"""
+    DESC = """Perform a scan from a file generated by daf.scan, or any CSV, .npy, .npz, HDF5 or Parquet file with the motor positions, or from a trajectory of the trajectory cache"""
     EPI = """
     Eg:
         daf.ffscan my_scan -t 0.01
+        daf.ffscan daf_hkl_scan.csv 0.01
+        daf.ffscan 3f9a2c 0.01
+        daf.ffscan trajectory.h5 0.01 --columns mu=mu_pos del=delta
+        daf.ffscan trajectory.parquet 0.01 --chunk_size 10000 --stream
 
         """
 
@@ -26,58 +58,96 @@ class FromFileScan(ScanBase):
         self.parser.add_argument(
             "file_name",
             type=str,
-            help="Perform a scan from the file generated by daf.scan",
+            help="Perform a scan from the file generated by daf.scan. If there is no such file, the name or hash of a cached trajectory",
+        )
+        self.parser.add_argument(
+            "--columns",
+            metavar="motor=column",
+            type=column_mapping,
+            nargs="+",
+            default={},
+            action=MergeColumns,
+            help="Column of the file with the positions of a motor, e.g. mu=theta, by default Mu or mu. Indices for arrays without column names",
+        )
+        self.parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="Read the points from the file while the scan runs instead of before it starts",
+        )
+        self.parser.add_argument(
+            "--chunk_size",
+            metavar="",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of points read from the file at once (default is {})".format(
+                CHUNK_SIZE
+            ),
+        )
+        self.parser.add_argument(
+            "-sep",
+            "--separator",
+            metavar="",
+            type=str,
+            default=",",
+            help="Separator of CSV files, comma is default",
         )
         self.common_cli_scan_arguments(step=False)
         args = self.parser.parse_args()
         return args
 
-    def generate_data_for_scan(self, full_file_path: str) -> np.array:
-        """Generate the scan path for scans"""
-        scan_points = pd.read_csv(full_file_path)
-        mu_points = [
-            float(i) for i in scan_points["Mu"]
-        ]  # Get only the points related to mu
-        eta_points = [
-            float(i) for i in scan_points["Eta"]
-        ]  # Get only the points related to eta
-        chi_points = [
-            float(i) for i in scan_points["Chi"]
-        ]  # Get only the points related to chi
-        phi_points = [
-            float(i) for i in scan_points["Phi"]
-        ]  # Get only the points related to phi
-        nu_points = [
-            float(i) for i in scan_points["Nu"]
-        ]  # Get only the points related to nu
-        del_points = [
-            float(i) for i in scan_points["Del"]
-        ]  # Get only the points related to del
-
-        data_for_scan = {
-            "mu": [mu_points],
-            "eta": [eta_points],
-            "chi": [chi_points],
-            "phi": [phi_points],
-            "nu": [nu_points],
-            "del": [del_points],
+    def trajectory_reader(self, full_file_path: str) -> TrajectoryReader:
+        """Reader of the scan file, or of the cached trajectory with that name or hash"""
+        if not os.path.exists(full_file_path):
+            cache = TrajectoryCache(DAFPaths.TRAJECTORY_CACHE)
+            key = cache.resolve(full_file_path)
+            if key is None:
+                raise FileNotFoundError(
+                    "{} is neither a file nor a cached trajectory".format(
+                        full_file_path
+                    )
+                )
+            full_file_path = cache.path(key)
+        return TrajectoryReader(
+            full_file_path,
+            column_map=self.parsed_args_dict["columns"],
+            chunk_size=self.parsed_args_dict["chunk_size"],
+            sep=self.parsed_args_dict["separator"],
+        )
+
+    def generate_data_for_scan(self, full_file_path: str) -> dict:
+        """Generate the scan path for scans, the points of each motor as build_scan_args expects them"""
+        reader = self.trajectory_reader(full_file_path)
+        points = np.concatenate(list(reader.chunks()) or [np.empty((0, 6))])
+        # Must be stored in list of list because the way the build_scan_args is structured
+        return {
+            motor: [[float(i) for i in points[:, column]]]
+            for column, motor in enumerate(DIFFRACTOMETER_MOTOR_NAMES)
         }
-        ordered_motors = [i for i in data_for_scan.keys()]
 
-        return data_for_scan, ordered_motors
+    def generate_streamed_data_for_scan(self, full_file_path: str) -> dict:
+        """Generate the scan path for stream_list_scan, the points are read from the file while the scan runs"""
+        reader = self.trajectory_reader(full_file_path)
+        return {"points": iter(reader), "num_points": len(reader)}
 
     def configure_scan_input(self):
         """Basically, a wrapper for configure_scan_inputs. It may differ from scan to scan"""
-        data_for_scan, ordered_motors = self.generate_data_for_scan(
-            self.parsed_args_dict["file_name"]
-        )
-        inputed_motors = [i for i in data_for_scan.keys()]
+        # A dry run needs every point to estimate the duration, it is read as a list_scan
+        if self.parsed_args_dict["stream"] and not self.parsed_args_dict["dry_run"]:
+            scan_type = "stream_list_scan"
+            data_for_scan = self.generate_streamed_data_for_scan(
+                self.parsed_args_dict["file_name"]
+            )
+        else:
+            scan_type = self.scan_type
+            data_for_scan = self.generate_data_for_scan(
+                self.parsed_args_dict["file_name"]
+            )
         return {
             "scan_data": data_for_scan,
-            "inputed_motors": inputed_motors,
+            "inputed_motors": DIFFRACTOMETER_MOTOR_NAMES,
             "motors_data_dict": self.experiment_file_dict["motors"],
             "counters": self.get_counters(),
-            "scan_type": self.scan_type,
+            "scan_type": scan_type,
             "steps": None,
             "acquisition_time": self.parsed_args_dict["time"],
             "output": self.parsed_args_dict["output"],
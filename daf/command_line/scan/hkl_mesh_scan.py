@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+from daf.utils.decorators import cli_decorator
+from daf.core.hkl_mesh import mesh_axis
+from daf.command_line.cli_base_utils import CLIBase
+from daf.command_line.scan.hkl_scan import HKLScan
+
+
+class HKLMeshScan(HKLScan):
+
+    DESC = (
+        """Perform a mesh scan in reciprocal space, using a grid of HKL coordinates"""
+    )
+    EPI = """
+    Eg:
+        daf.hklmesh -H 1 1.1 10 -K 1 1 0 -L 0.9 1.1 20 0.1
+        daf.hklmesh -H 1 1.1 10 -K 0.9 1.1 10 -L 1 1 0 0.1 -n my_rsm -v
+        daf.hklmesh -H 1 1.1 10 -K 1 1 0 -L 0.9 1.1 200 0.1 -c -w 8
+
+    Each axis takes start, end and number of intervals, 0 intervals keeps the axis fixed at start.
+    The grid is run as a single scan in snake order, L being the fastest axis.
+        """
+
+    def parse_command_line(self):
+        CLIBase.parse_command_line(self)
+        for axis in ("H", "K", "L"):
+            self.parser.add_argument(
+                "-" + axis,
+                metavar=("start", "end", "intervals"),
+                type=float,
+                nargs=3,
+                required=True,
+                help="Start, end and number of intervals of {}".format(axis),
+            )
+        self.parser.add_argument(
+            "-n",
+            "--scan_name",
+            metavar="",
+            type=str,
+            default="daf_hkl_mesh.csv",
+            help="Name of the scan",
+        )
+        self.parser.add_argument(
+            "-sep",
+            "--separator",
+            metavar="",
+            type=str,
+            default=",",
+            help="Chose the separator of scan file, comma is default",
+        )
+        self.parser.add_argument(
+            "-m",
+            "--max_diff",
+            metavar="",
+            type=float,
+            default=0,
+            help="Max difference of angles variation, if 0 is given no verification will be done",
+        )
+        self.parser.add_argument(
+            "-v", "--verbose", action="store_true", help="Show full output"
+        )
+        self.parser.add_argument(
+            "-c",
+            "--calc",
+            action="store_true",
+            help="Only calc the scan without perform it",
+        )
+        self.parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="show how the solver found the angles of the scan points and the time it took",
+        )
+        self.parser.add_argument(
+            "-w",
+            "--workers",
+            metavar="",
+            type=int,
+            default=1,
+            help="Number of processes to solve the grid in parallel chunks (default is 1)",
+        )
+        self.common_cli_scan_arguments(step=False)
+        args = self.parser.parse_args()
+        for axis in ("H", "K", "L"):
+            try:
+                mesh_axis(vars(args)[axis])
+            except ValueError as error:
+                self.parser.error("-{}: {}".format(axis, error))
+        return args
+
+    def generate_data_for_scan(self):
+        """Solve the HKL grid, reusing it from the trajectory cache if it was already solved"""
+        self.exp = self.build_exp()
+        self.enable_trajectory_cache()
+        scan_points = self.exp.hkl_mesh_scan(
+            mesh_axis(self.parsed_args_dict["H"]),
+            mesh_axis(self.parsed_args_dict["K"]),
+            mesh_axis(self.parsed_args_dict["L"]),
+            diflimit=self.parsed_args_dict["max_diff"],
+            name=self.parsed_args_dict["scan_name"],
+            write=True,
+            sep=self.parsed_args_dict["separator"],
+            startvalues=self.diffractometer_motor_start_values(),
+            workers=self.parsed_args_dict["workers"],
+        )
+        return self.list_scan_data(scan_points)
+
+
+@cli_decorator
+def main() -> None:
+    obj = HKLMeshScan()
+    obj.run_cmd()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ import numpy as np
 import pandas as pd
 
 from daf.utils.decorators import cli_decorator
+from daf.core.solve_stats import format_trajectory_stats
+from daf.core.trajectory_stream import LOOK_AHEAD
+from daf.core.utils import DIFFRACTOMETER_MOTOR_NAMES
 from daf.command_line.cli_base_utils import CLIBase
 from daf.command_line.scan.daf_scan_utils import ScanBase
 
@@ -16,6 +19,10 @@ class HKLScan(ScanBase):
         daf.scan 1 1 1 1.1 1.1 1.1 100 0.1 -n my_scan
         daf.scan 1 1 1 1.1 1.1 1.1 1000 0.1 -n my_scan -x eta -v
         daf.scan 1 1 1 1.1 1.1 1.1 100 0.1 -p -t 0.5
+        daf.scan 1 1 1 1.1 1.1 1.1 100 0.1 -c --profile
+        daf.scan 1 1 1 1.1 1.1 1.1 1000 0.1 --stream
+        daf.scan 1 1 1 1.1 1.1 1.1 10000 0.1 -c -w 8
+        daf.scan 1 1 1 1.1 1.1 1.1 20 0.1 --adaptive 0.5 --merge 0.05
         """
 
     def __init__(self):
@@ -73,18 +80,82 @@ class HKLScan(ScanBase):
             action="store_true",
             help="Only calc the scan without perform it",
         )
+        self.parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="show how the solver found the angles of the scan points and the time it took",
+        )
+        self.parser.add_argument(
+            "--stream",
+            action="store_true",
+            help="start the scan after the first point is solved, the next ones are solved while the motors move",
+        )
+        self.parser.add_argument(
+            "--look_ahead",
+            metavar="",
+            type=int,
+            default=LOOK_AHEAD,
+            help="Number of points solved ahead of the motors in a streamed scan (default is {})".format(
+                LOOK_AHEAD
+            ),
+        )
+        self.parser.add_argument(
+            "-w",
+            "--workers",
+            metavar="",
+            type=int,
+            default=1,
+            help="Number of processes to solve the scan in parallel chunks (default is 1). With --stream the scan starts once every chunk is solved",
+        )
+        self.parser.add_argument(
+            "--adaptive",
+            metavar="",
+            type=float,
+            default=0,
+            help="Max motor step, in degrees, between points. Steps bigger than it are split, making a non-uniform scan",
+        )
+        self.parser.add_argument(
+            "--merge",
+            metavar="",
+            type=float,
+            default=0,
+            help="With --adaptive, merge the points where no motor moves more than this, in degrees",
+        )
         self.common_cli_scan_arguments()
         args = self.parser.parse_args()
+        if args.stream and args.adaptive:
+            # The points of an adaptive scan are only known once it is solved
+            self.parser.error("--adaptive can not be used with --stream")
         return args
 
+    def diffractometer_motor_start_values(self) -> list:
+        return [
+            self.experiment_file_dict["motors"][i]["value"]
+            for i in DIFFRACTOMETER_MOTOR_NAMES
+        ]
+
+    def generate_streamed_data_for_scan(self):
+        """Generator of the scan path, solved while it is consumed"""
+        self.exp = self.build_exp()
+        self.enable_trajectory_cache()
+        return self.exp.scan_points(
+            self.parsed_args_dict["hkli"],
+            self.parsed_args_dict["hklf"],
+            self.parsed_args_dict["step"],
+            diflimit=self.parsed_args_dict["max_diff"],
+            name=self.parsed_args_dict["scan_name"],
+            write=True,
+            sep=self.parsed_args_dict["separator"],
+            startvalues=self.diffractometer_motor_start_values(),
+            look_ahead=self.parsed_args_dict["look_ahead"],
+            workers=self.parsed_args_dict["workers"],
+        )
+
     def generate_data_for_scan(self) -> np.array:
         """Generate the scan path for scans"""
-        diffractometer_motor_names = ["mu", "eta", "chi", "phi", "nu", "del"]
         self.exp = self.build_exp()
-        diffractometer_motor_start_values = [
-            self.experiment_file_dict["motors"][i]["value"]
-            for i in diffractometer_motor_names
-        ]
+        self.enable_trajectory_cache()
+        diffractometer_motor_start_values = self.diffractometer_motor_start_values()
         scan_points = self.exp.scan(
             self.parsed_args_dict["hkli"],
             self.parsed_args_dict["hklf"],
@@ -94,7 +165,14 @@ class HKLScan(ScanBase):
             write=True,
             sep=self.parsed_args_dict["separator"],
             startvalues=diffractometer_motor_start_values,
+            workers=self.parsed_args_dict["workers"],
+            adaptive_step=self.parsed_args_dict["adaptive"],
+            merge_step=self.parsed_args_dict["merge"],
         )
+        return self.list_scan_data(scan_points)
+
+    def list_scan_data(self, scan_points):
+        """Motor points of a scan DataFrame, as build_scan_args expects them for a list_scan"""
         mu_points = [
             float(i) for i in scan_points["Mu"]
         ]  # Get only the points related to mu
@@ -128,14 +206,26 @@ class HKLScan(ScanBase):
 
     def configure_scan_input(self):
         """Basically, a wrapper for configure_scan_inputs. It may differ from scan to scan"""
-        data_for_scan, ordered_motors = self.generate_data_for_scan()
-        inputed_motors = [i for i in data_for_scan.keys()]
+        # A dry run needs every point to estimate the duration, it is solved as a list_scan
+        if self.parsed_args_dict.get("stream") and not self.parsed_args_dict.get(
+            "dry_run"
+        ):
+            scan_type = "stream_list_scan"
+            inputed_motors = DIFFRACTOMETER_MOTOR_NAMES
+            data_for_scan = {
+                "points": self.generate_streamed_data_for_scan(),
+                "num_points": self.parsed_args_dict["step"] + 1,
+            }
+        else:
+            scan_type = self.scan_type
+            data_for_scan, ordered_motors = self.generate_data_for_scan()
+            inputed_motors = [i for i in data_for_scan.keys()]
         return {
             "scan_data": data_for_scan,
             "inputed_motors": inputed_motors,
             "motors_data_dict": self.experiment_file_dict["motors"],
             "counters": self.get_counters(),
-            "scan_type": self.scan_type,
+            "scan_type": scan_type,
             "steps": None,
             "acquisition_time": self.parsed_args_dict["time"],
             "output": self.parsed_args_dict["output"],
@@ -156,6 +246,10 @@ class HKLScan(ScanBase):
             self.print_scan_data_frame()
         if not self.parsed_args_dict["calc"]:
             self.run_scan()
+        elif self.parsed_args_dict["profile"]:
+            self.generate_data_for_scan()
+        if self.parsed_args_dict["profile"]:
+            print(format_trajectory_stats(self.exp.trajectory_solve_stats))
 
 
 @cli_decorator
@@ -42,12 +42,19 @@ class MeshScan(ScanBase):
             motor: convert_last_element_to_int(self.parsed_args_dict[motor])
             for motor in self.inputed_motors
         }
-        scan_inputs = [
-            scan_data,
-            self.inputed_motors,
-            self.experiment_file_dict["motors"],
-            self.scan_type,
-        ]
+        # grid_scan gets the number of points of each motor in scan_data
+        scan_inputs = {
+            "scan_data": scan_data,
+            "inputed_motors": self.inputed_motors,
+            "motors_data_dict": self.experiment_file_dict["motors"],
+            "counters": self.get_counters(),
+            "main_counter": self.experiment_file_dict["main_scan_counter"],
+            "scan_type": self.scan_type,
+            "acquisition_time": self.parsed_args_dict["time"],
+            "output": self.parsed_args_dict["output"],
+            "kafka_topic": self.experiment_file_dict["kafka_topic"],
+            "scan_db": self.experiment_file_dict["scan_db"],
+        }
         return scan_inputs
 
     def run_cmd(self):
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""Write the NeXus file of a scan while it runs, readable by other processes with HDF5 SWMR"""
+
+import json
+import time
+import traceback
+
+import h5py
+import numpy as np
+
+# Rows kept in memory before being appended to the file, and max seconds between two flushes
+FLUSH_ROWS = 256
+FLUSH_INTERVAL = 1.0
+# Rows of each HDF5 chunk
+CHUNK_ROWS = 256
+
+DTYPES = {
+    "number": np.float64,
+    "array": np.float64,
+    "integer": np.int64,
+    "boolean": np.bool_,
+    "string": h5py.string_dtype(),
+}
+# Value written when an event misses a data key
+FILL_VALUES = {
+    "number": np.nan,
+    "array": np.nan,
+    "integer": 0,
+    "boolean": False,
+    "string": "",
+}
+
+
+class StreamingNexusWriter:
+    """
+    Bluesky callback writing a scan to a NeXus file as its documents arrive.
+
+    The start document creates the file with an NXentry, the run metadata and an NXdata group. The
+    descriptors create one chunked, resizable dataset for each data key, externally stored data (area
+    detector images) is not written. With the first event the file switches to SWMR mode, then events
+    are kept in memory and appended every flush_rows events or flush_interval seconds, and the file is
+    flushed, so readers opening it with swmr=True see the scan grow. Keys missing in an event get the
+    FILL_VALUES of their dtype. The stop document writes the last rows and the end of the run and closes
+    the file.
+
+    Errors writing the file are printed and stop the writer, never the scan.
+    """
+
+    def __init__(
+        self,
+        file_name,
+        flush_rows=FLUSH_ROWS,
+        flush_interval=FLUSH_INTERVAL,
+        chunk_rows=CHUNK_ROWS,
+    ):
+        self.file_name = str(file_name)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.chunk_rows = chunk_rows
+        self.file = None
+        self.streams = {}
+        self.descriptors = {}
+        self.pending = {}
+        self.rows = {}
+        self.last_flush = time.monotonic()
+        self.skipped_descriptors = 0
+        self.failed = False
+
+    def __call__(self, name: str, doc: dict) -> None:
+        if self.failed:
+            return
+        try:
+            getattr(self, name, lambda doc: None)(doc)
+        except Exception:
+            self.failed = True
+            print("Stopped writing {}:".format(self.file_name))
+            traceback.print_exc()
+            self.close()
+
+    def start(self, doc):
+        self.file = h5py.File(self.file_name, "w", libver="latest")
+        self.file.attrs["NX_class"] = "NXroot"
+        self.file.attrs["default"] = "entry"
+        entry = self.file.create_group("entry")
+        entry.attrs["NX_class"] = "NXentry"
+        entry.attrs["default"] = "data"
+        entry.create_dataset("start_time", data=float(doc.get("time", time.time())))
+        entry.create_dataset("end_time", data=np.nan)
+        entry.create_dataset("exit_status", data="running".ljust(16).encode())
+        metadata = entry.create_group("metadata")
+        metadata.attrs["NX_class"] = "NXcollection"
+        for key, value in doc.items():
+            metadata.attrs[key] = (
+                value
+                if isinstance(value, (str, int, float, bool))
+                else json.dumps(value, default=str)
+            )
+        data = entry.create_group("data")
+        data.attrs["NX_class"] = "NXdata"
+        motors = list(doc.get("motors", []))
+        if motors:
+            data.attrs["axes"] = motors
+            for motor in motors:
+                data.attrs[motor + "_indices"] = [0]
+        if doc.get("main_counter"):
+            data.attrs["signal"] = doc["main_counter"]
+
+    def descriptor(self, doc):
+        if self.file is None:
+            return
+        if self.file.swmr_mode:
+            # SWMR files can not get new datasets
+            self.skipped_descriptors += 1
+            return
+        stream = doc.get("name", "primary")
+        group = self.file["entry/data"]
+        if stream != "primary":
+            group = self.file["entry"].require_group(stream)
+            group.attrs["NX_class"] = "NXcollection"
+        keys = {
+            key: info
+            for key, info in doc["data_keys"].items()
+            if not info.get("external")
+        }
+        for key, info in keys.items():
+            shape = tuple(info.get("shape") or ())
+            dtype = info.get("dtype")
+            group.create_dataset(
+                key,
+                shape=(0,) + shape,
+                maxshape=(None,) + shape,
+                chunks=(self.chunk_rows,) + shape,
+                dtype=DTYPES.get(dtype, np.float64),
+                fillvalue=FILL_VALUES.get(dtype, np.nan),
+            )
+        group.create_dataset(
+            "time",
+            shape=(0,),
+            maxshape=(None,),
+            chunks=(self.chunk_rows,),
+            dtype=np.float64,
+        )
+        self.descriptors[doc["uid"]] = stream
+        self.streams[stream] = (group, list(keys))
+        self.pending.setdefault(stream, [])
+        self.rows.setdefault(stream, 0)
+
+    def event(self, doc):
+        stream = self.descriptors.get(doc["descriptor"])
+        if stream is None:
+            return
+        if not self.file.swmr_mode:
+            self.file.swmr_mode = True
+        self.pending[stream].append(doc)
+        if (
+            len(self.pending[stream]) >= self.flush_rows
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def event_page(self, doc):
+        for i, seq_num in enumerate(doc["seq_num"]):
+            self.event(
+                {
+                    "descriptor": doc["descriptor"],
+                    "seq_num": seq_num,
+                    "time": doc["time"][i],
+                    "data": {key: values[i] for key, values in doc["data"].items()},
+                }
+            )
+
+    def flush(self) -> None:
+        """Append the events kept in memory and flush the file"""
+        if self.file is None:
+            return
+        for stream, events in self.pending.items():
+            if not events:
+                continue
+            group, keys = self.streams[stream]
+            start = self.rows[stream]
+            end = start + len(events)
+            for key in keys + ["time"]:
+                dataset = group[key]
+                dataset.resize(end, axis=0)
+                if key == "time":
+                    values = [event["time"] for event in events]
+                    dataset[start:end] = np.asarray(values, dtype=dataset.dtype)
+                    continue
+                values = np.full(
+                    (len(events),) + dataset.shape[1:],
+                    dataset.fillvalue,
+                    dtype=dataset.dtype,
+                )
+                for i, event in enumerate(events):
+                    if key in event["data"]:
+                        values[i] = event["data"][key]
+                dataset[start:end] = values
+            self.rows[stream] = end
+            self.pending[stream] = []
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def stop(self, doc):
+        if self.file is None:
+            return
+        self.flush()
+        entry = self.file["entry"]
+        entry["end_time"][()] = float(doc.get("time", time.time()))
+        entry["exit_status"][()] = (
+            str(doc.get("exit_status", "")).ljust(16)[:16].encode()
+        )
+        self.close()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
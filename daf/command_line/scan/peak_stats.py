@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""Peak statistics of the counters of a scan, updated event by event in bounded memory"""
+
+import math
+import time
+
+import numpy as np
+
+# Points of each counter kept to find the half maximum crossings, and min seconds between publications
+HISTORY_POINTS = 4096
+PUBLISH_INTERVAL = 0.5
+
+
+class CounterPeakStats:
+    """
+    Running max, min, centre of mass, centre and FWHM of one counter along x, as bluesky's PeakStats
+    computes them for BestEffortCallback.peaks.
+
+    The centre of mass is the first moment of the counter, kept as running sums. The centre and the FWHM
+    come from the crossings of the half maximum, halfway between the min and the max: the centre is their
+    mean and the FWHM the distance between the first and the last one. They are found in a history of at
+    most history_points points. When it is full every other point is dropped and from then on only one
+    of every two new points is kept, so longer scans get an estimate from evenly spaced points in
+    bounded memory.
+    """
+
+    def __init__(self, history_points=HISTORY_POINTS):
+        self.points = 0
+        self.origin = None
+        self.sum_y = self.sum_xy = 0.0
+        self.max = None
+        self.min = None
+        # Even, so halving it keeps every other point
+        self.history = np.empty((max(2, int(history_points) // 2 * 2), 2))
+        self.kept = 0
+        self.stride = 1
+
+    def update(self, x, y) -> None:
+        x, y = float(x), float(y)
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return
+        if self.origin is None:
+            # Sums are taken around the first x to keep their precision
+            self.origin = x
+        dx = x - self.origin
+        self.points += 1
+        self.sum_y += y
+        self.sum_xy += dx * y
+        if self.max is None or y > self.max[1]:
+            self.max = (x, y)
+        if self.min is None or y < self.min[1]:
+            self.min = (x, y)
+        self._remember(x, y)
+
+    def _remember(self, x, y) -> None:
+        """Keep the point in the history if it is one of every stride points"""
+        index = self.points - 1
+        if index % self.stride:
+            return
+        if self.kept == len(self.history):
+            self.kept = len(self.history) // 2
+            self.history[: self.kept] = self.history[::2].copy()
+            self.stride *= 2
+            if index % self.stride:
+                return
+        self.history[self.kept] = (x, y)
+        self.kept += 1
+
+    def crossings(self) -> np.ndarray:
+        """x where the counter crosses its half maximum, interpolated between the points of the history"""
+        if self.kept < 2:
+            return np.array([])
+        x, y = self.history[: self.kept].T
+        half_maximum = (self.max[1] + self.min[1]) / 2
+        index = np.nonzero(np.diff((y > half_maximum).astype(int)))[0]
+        x0, x1 = x[index], x[index + 1]
+        y0, y1 = y[index] - half_maximum, y[index + 1] - half_maximum
+        return x0 - y0 * (x1 - x0) / (y1 - y0)
+
+    @property
+    def com(self):
+        if self.points == 0 or self.sum_y == 0:
+            return None
+        return self.sum_xy / self.sum_y + self.origin
+
+    @property
+    def cen(self):
+        crossings = self.crossings()
+        return float(np.mean(crossings)) if len(crossings) else None
+
+    @property
+    def fwhm(self):
+        crossings = self.crossings()
+        return float(abs(crossings[-1] - crossings[0])) if len(crossings) > 1 else None
+
+    def stats(self) -> dict:
+        return {
+            "com": self.com,
+            "cen": self.cen,
+            "max": self.max,
+            "min": self.min,
+            "fwhm": self.fwhm,
+        }
+
+
+class OnlinePeakStats:
+    """
+    Bluesky callback with the peak statistics of every counter of a scan, replacing the ones of
+    BestEffortCallback without its plots and tables.
+
+    x is the main motor of the run (main_motor in the start document) or the sequence number when the
+    scan moves no motor. Every scalar number of the primary stream not read from a motor is a counter.
+    While the scan runs publish, if given, is called at most every interval seconds and once more at the
+    end, with the statistics of each counter, a dict such as
+    {"com": ..., "cen": ..., "max": (x, y), "min": (x, y), "fwhm": ...}.
+    """
+
+    def __init__(self, publish=None, interval=PUBLISH_INTERVAL):
+        self.publish = publish
+        self.interval = interval
+        self.last_publish = None
+        self.x_key = None
+        self.motors = ()
+        self.counters = {}
+        self.primary = set()
+        self.events = 0
+
+    def __call__(self, name: str, doc: dict) -> None:
+        getattr(self, name, lambda doc: None)(doc)
+
+    def start(self, doc):
+        self.motors = tuple(doc.get("motors") or ())
+        self.x_key = doc.get("main_motor") or (self.motors[0] if self.motors else None)
+        self.counters = {}
+        self.primary = set()
+        self.events = 0
+        self.last_publish = None
+
+    def descriptor(self, doc):
+        if doc.get("name", "primary") != "primary":
+            return
+        self.primary.add(doc["uid"])
+        for key, info in doc["data_keys"].items():
+            if (
+                key == self.x_key
+                or key in self.motors
+                or info.get("object_name") in self.motors
+                or info.get("external")
+                or info.get("shape")
+                or info.get("dtype") not in ("number", "integer")
+            ):
+                continue
+            self.counters.setdefault(key, CounterPeakStats())
+
+    def event(self, doc):
+        if doc["descriptor"] not in self.primary:
+            return
+        self.events += 1
+        data = doc["data"]
+        x = doc["seq_num"] if self.x_key is None else data.get(self.x_key)
+        if x is None:
+            return
+        for key, stats in self.counters.items():
+            if key in data:
+                stats.update(x, data[key])
+        now = time.monotonic()
+        if self.publish is not None and (
+            self.last_publish is None or now - self.last_publish >= self.interval
+        ):
+            self.last_publish = now
+            self.publish(self.stats())
+
+    def event_page(self, doc):
+        for i, seq_num in enumerate(doc["seq_num"]):
+            self.event(
+                {
+                    "descriptor": doc["descriptor"],
+                    "seq_num": seq_num,
+                    "data": {key: values[i] for key, values in doc["data"].items()},
+                }
+            )
+
+    def stop(self, doc):
+        if self.publish is not None and self.events:
+            self.publish(self.stats())
+
+    def stats(self) -> dict:
+        """Statistics of each counter"""
+        return {key: stats.stats() for key, stats in self.counters.items()}
+
+    @property
+    def peaks(self) -> dict:
+        """Statistics grouped as BestEffortCallback.peaks: {"com": {counter: value}, "max": ...}"""
+        counters = self.stats()
+        return {
+            key: {counter: stats[key] for counter, stats in counters.items()}
+            for key in ("com", "cen", "max", "min", "fwhm")
+        }
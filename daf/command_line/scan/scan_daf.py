@@ -1,27 +1,200 @@
 import os
 import functools
+import threading
+import time
 from dataclasses import dataclass
 
-from kafka import KafkaProducer
-import msgpack
-
 from apstools.callbacks import NXWriter
 import apstools.utils as au
 
 import databroker
 from bluesky import RunEngine
 
-from bluesky.plans import count, scan, rel_scan, list_scan, grid_scan
+from bluesky.plans import count, scan, rel_scan, list_scan, grid_scan, fly
+import bluesky.plan_stubs as bps
+import bluesky.preprocessors as bpp
 from ophyd import EpicsMotor, EpicsSignalRO
+from ophyd.status import Status
 from lnls_ophyd.area_detectors.pilatus_300k import Pilatus, Pilatus6ROIs
-from bluesky.callbacks.best_effort import BestEffortCallback
-from bluesky.utils import ProgressBarManager
 
+from daf.core.fly_scan import FLY_PERIOD, FlyMotion
+from daf.core.scan_duration import (
+    estimate_scan_duration,
+    motor_kinematics,
+    plan_points,
+)
 from daf.utils import dafutilities as du
 from daf.utils.utils import create_unique_file_name
+from .document_publisher import DocumentPublisher
+from .nexus_stream import StreamingNexusWriter
+from .peak_stats import OnlinePeakStats
+from .time_buffer import DecimatedPublisher
 from .signal_handler import DAFSigIntHandler
 
 
+def stream_list_scan(detectors, motors, points, num_points=None, md=None):
+    """
+    list_scan that takes the points lazily. points is an iterable of positions, one value per
+    motor in each of them, that is consumed one point at a time while the scan runs.
+    """
+    motor_names = [motor.name for motor in motors]
+    _md = {
+        "detectors": [detector.name for detector in detectors],
+        "motors": motor_names,
+        "num_points": num_points,
+        "plan_name": "stream_list_scan",
+        "hints": {
+            "dimensions": [(motor.hints["fields"], "primary") for motor in motors]
+        },
+    }
+    _md.update(md or {})
+    pos_cache = {motor: None for motor in motors}
+
+    @bpp.stage_decorator(list(detectors) + list(motors))
+    @bpp.run_decorator(md=_md)
+    def inner_stream_list_scan():
+        for point in points:
+            step = dict(zip(motors, point))
+            yield from bps.one_nd_step(detectors, step, pos_cache)
+
+    return (yield from inner_stream_list_scan())
+
+
+class DAFFlyer:
+    """
+    Ophyd flyer running a daf.core.fly_scan.FlyMotion. kickoff moves the motor to the start and starts
+    the continuous motion, complete waits for the end of it, and collect gives one event for each bin.
+    stop, called when the scan ends or is aborted, stops the motion and restores the motor speed
+    """
+
+    def __init__(self, motion, name="daf_flyer"):
+        self.motion = motion
+        self.name = name
+        self.parent = None
+        self.move_status = None
+        self.stopped = False
+        # A stop waits for a kickoff already moving the motor to the start
+        self.lock = threading.Lock()
+
+    def _run_in_thread(self, function):
+        """Run function in a thread, return a status finished when it returns"""
+        status = Status(obj=self)
+
+        def run():
+            try:
+                function()
+            except Exception as exception:
+                status.set_exception(exception)
+            else:
+                status.set_finished()
+
+        threading.Thread(target=run, daemon=True).start()
+        return status
+
+    def kickoff(self):
+        def start():
+            with self.lock:
+                if self.stopped:
+                    raise RuntimeError("The fly scan was stopped")
+                self.motion.prepare()
+                self.move_status = self.motion.start()
+
+        return self._run_in_thread(start)
+
+    def complete(self):
+        def wait():
+            try:
+                self.move_status.wait()
+            finally:
+                with self.lock:
+                    self.motion.finish()
+
+        return self._run_in_thread(wait)
+
+    def stop(self, *, success=False):
+        with self.lock:
+            self.stopped = True
+            if self.move_status is not None and not self.move_status.done:
+                self.motion.motor.stop(success=success)
+            self.motion.finish()
+
+    def _configuration(self) -> dict:
+        return {
+            self.name + "_velocity": self.motion.velocity,
+            self.name + "_period": self.motion.sampler.period,
+        }
+
+    def describe_configuration(self):
+        return {
+            key: {"source": "daf.fly_scan", "dtype": "number", "shape": []}
+            for key in self._configuration()
+        }
+
+    def read_configuration(self):
+        now = time.time()
+        return {
+            key: {"value": value, "timestamp": now}
+            for key, value in self._configuration().items()
+        }
+
+    def describe_collect(self):
+        return {
+            "primary": {
+                key: {"source": key, "dtype": "number", "shape": []}
+                for key in self.motion.data_keys()
+            }
+        }
+
+    def collect(self):
+        centres, means, _ = self.motion.bins()
+        now = time.time()
+        for i, centre in enumerate(centres):
+            data = {self.motion.motor.name: float(centre)}
+            data.update({name: float(values[i]) for name, values in means.items()})
+            yield {
+                "time": now,
+                "data": data,
+                "timestamps": {key: now for key in data},
+            }
+
+
+def fly_scan(
+    detectors,
+    motor,
+    start,
+    end,
+    num,
+    duration,
+    period=FLY_PERIOD,
+    monitor=False,
+    md=None,
+):
+    """
+    Move motor from start to end at constant speed in duration seconds, reading detectors every period
+    seconds, or on every change with monitor, and average their readings in num bins along the path.
+    """
+    _md = {
+        "detectors": [detector.name for detector in detectors],
+        "motors": [motor.name],
+        "num_points": num,
+        "plan_name": "fly_scan",
+        "plan_args": {
+            "start": start,
+            "end": end,
+            "num": num,
+            "duration": duration,
+            "period": period,
+            "monitor": monitor,
+        },
+        "hints": {"dimensions": [(motor.hints["fields"], "primary")]},
+    }
+    _md.update(md or {})
+    motion = FlyMotion(motor, detectors, start, end, num, duration, period, monitor)
+    flyer = DAFFlyer(motion)
+    # The RunEngine only stops what it moved itself, the flyer moves the motor
+    return (yield from bpp.finalize_wrapper(fly([flyer], md=_md), bps.stop(flyer)))
+
+
 @dataclass
 class DAFScanInputs:
     scan_data: dict = None
@@ -36,6 +209,49 @@ class DAFScanInputs:
     output: str = None
     kafka_topic: str = None
     scan_db: str = None
+    # Transport of the documents sent to kafka_topic, a KafkaTransport if None, see document_publisher
+    document_transport: object = None
+    # Show the BestEffortCallback plots and tables, None to show them only when there is a display
+    live_plots: bool = None
+    # Seconds lost in each point besides motion and acquisition, measured by the previous scans
+    point_overhead: float = 0.0
+    # Write the NeXus file while the scan runs, see nexus_stream, instead of exporting it with NXWriter
+    # from the databroker when it ends. Time scans with a ring buffer always stream it
+    stream_nexus: bool = False
+
+
+class DAFScanSession:
+    """
+    RunEngine, databrokers, document publishers and ophyd devices of a process, created when first used
+    and reused by every scan run with the session. daf.queue runs all its scans in one session, other
+    scans create their own and close it when they end.
+    """
+
+    def __init__(self, document_transport=None):
+        self.RE = RunEngine(context_managers=[DAFSigIntHandler])
+        self.document_transport = document_transport
+        self.objects = {}
+
+    def cached(self, key, factory):
+        """The object stored with key, built by calling factory the first time"""
+        if key not in self.objects:
+            self.objects[key] = factory()
+        return self.objects[key]
+
+    def databroker(self, name):
+        return self.cached(("databroker", name), lambda: databroker.Broker.named(name))
+
+    def publisher(self, topic) -> DocumentPublisher:
+        return self.cached(
+            ("publisher", topic),
+            lambda: DocumentPublisher(topic, self.document_transport),
+        )
+
+    def close(self) -> None:
+        """Send the documents still queued in the publishers"""
+        for key, value in self.objects.items():
+            if key[0] == "publisher":
+                value.close()
 
 
 class DAFScan:
@@ -44,7 +260,9 @@ class DAFScan:
         "absolute": scan,
         "relative": rel_scan,
         "list_scan": list_scan,
+        "stream_list_scan": stream_list_scan,
         "grid_scan": grid_scan,
+        "fly_scan": fly_scan,
         "count": None,
     }
 
@@ -54,7 +272,12 @@ class DAFScan:
         "pilatus6ROIs": Pilatus6ROIs,
     }
 
-    def __init__(self, daf_scan_inputs: DAFScanInputs) -> None:
+    def __init__(
+        self,
+        daf_scan_inputs: DAFScanInputs,
+        dry_run: bool = False,
+        session: DAFScanSession = None,
+    ) -> None:
         self.scan_data = daf_scan_inputs.scan_data
         self.motors = daf_scan_inputs.inputed_motors
         self.motors_data_dict = daf_scan_inputs.motors_data_dict
@@ -71,16 +294,39 @@ class DAFScan:
         self.output = create_unique_file_name(daf_scan_inputs.output)
         self.kafka_topic = daf_scan_inputs.kafka_topic
         self.scan_db = daf_scan_inputs.scan_db
-        self.PLANS_MAP["count"] = functools.partial(
-            count, num=int(1e6), delay=self.acquisition_time
-        )  # gambiarra pro count
-        self.configure_run_engine()
-        self.producer = KafkaProducer()
+        self.document_transport = daf_scan_inputs.document_transport
+        self.point_overhead = daf_scan_inputs.point_overhead or 0.0
+        self.duration_estimate = None
+        # Time scans with a ring buffer run until stopped, in bounded memory
+        self.ring_buffer = self.scan_type == "count" and bool(
+            (self.scan_data or {}).get("buffer")
+        )
+        # Exporting from the databroker at the end would load every count of the scan in memory
+        self.stream_nexus = daf_scan_inputs.stream_nexus or self.ring_buffer
+        self.live_plots = (
+            bool(os.environ.get("DISPLAY"))
+            if daf_scan_inputs.live_plots is None
+            else daf_scan_inputs.live_plots
+        ) and not self.ring_buffer
+        # The count plan depends on the scan, scans of the same process must not share it
+        self.plans = dict(
+            self.PLANS_MAP,
+            count=functools.partial(
+                count,
+                num=None if self.ring_buffer else int(1e6),
+                delay=self.acquisition_time,
+            ),
+        )
+        self.session = session
+        self.owns_session = session is None
+        if not dry_run:
+            if self.owns_session:
+                self.session = DAFScanSession(self.document_transport)
+            self.configure_run_engine()
 
     def configure_run_engine(self):
-        """Instantiate RunEngine and subscribe the needed callbacks"""
-        self.RE = RunEngine(context_managers=[DAFSigIntHandler])
-        # self.RE.waiting_hook = ProgressBarManager()
+        """Get the RunEngine of the session and subscribe the needed callbacks"""
+        self.RE = self.session.RE
         self.instantiate_callbacks()
         self.subscribe_callbacks()
 
@@ -99,9 +345,12 @@ class DAFScan:
     def instantiate_callbacks(self):
         """Instantiate all callbacks and store then in a dict"""
         self.callbacks = {}
-        self.callbacks["bec"] = BestEffortCallback()
-        # self.callbacks["nexus"] = self.nexus_callback()
-        self.callbacks["kafka"] = self.kafka_callback
+        self.callbacks["stats"] = self.stats_callback()
+        if self.live_plots:
+            self.callbacks["bec"] = self.bec_callback()
+        if self.stream_nexus:
+            self.callbacks["nexus"] = self.nexus_callback()
+        self.callbacks["kafka"] = self.kafka_callback()
         self.callbacks["db"] = self.config_databroker()
         # self.callbacks["debug"] = self.debug_callback
 
@@ -111,60 +360,137 @@ class DAFScan:
         for callback_name, callback in self.callbacks.items():
             self.callback_tokens[callback_name] = self.RE.subscribe(callback)
 
+    def unsubscribe_callbacks(self):
+        """Unsubscribe the callbacks of this scan, the RunEngine may run other scans"""
+        for token in self.callback_tokens.values():
+            self.RE.unsubscribe(token)
+        self.callback_tokens = {}
+
     def config_databroker(self):
         """Databroker to write"""
-        self.db = databroker.Broker.named(self.scan_db)
+        self.db = self.session.databroker(self.scan_db)
         return self.db.insert
 
     def debug_callback(self, name: str, doc: dict):
         """Callback for debug only, too much verbose"""
         print(name, doc)
 
+    @staticmethod
+    def bec_callback():
+        """Plots and tables of the scan, imported only when used"""
+        from bluesky.callbacks.best_effort import BestEffortCallback
+
+        bec = BestEffortCallback()
+        # Peak statistics come from OnlinePeakStats
+        bec.disable_peaks()
+        return bec
+
     def nexus_callback(self):
-        """Callback to write NeXus files right after the plan is executed"""
-        nxwriter = NXWriter()
-        nxwriter.file_name = self.output
-        nxwriter.warn_on_missing_content = False
-        return nxwriter.receiver
+        """Callback writing the NeXus file while the scan runs, see nexus_stream"""
+        return StreamingNexusWriter(self.output)
 
     def nexus_export(self, scan_hash: str):
+        """Write the NeXus file of a finished scan from the databroker, with the apstools layout"""
         nxwriter = NXWriter()
         nxwriter.file_name = self.output
         nxwriter.warn_on_missing_content = False
         au.replay(self.db[scan_hash], nxwriter.receiver)
 
-    def kafka_callback(self, name: str, doc: dict):
-        """Callback to stream Bluesky Documents via Kafka"""
-        self.producer = KafkaProducer(value_serializer=msgpack.dumps)
-        self.producer.send(self.kafka_topic, (name, doc))
+    def stats_callback(self):
+        """Peak statistics of the scan, sent while it runs to the peak_stats topic of kafka_topic"""
+        publisher = self.session.publisher(self.kafka_topic)
+        topic = "{}_peak_stats".format(self.kafka_topic)
+        return OnlinePeakStats(
+            publish=lambda stats: publisher("peak_stats", stats, topic=topic)
+        )
+
+    def kafka_callback(self):
+        """Callback to stream Bluesky Documents via Kafka, with one producer for the whole scan"""
+        self.publisher = self.session.publisher(self.kafka_topic)
+        if self.ring_buffer:
+            # Live consumers only get the decimated counts, the NeXus file keeps every one
+            self.time_buffer = DecimatedPublisher(
+                self.publisher,
+                capacity=self.scan_data["buffer"],
+                window=self.scan_data.get("window", 1),
+            )
+            return self.time_buffer
+        return self.publisher
 
     def configure_scan(self):
         """Build motors, counters and the plan"""
         self.build_ophyd_motors()
         self.build_counters()
         bluesky_plan_args = self.build_scan_args()
+        if self.scan_type in ("absolute", "relative", "list_scan", "grid_scan"):
+            # Compared with the real duration to measure the overhead of each point
+            self.duration_estimate = self.plan_duration(bluesky_plan_args)
         return self.get_plan(bluesky_plan_args)
 
+    def plan_duration(self, bluesky_plan_args: list) -> dict:
+        """Estimated duration of the plan built with bluesky_plan_args, see scan_duration"""
+        # Time scans have no motors
+        motors_data_dict = self.motors_data_dict or {}
+        positions = {motor: info["value"] for motor, info in motors_data_dict.items()}
+        kinematics = {
+            motor: motor_kinematics(info) for motor, info in motors_data_dict.items()
+        }
+        if self.scan_type == "fly_scan":
+            motor, start, end, steps, duration = bluesky_plan_args[:5]
+            motor = getattr(motor, "name", motor)
+            estimate = estimate_scan_duration(
+                [[start]], [motor], kinematics, duration, start=[positions[motor]]
+            )
+            estimate["points"] = steps
+            return estimate
+        motors, points = plan_points(self.scan_type, bluesky_plan_args, positions)
+        return estimate_scan_duration(
+            points,
+            motors,
+            kinematics,
+            self.acquisition_time + (self.delay_time or 0),
+            self.point_overhead,
+            start=[positions[motor] for motor in motors],
+        )
+
+    def estimate_duration(self) -> dict:
+        """Estimated duration of the scan, from the same plan arguments but without connecting to anything"""
+        # Motor names stand for the ophyd motors in the plan arguments
+        self.ophyd_motors = {motor: motor for motor in self.motors}
+        return self.plan_duration(self.build_scan_args())
+
+    @staticmethod
+    def connected_motor(pv: str, name: str) -> EpicsMotor:
+        motor = EpicsMotor(pv, name=name)
+        motor.wait_for_connection(timeout=10)
+        return motor
+
     def build_ophyd_motors(self):
-        """Build ophyd motors used in the scan"""
+        """Build ophyd motors used in the scan, or get the ones the session already connected"""
         self.ophyd_motors = {}
         for motor in self.motors:
-            self.ophyd_motors[motor] = EpicsMotor(
-                self.motors_data_dict[motor]["pv"], name=motor
+            pv = self.motors_data_dict[motor]["pv"]
+            self.ophyd_motors[motor] = self.session.cached(
+                ("motor", motor, pv),
+                functools.partial(self.connected_motor, pv, motor),
             )
-            self.ophyd_motors[motor].wait_for_connection(timeout=10)
 
     def build_counters(self):
-        """Build counters used in the scan based in the configuration file"""
+        """Build counters used in the scan based in the configuration file, or get them from the session"""
         self.ophyd_counters = {}
         for counter, counter_info in self.counters.items():
+            counter_class = self.COUNTERS_MAP[counter_info["class"]]
             if counter_info["type"] == "AD":
                 path_to_write = os.path.dirname(self.output)
-                self.ophyd_counters[counter] = self.COUNTERS_MAP[counter_info["class"]](
-                    counter_info["pv"],
-                    name=counter,
-                    write_path=path_to_write,
-                    read_attrs=["hdf5"],
+                self.ophyd_counters[counter] = self.session.cached(
+                    ("counter", counter, counter_info["pv"], path_to_write),
+                    functools.partial(
+                        counter_class,
+                        counter_info["pv"],
+                        name=counter,
+                        write_path=path_to_write,
+                        read_attrs=["hdf5"],
+                    ),
                 )
                 self.ophyd_counters[counter].cam.acquire_period.put(
                     self.acquisition_time
@@ -172,12 +498,30 @@ class DAFScan:
                 self.ophyd_counters[counter].cam.acquire_time.put(self.acquisition_time)
                 self.ophyd_counters[counter].cam.num_images.put(1)
                 continue
-            self.ophyd_counters[counter] = self.COUNTERS_MAP[counter_info["class"]](
-                counter_info["pv"], name=counter
+            self.ophyd_counters[counter] = self.session.cached(
+                ("counter", counter, counter_info["pv"]),
+                functools.partial(counter_class, counter_info["pv"], name=counter),
             )
 
     def build_scan_args(self):
         """Build the points and motors inputed to the plan. This method can be overriden by the calling class"""
+        if self.scan_type == "fly_scan":
+            motor = self.motors[0]
+            return [
+                self.ophyd_motors[motor],
+                self.scan_data["start"],
+                self.scan_data["end"],
+                self.steps,
+                self.steps * self.acquisition_time,
+                self.scan_data["period"],
+                self.scan_data["monitor"],
+            ]
+        if self.scan_type == "stream_list_scan":
+            return [
+                [self.ophyd_motors[motor] for motor in self.motors],
+                self.scan_data["points"],
+                self.scan_data["num_points"],
+            ]
         movables = []
         for motor_name, ophyd_motor in self.ophyd_motors.items():
             movables.append(ophyd_motor)
@@ -189,9 +533,15 @@ class DAFScan:
 
     def get_plan(self, bluesky_plan_args: list):
         """Get the plan that's going to be used based in the scan_type argument"""
-        return self.PLANS_MAP[self.scan_type](
-            [*self.ophyd_counters.values()], *bluesky_plan_args
-        )
+        counters = self.ophyd_counters
+        if self.scan_type == "fly_scan":
+            # Area detectors can not be sampled during the motion
+            counters = {
+                name: counter
+                for name, counter in counters.items()
+                if self.counters[name]["type"] != "AD"
+            }
+        return self.plans[self.scan_type]([*counters.values()], *bluesky_plan_args)
 
     @staticmethod
     def convert_to_float_if_not_none(val: "float or tuple"):
@@ -206,39 +556,54 @@ class DAFScan:
             if val is not None:
                 return float(val)
 
-    def write_stats(self):
-        self.io = du.DAFIO(read=False)
-        self.experiment_file_dict = self.io.read()
-        stats = ("com", "cen", "max", "min", "fwhm")
-        stat_dict = {}
-        # print(self.callbacks["bec"].peaks)
-        for key in stats:
-            stat_dict[key] = {}
-            for counter_name, stats in self.callbacks["bec"].peaks[key].items():
-                stat_dict[key][counter_name] = self.convert_to_float_if_not_none(stats)
-        # for counter, counter_info in self.counters.items():
-        #     if counter_info["type"] == "AD":
-        #         continue
-        #     stat_dict[counter] = {}
-        #     stat_dict[counter]["peak"] = self.convert_to_float_if_not_none(
-        #         self.callbacks["bec"].peaks["max"][counter][1]
-        #     )
-        #     stat_dict[counter]["peak_at"] = self.convert_to_float_if_not_none(
-        #         self.callbacks["bec"].peaks["max"][counter][0]
-        #     )
-        #     stat_dict[counter]["FWHM"] = self.convert_to_float_if_not_none(
-        #         self.callbacks["bec"].peaks["fwhm"][counter]
-        #     )
-        #     # stat_dict[counter]["FWHM_at"] = self.callbacks["bec"].peaks["fwhm"][counter][0]
-        #     stat_dict[counter]["COM"] = self.convert_to_float_if_not_none(
-        #         self.callbacks["bec"].peaks["com"][counter]
-        #     )
-        self.experiment_file_dict["scan_stats"] = stat_dict
-        self.io.write(self.experiment_file_dict)
+    def measured_point_overhead(self, elapsed: float):
+        """
+        Seconds lost in each point of a complete scan that lasted elapsed, besides the estimated motion
+        and acquisition, averaged with the previous measurement. None if it can not be measured.
+        """
+        estimate = self.duration_estimate
+        if estimate is None or self.callbacks["stats"].events != estimate["points"]:
+            return None
+        measured = max(
+            0.0,
+            (elapsed - estimate["motion"] - estimate["acquisition"])
+            / estimate["points"],
+        )
+        if self.point_overhead:
+            return (self.point_overhead + measured) / 2
+        return measured
+
+    def write_stats(self, point_overhead=None):
+        """Write the peak statistics of the scan to scan_stats in the experiment file"""
+        stat_dict = {
+            key: {
+                counter_name: self.convert_to_float_if_not_none(value)
+                for counter_name, value in values.items()
+            }
+            for key, values in self.callbacks["stats"].peaks.items()
+        }
+        to_update = {"scan_stats": stat_dict}
+        if point_overhead is not None:
+            to_update["scan_point_overhead"] = float(point_overhead)
+        du.DAFIO.update(to_update)
 
     def run(self):
         """Run the scan and export to a NeXus file"""
         md = self.configure_metadata()
-        scan_hash = self.RE(self.configure_scan(), **md)
-        self.nexus_export(scan_hash)
-        self.write_stats()
+        try:
+            # Motors and counters that fail to connect must not leave the callbacks subscribed
+            plan = self.configure_scan()
+            started = time.monotonic()
+            scan_hash = self.RE(plan, **md)
+        finally:
+            if self.stream_nexus:
+                self.callbacks["nexus"].close()
+            self.unsubscribe_callbacks()
+            if self.owns_session:
+                self.session.close()
+            else:
+                self.publisher.flush()
+        overhead = self.measured_point_overhead(time.monotonic() - started)
+        if not self.stream_nexus:
+            self.nexus_export(scan_hash)
+        self.write_stats(overhead)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import importlib
+import shlex
+import subprocess
+import sys
+import time
+
+from daf.utils.decorators import cli_decorator
+from daf.command_line.cli_base_utils import CLIBase
+from daf.command_line.scan.daf_scan_utils import ScanBase
+import daf.command_line.scan.scan_daf as sd
+
+# Commands run inside the queue process and the daf.command_line.scan module of their main
+SCAN_COMMANDS = {
+    "daf.ascan": "a1scan",
+    "daf.a2scan": "a2scan",
+    "daf.a3scan": "a3scan",
+    "daf.a4scan": "a4scan",
+    "daf.a5scan": "a5scan",
+    "daf.a6scan": "a6scan",
+    "daf.lup": "d1scan",
+    "daf.dscan": "d1scan",
+    "daf.d2scan": "d2scan",
+    "daf.d3scan": "d3scan",
+    "daf.d4scan": "d4scan",
+    "daf.d5scan": "d5scan",
+    "daf.d6scan": "d6scan",
+    "daf.ffscan": "from_file_scan",
+    "daf.scan": "hkl_scan",
+    "daf.mesh": "mesh_scan",
+    "daf.hklmesh": "hkl_mesh_scan",
+    "daf.tscan": "time_scan",
+    "daf.fscan": "fly_scan",
+}
+
+
+def read_queue(file_path: str) -> list:
+    """Commands of a queue file as lists of arguments, without empty lines and # comments"""
+    with open(file_path) as file:
+        commands = [shlex.split(line, comments=True) for line in file]
+    return [command for command in commands if command]
+
+
+class ScanQueue(CLIBase):
+
+    DESC = """Run the DAF commands of a file one after the other. Scans run in this process and share one RunEngine, the connected motors and counters, the databroker and the Kafka producer"""
+    EPI = """
+    Eg:
+        daf.queue my_scans.txt
+        daf.queue my_scans.txt --keep_going
+        daf.queue my_scans.txt --dry_run
+
+    Each line of the file is a DAF command as typed in the shell, # starts a comment:
+        daf.mv -m 10
+        daf.ascan -e 10 20 100 .1
+        daf.scan 1 1 1 1 1 1.1 100 .1  # HKL scan
+
+    Commands that are not scans run in their own process. Ctrl+C pauses the running scan as in any
+    other scan.
+        """
+
+    def __init__(self):
+        self.parsed_args = self.parse_command_line()
+        self.parsed_args_dict = vars(self.parsed_args)
+
+    def parse_command_line(self):
+        super().parse_command_line()
+        self.parser.add_argument(
+            "file",
+            metavar="file",
+            type=str,
+            help="File with one DAF command per line",
+        )
+        self.parser.add_argument(
+            "-k",
+            "--keep_going",
+            action="store_true",
+            help="Keep running the next commands when one of them fails",
+        )
+        self.parser.add_argument(
+            "--dry_run",
+            action="store_true",
+            help="Only print how long each scan would take, other commands are not run",
+        )
+        args = self.parser.parse_args()
+        return args
+
+    @staticmethod
+    def run_scan_command(command: list) -> None:
+        """Run the main of a scan command in this process, with command as its sys.argv"""
+        module = importlib.import_module(
+            "daf.command_line.scan." + SCAN_COMMANDS[command[0]]
+        )
+        argv = sys.argv
+        sys.argv = list(command)
+        try:
+            module.main()
+        finally:
+            sys.argv = argv
+
+    def run_command(self, command: list) -> bool:
+        """Run a command of the queue, return if it succeeded"""
+        is_scan = command[0] in SCAN_COMMANDS
+        if self.parsed_args_dict["dry_run"]:
+            if not is_scan:
+                print("Not run in a dry run")
+                return True
+            command = command + ["--dry_run"]
+        try:
+            if not is_scan:
+                return subprocess.run(command).returncode == 0
+            self.run_scan_command(command)
+        except SystemExit as exit_request:
+            # Wrong arguments, argparse exits
+            return not exit_request.code
+        except Exception as exception:
+            print("{}: {}".format(type(exception).__name__, exception))
+            return False
+        return True
+
+    def run_cmd(self) -> None:
+        commands = read_queue(self.parsed_args_dict["file"])
+        if not self.parsed_args_dict["dry_run"]:
+            ScanBase.session = sd.DAFScanSession()
+        started = time.monotonic()
+        ran = failed = 0
+        try:
+            for i, command in enumerate(commands, start=1):
+                print("[{}/{}] {}".format(i, len(commands), shlex.join(command)))
+                ran += 1
+                if self.run_command(command):
+                    continue
+                failed += 1
+                if not self.parsed_args_dict["keep_going"]:
+                    print("Queue stopped, use --keep_going to run the next commands")
+                    break
+        finally:
+            if ScanBase.session is not None:
+                ScanBase.session.close()
+                ScanBase.session = None
+        print(
+            "{} of {} commands run, {} failed, in {:.1f} s".format(
+                ran, len(commands), failed, time.monotonic() - started
+            )
+        )
+
+
+@cli_decorator
+def main() -> None:
+    obj = ScanQueue()
+    obj.run_cmd()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,10 @@ from bluesky.utils import SigintHandler
 
 
 class DAFSigIntHandler(SigintHandler):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+    def __init__(self, RE, *args, **kwargs):
+        super().__init__(RE, *args, **kwargs)
+        # Newer bluesky versions keep it only as _RE
+        self.RE = RE
         self.signals_map = {
             "r": self.RE.resume,
             "resume": self.RE.resume,
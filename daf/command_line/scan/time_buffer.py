@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Bounded memory for long time scans: a ring buffer of the last counts and decimated live documents"""
+
+import uuid
+
+import numpy as np
+
+# Points kept in memory and raw events reduced to one live event
+RING_CAPACITY = 10000
+DECIMATION_WINDOW = 10
+
+
+class RingBuffer:
+    """
+    The last capacity (time, counters) points of a scan, in a preallocated array.
+
+    Appending never allocates, once full the oldest point is overwritten.
+    """
+
+    def __init__(self, fields, capacity=RING_CAPACITY):
+        self.fields = list(fields)
+        self.capacity = max(1, int(capacity))
+        self.data = np.full((self.capacity, len(self.fields) + 1), np.nan)
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp, values: dict) -> None:
+        row = self.data[self.count % self.capacity]
+        row[0] = timestamp
+        row[1:] = [values.get(field, np.nan) for field in self.fields]
+        self.count += 1
+
+    def last(self, points=None) -> np.ndarray:
+        """The last points rows, all the buffer by default, oldest first. Columns are time and the fields"""
+        size = len(self) if points is None else min(int(points), len(self))
+        end = self.count % self.capacity
+        index = np.arange(end - size, end) % self.capacity
+        return self.data[index]
+
+    def decimate(self, bins, start=None, end=None, points=None) -> dict:
+        """
+        Reduce the last points points, all the buffer by default, with a time between start and end to
+        bins groups of consecutive points.
+
+        Return a dict with the mean time of each group as "time", and for each field the mean, min and
+        max of each group as field, field + "_min" and field + "_max". Missing values are ignored, a
+        field without values in a group gives NaN.
+        """
+        data = self.last(points)
+        inside = np.ones(len(data), dtype=bool)
+        if start is not None:
+            inside &= data[:, 0] >= start
+        if end is not None:
+            inside &= data[:, 0] <= end
+        data = data[inside]
+        bins = max(1, min(int(bins), len(data)))
+        if not len(data):
+            return {"time": np.array([])}
+        edges = np.linspace(0, len(data), bins + 1).astype(int)[:-1]
+        missing = np.isnan(data)
+        counts = np.add.reduceat(~missing, edges, axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = (
+                np.add.reduceat(np.where(missing, 0.0, data), edges, axis=0) / counts
+            )
+        minima = np.minimum.reduceat(np.where(missing, np.inf, data), edges, axis=0)
+        maxima = np.maximum.reduceat(np.where(missing, -np.inf, data), edges, axis=0)
+        minima[counts == 0] = np.nan
+        maxima[counts == 0] = np.nan
+        result = {"time": means[:, 0]}
+        for i, field in enumerate(self.fields, start=1):
+            result[field] = means[:, i]
+            result[field + "_min"] = minima[:, i]
+            result[field + "_max"] = maxima[:, i]
+        return result
+
+
+class DecimatedPublisher:
+    """
+    Bluesky callback between a time scan and a live consumer, callback, such as the DocumentPublisher
+    read by daf.live. The counters of the primary stream are kept in a RingBuffer and every window events
+    callback gets a single event, made by RingBuffer.decimate, with their mean time and the mean, min and
+    max of each counter (field, field_min and field_max), so the
+    consumer receives window times fewer events. Other documents go through unchanged.
+    """
+
+    def __init__(self, callback, capacity=RING_CAPACITY, window=DECIMATION_WINDOW):
+        self.callback = callback
+        self.capacity = capacity
+        self.window = max(1, int(window))
+        self.buffer = None
+        self.descriptor_uid = None
+        self.pending = 0
+        self.sent = 0
+
+    def __call__(self, name: str, doc: dict) -> None:
+        handler = getattr(self, name, None)
+        if handler is None:
+            self.callback(name, doc)
+        else:
+            handler(doc)
+
+    def start(self, doc):
+        self.buffer = None
+        self.descriptor_uid = None
+        self.pending = 0
+        self.sent = 0
+        self.callback("start", doc)
+
+    def descriptor(self, doc):
+        if doc.get("name", "primary") != "primary" or self.descriptor_uid is not None:
+            self.callback("descriptor", doc)
+            return
+        fields = [
+            key
+            for key, info in doc["data_keys"].items()
+            if info.get("dtype") in ("number", "integer")
+            and not info.get("shape")
+            and not info.get("external")
+        ]
+        data_keys = {}
+        for field in fields:
+            info = dict(doc["data_keys"][field], dtype="number")
+            data_keys[field] = info
+            data_keys[field + "_min"] = info
+            data_keys[field + "_max"] = info
+        self.buffer = RingBuffer(fields, self.capacity)
+        self.descriptor_uid = doc["uid"]
+        self.callback("descriptor", dict(doc, data_keys=data_keys))
+
+    def event(self, doc):
+        if doc["descriptor"] != self.descriptor_uid:
+            self.callback("event", doc)
+            return
+        self.buffer.append(doc["time"], doc["data"])
+        self.pending += 1
+        if self.pending >= self.window:
+            self.send_window()
+
+    def event_page(self, doc):
+        for i, seq_num in enumerate(doc["seq_num"]):
+            self.event(
+                {
+                    "descriptor": doc["descriptor"],
+                    "seq_num": seq_num,
+                    "time": doc["time"][i],
+                    "data": {key: values[i] for key, values in doc["data"].items()},
+                }
+            )
+
+    def send_window(self) -> None:
+        """Send the events not sent yet as one decimated event"""
+        if not self.pending:
+            return
+        window = self.buffer.decimate(1, points=self.pending)
+        self.pending = 0
+        self.sent += 1
+        data = {
+            key: float(values[0]) for key, values in window.items() if key != "time"
+        }
+        timestamp = float(window["time"][0])
+        self.callback(
+            "event",
+            {
+                "uid": str(uuid.uuid4()),
+                "descriptor": self.descriptor_uid,
+                "time": timestamp,
+                "seq_num": self.sent,
+                "data": data,
+                "timestamps": {key: timestamp for key in data},
+                "filled": {},
+            },
+        )
+
+    def stop(self, doc):
+        self.send_window()
+        num_events = dict(doc.get("num_events") or {})
+        if "primary" in num_events:
+            num_events["primary"] = self.sent
+        self.callback("stop", dict(doc, num_events=num_events))
@@ -3,6 +3,7 @@
 import signal
 
 from daf.utils.decorators import cli_decorator
+from daf.command_line.scan.time_buffer import DECIMATION_WINDOW, RING_CAPACITY
 from daf.command_line.cli_base_utils import CLIBase
 from daf.command_line.scan.daf_scan_utils import ScanBase
 
@@ -14,7 +15,10 @@ class TimeScan(ScanBase):
     Eg:
         daf.tscan .1
         daf.tscan .1 -d 1
+        daf.tscan .1 -b 10000 -w 50
 
+    With -b the scan runs until stopped keeping only the last counts in memory, every count is still
+    written to the output file and daf.live gets the mean, min and max of every window counts.
         """
 
     def __init__(self):
@@ -30,6 +34,27 @@ class TimeScan(ScanBase):
             help="Delay between each point in seconds",
             default=0,
         )
+        self.parser.add_argument(
+            "-b",
+            "--buffer",
+            metavar="points",
+            type=int,
+            nargs="?",
+            const=RING_CAPACITY,
+            help="Keep only the last points counts in memory (default is {} when no number is given)".format(
+                RING_CAPACITY
+            ),
+        )
+        self.parser.add_argument(
+            "-w",
+            "--window",
+            metavar="points",
+            type=int,
+            default=DECIMATION_WINDOW,
+            help="Counts reduced to each live point when using --buffer (default is {})".format(
+                DECIMATION_WINDOW
+            ),
+        )
         super().common_cli_scan_arguments(step=False)
 
         args = self.parser.parse_args()
@@ -45,6 +70,10 @@ class TimeScan(ScanBase):
             "output": self.parsed_args_dict["output"],
             "kafka_topic": self.experiment_file_dict["kafka_topic"],
             "scan_db": self.experiment_file_dict["scan_db"],
+            "scan_data": {
+                "buffer": self.parsed_args_dict["buffer"],
+                "window": self.parsed_args_dict["window"],
+            },
         }
 
     def run_cmd(self) -> None:
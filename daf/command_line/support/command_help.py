@@ -166,16 +166,31 @@ class CommandHelp(SupportBase):
                 ShellColors.CYAN, ShellColors.NO_COLOR
             )
         )
+        print(
+            "{}daf.hklmesh{} - Perform a mesh scan in reciprocal space, using a grid of HKL coordinates".format(
+                ShellColors.CYAN, ShellColors.NO_COLOR
+            )
+        )
         print(
             "{}daf.rfscan{} - Perform a scan in HKL coordinates by providing a csv file generated bydaf.scan".format(
                 ShellColors.CYAN, ShellColors.NO_COLOR
             )
         )
+        print(
+            "{}daf.fscan{} - Perform a fly scan, moving one of the diffractometer motors continuously".format(
+                ShellColors.CYAN, ShellColors.NO_COLOR
+            )
+        )
         print(
             "{}daf.tscan{} - Perform an infinite time scan for the configured counters".format(
                 ShellColors.CYAN, ShellColors.NO_COLOR
             )
         )
+        print(
+            "{}daf.queue{} - Run the DAF commands of a file, the scans sharing one RunEngine, motors and counters".format(
+                ShellColors.CYAN, ShellColors.NO_COLOR
+            )
+        )
         print(
             "{}daf.ascan{} - Perform an absolute scan in one of the diffractometer motors".format(
                 ShellColors.CYAN, ShellColors.NO_COLOR
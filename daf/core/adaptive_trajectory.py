@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""HKL line scans with a non-uniform step, refined where the motors move fast and merged where they barely move"""
+
+import numpy as np
+
+from daf.core.solver import solve
+
+# Bisections allowed for each of the initial intervals
+MAX_DEPTH = 8
+
+
+def motor_step(first, second) -> float:
+    """Largest motor displacement (degrees) between two solutions"""
+    return float(np.max(np.abs(np.asarray(second.angles) - np.asarray(first.angles))))
+
+
+def merge_small_steps(solutions, min_step) -> list:
+    """Drop the points whose removal leaves no motor step larger than min_step. The ends are always kept"""
+    if min_step <= 0 or len(solutions) < 3:
+        return list(solutions)
+    kept = [solutions[0]]
+    for i in range(1, len(solutions) - 1):
+        if motor_step(kept[-1], solutions[i + 1]) > min_step:
+            kept.append(solutions[i])
+    kept.append(solutions[-1])
+    return kept
+
+
+def adaptive_hkl_trajectory(
+    context,
+    hkli,
+    hklf,
+    points,
+    max_step,
+    min_step=0,
+    start=(0, 0, 0, 0, 0, 0),
+    max_err=1e-5,
+    max_depth=MAX_DEPTH,
+) -> list:
+    """
+    Solve the line from hkli to hklf starting with points uniform intervals. Every interval in which a
+    motor moves more than max_step degrees is bisected, up to max_depth times, and the points are then
+    merged while no motor moves more than min_step between the remaining ones. Every point warm-starts
+    from the previous one. Return the list of daf.core.solver.Solution of the trajectory.
+    """
+    hkli = np.asarray(hkli, dtype=float)
+    direction = np.asarray(hklf, dtype=float) - hkli
+    solutions = [solve(context, hkli, start, max_err=max_err)]
+    positions = [0.0]
+    # Positions along the line still to be solved, the next one at the end
+    pending = [(position, 0) for position in np.linspace(1, 0, int(points) + 1)[:-1]]
+    while pending:
+        position, depth = pending.pop()
+        solution = solve(
+            context,
+            hkli + position * direction,
+            solutions[-1].angles,
+            max_err=max_err,
+        )
+        if motor_step(solutions[-1], solution) > max_step and depth < max_depth:
+            pending.append((position, depth + 1))
+            pending.append(((positions[-1] + position) / 2, depth + 1))
+            continue
+        solutions.append(solution)
+        positions.append(position)
+    return merge_small_steps(solutions, min_step)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Closed-form solutions for the 4S+2D diffractometer, H. You, JAC, 1999, 32, 614-23"""
+
+import numpy as np
+
+# Same order and rotation axes as xu.experiment.QConversion(["x+", "z-", "y+", "z-"], ["x+", "z-"], [0, 1, 0])
+SAMPLE_MOTORS = ("Mu", "Eta", "Chi", "Phi")
+SAMPLE_AXES = {
+    "Mu": np.array([1.0, 0.0, 0.0]),
+    "Eta": np.array([0.0, 0.0, -1.0]),
+    "Chi": np.array([0.0, 1.0, 0.0]),
+    "Phi": np.array([0.0, 0.0, -1.0]),
+}
+MOTOR_ORDER = ("Mu", "Eta", "Chi", "Phi", "Nu", "Del")
+
+# MODE_COLUMNS values that fix a sample motor
+FIXED_SAMPLE_MOTOR = {1: "Eta", 2: "Mu", 3: "Chi", 4: "Phi"}
+DETECTOR_CONSTRAINTS = {1: "Del", 2: "Nu", 3: "qaz"}
+
+
+def rotation_matrix(axis, angle):
+    """Rotation matrix of angle (degrees) around a unit axis (Rodrigues formula)"""
+    theta = np.deg2rad(angle)
+    cross = np.array(
+        [
+            [0, -axis[2], axis[1]],
+            [axis[2], 0, -axis[0]],
+            [-axis[1], axis[0], 0],
+        ]
+    )
+    return (
+        np.identity(3) + np.sin(theta) * cross + (1 - np.cos(theta)) * cross.dot(cross)
+    )
+
+
+def solve_trig(a, b, c, tol=1e-10):
+    """Return all angles (degrees) that satisfy a*cos(x) + b*sin(x) = c"""
+    norm = np.hypot(a, b)
+    if norm < tol:
+        return []
+    ratio = c / norm
+    if abs(ratio) > 1:
+        if abs(ratio) - 1 > 1e-9:
+            return []
+        ratio = np.sign(ratio)
+    base = np.arctan2(b, a)
+    delta = np.arccos(ratio)
+    if delta < tol:
+        return [np.rad2deg(base)]
+    return [np.rad2deg(base + delta), np.rad2deg(base - delta)]
+
+
+def solve_projected_rotation(m, axis, a, target):
+    """Return all angles x that satisfy m . R(axis, x) a = target"""
+    a_par = axis.dot(a) * axis
+    return solve_trig(m.dot(a - a_par), m.dot(np.cross(axis, a)), target - m.dot(a_par))
+
+
+def rotation_angle(axis, c, q):
+    """Angle (degrees) of the rotation around axis that brings c to q"""
+    c_perp = c - axis.dot(c) * axis
+    q_perp = q - axis.dot(q) * axis
+    return np.rad2deg(
+        np.arctan2(axis.dot(np.cross(c_perp, q_perp)), c_perp.dot(q_perp))
+    )
+
+
+def sample_rotation(angles, motors):
+    """Product of the rotation matrices of the given sample motors, in the diffractometer order"""
+    result = np.identity(3)
+    for motor in motors:
+        result = result.dot(rotation_matrix(SAMPLE_AXES[motor], angles[motor]))
+    return result
+
+
+def q_lab_from_detector(nu, del_, k):
+    """Scattering vector in the laboratory frame for given detector angles"""
+    nu, del_ = np.deg2rad(nu), np.deg2rad(del_)
+    return k * np.array(
+        [np.sin(del_), np.cos(nu) * np.cos(del_) - 1, np.sin(nu) * np.cos(del_)]
+    )
+
+
+def detector_solutions(two_theta, constraint, value):
+    """Return all (nu, del) pairs that give two_theta and satisfy the detector constraint"""
+    cos_tt = np.cos(np.deg2rad(two_theta))
+    sin_tt = np.sin(np.deg2rad(two_theta))
+    if constraint == "Nu":
+        cos_del = cos_tt / np.cos(np.deg2rad(value))
+        if abs(cos_del) > 1:
+            return []
+        del_ = np.rad2deg(np.arccos(cos_del))
+        return [(value, del_), (value, -del_)]
+    if constraint == "Del":
+        cos_nu = cos_tt / np.cos(np.deg2rad(value))
+        if abs(cos_nu) > 1:
+            return []
+        nu = np.rad2deg(np.arccos(cos_nu))
+        return [(nu, value), (-nu, value)]
+    if constraint == "qaz":
+        qaz = np.deg2rad(value)
+        del_ = np.rad2deg(np.arcsin(sin_tt * np.sin(qaz)))
+        nu = np.rad2deg(np.arctan2(sin_tt * np.cos(qaz), cos_tt))
+        return [(nu, del_)]
+    return []
+
+
+def omega_solutions(known, omega, nu, del_):
+    """Solve the omega pseudo-angle equation for the missing angle between mu and eta"""
+    tt = np.rad2deg(np.arccos(np.cos(np.deg2rad(nu)) * np.cos(np.deg2rad(del_))))
+    theta = np.deg2rad(tt / 2)
+    qaz = np.arctan2(np.tan(np.deg2rad(del_)), np.sin(np.deg2rad(nu)))
+    sin_omega = np.sin(np.deg2rad(omega))
+    if "Mu" in known:
+        mu = np.deg2rad(known["Mu"])
+        # sin(omega) = sin(eta)*a + cos(eta)*b
+        a = np.sin(qaz) * np.cos(theta)
+        b = np.sin(mu) * np.cos(qaz) * np.cos(theta) - np.cos(mu) * np.sin(theta)
+        return "Eta", solve_trig(b, a, sin_omega)
+    if "Eta" in known:
+        eta = np.deg2rad(known["Eta"])
+        # sin(omega) - sin(eta)*sin(qaz)*cos(theta) = sin(mu)*a + cos(mu)*b
+        a = np.cos(eta) * np.cos(qaz) * np.cos(theta)
+        b = -np.cos(eta) * np.sin(theta)
+        return "Mu", solve_trig(
+            b, a, sin_omega - np.sin(eta) * np.sin(qaz) * np.cos(theta)
+        )
+    return None, []
+
+
+def two_sample_motor_solutions(v, q_lab, known):
+    """Solve R_mu R_eta R_chi R_phi v = q_lab when two of the sample angles are known"""
+    unknown = [motor for motor in SAMPLE_MOTORS if motor not in known]
+    if len(unknown) != 2:
+        return []
+    outer, inner = unknown
+    i, j = SAMPLE_MOTORS.index(outer), SAMPLE_MOTORS.index(inner)
+    left = sample_rotation(known, SAMPLE_MOTORS[:i])
+    middle = sample_rotation(known, SAMPLE_MOTORS[i + 1 : j])
+    right = sample_rotation(known, SAMPLE_MOTORS[j + 1 :])
+
+    q_prime = left.T.dot(q_lab)
+    a_prime = right.dot(v)
+    outer_axis = SAMPLE_AXES[outer]
+    inner_axis = SAMPLE_AXES[inner]
+
+    solutions = []
+    for inner_angle in solve_projected_rotation(
+        middle.T.dot(outer_axis), inner_axis, a_prime, outer_axis.dot(q_prime)
+    ):
+        c = middle.dot(rotation_matrix(inner_axis, inner_angle)).dot(a_prime)
+        solution = dict(known)
+        solution[inner] = inner_angle
+        solution[outer] = rotation_angle(outer_axis, c, q_prime)
+        solutions.append(solution)
+    return solutions
+
+
+def three_sample_motor_solutions(v, k, two_theta, known):
+    """Solve the sample and detector angles when three of the sample angles are known"""
+    unknown = [motor for motor in SAMPLE_MOTORS if motor not in known]
+    if len(unknown) != 1:
+        return []
+    motor = unknown[0]
+    i = SAMPLE_MOTORS.index(motor)
+    left = sample_rotation(known, SAMPLE_MOTORS[:i])
+    right = sample_rotation(known, SAMPLE_MOTORS[i + 1 :])
+    axis = SAMPLE_AXES[motor]
+    # Every reachable Q lies on the Ewald sphere: Q_y = k*(cos(2theta) - 1)
+    target = k * (np.cos(np.deg2rad(two_theta)) - 1)
+
+    solutions = []
+    for angle in solve_projected_rotation(
+        left.T.dot([0, 1, 0]), axis, right.dot(v), target
+    ):
+        solution = dict(known)
+        solution[motor] = angle
+        kf = sample_rotation(solution, SAMPLE_MOTORS).dot(v) / k + np.array([0, 1, 0])
+        del_ = np.rad2deg(np.arcsin(np.clip(kf[0], -1, 1)))
+        nu = np.rad2deg(np.arctan2(kf[2], kf[1]))
+        solutions.append(dict(solution, Nu=nu, Del=del_))
+        solutions.append(dict(solution, Nu=nu + 180, Del=180 - del_))
+    return solutions
+
+
+def has_closed_form(col1, col2, col3, col4, col5):
+    """Check if an operation mode can be solved by closed_form_solutions"""
+    sample_cols = [col for col in (col4, col5) if col != 0]
+    if col2 != 0 or len(set(sample_cols)) != len(sample_cols):
+        return False
+    if col1 in DETECTOR_CONSTRAINTS:
+        if len(sample_cols) != 1:
+            return False
+        if col3 == 0:
+            return FIXED_SAMPLE_MOTOR[sample_cols[0]] in ("Mu", "Eta")
+        if col3 in FIXED_SAMPLE_MOTOR:
+            return FIXED_SAMPLE_MOTOR[col3] != FIXED_SAMPLE_MOTOR[sample_cols[0]]
+        if col3 == 5:
+            return FIXED_SAMPLE_MOTOR[sample_cols[0]] != "Eta"
+        if col3 == 6:
+            return FIXED_SAMPLE_MOTOR[sample_cols[0]] != "Mu"
+        return False
+    if col1 == 0:
+        return (
+            col3 in FIXED_SAMPLE_MOTOR
+            and len(sample_cols) == 2
+            and col3 not in sample_cols
+        )
+    return False
+
+
+def closed_form_solutions(v, k, mode, fixed_values):
+    """
+    Return every (mu, eta, chi, phi, nu, del) that brings the phi frame vector v to the diffraction condition.
+
+    mode is the 5 column operation mode, fixed_values maps the fixed motors ("Mu", ..., "Del") and the
+    pseudo-angles "qaz" and "omega" to their constraint values. An empty list is returned when the
+    reflection is not reachable in the given mode.
+    """
+    col1, col2, col3, col4, col5 = mode
+    if not has_closed_form(col1, col2, col3, col4, col5):
+        return []
+    sin_theta = np.linalg.norm(v) / (2 * k)
+    if sin_theta > 1:
+        return []
+    two_theta = 2 * np.rad2deg(np.arcsin(sin_theta))
+
+    known = {
+        FIXED_SAMPLE_MOTOR[col]: fixed_values[FIXED_SAMPLE_MOTOR[col]]
+        for col in (col3, col4, col5)
+        if col in FIXED_SAMPLE_MOTOR
+    }
+
+    if col1 == 0:
+        solutions = three_sample_motor_solutions(v, k, two_theta, known)
+        return [
+            tuple(solution[motor] for motor in MOTOR_ORDER) for solution in solutions
+        ]
+
+    detector_constraint = DETECTOR_CONSTRAINTS[col1]
+    solutions = []
+    for nu, del_ in detector_solutions(
+        two_theta, detector_constraint, fixed_values[detector_constraint]
+    ):
+        known_now = dict(known)
+        if col3 == 5:
+            known_now["Eta"] = del_ / 2
+        elif col3 == 6:
+            known_now["Mu"] = nu / 2
+
+        if col3 == 0:
+            motor, angles = omega_solutions(known_now, fixed_values["omega"], nu, del_)
+            candidates = [dict(known_now, **{motor: angle}) for angle in angles]
+        else:
+            candidates = [known_now]
+
+        q_lab = q_lab_from_detector(nu, del_, k)
+        for candidate in candidates:
+            for solution in two_sample_motor_solutions(v, q_lab, candidate):
+                solutions.append(
+                    tuple(solution[motor] for motor in MOTOR_ORDER[:4]) + (nu, del_)
+                )
+    return solutions
+
+
+def wrap_to_bounds(angle, bound, reference, tol=1e-6):
+    """Bring angle to the given bound adding multiples of 360, choosing the one nearest to reference.
+    Return None if it is not possible"""
+    if not isinstance(bound, (list, tuple, np.ndarray)):
+        return float(bound) if abs((angle - bound + 180) % 360 - 180) < tol else None
+    low, high = bound
+    first = np.ceil((low - tol - angle) / 360)
+    last = np.floor((high + tol - angle) / 360)
+    if first > last:
+        return None
+    options = angle + 360 * np.arange(first, last + 1)
+    return float(options[np.argmin(np.abs(options - reference))])
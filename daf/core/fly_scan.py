@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""Continuous motion (fly) scans: move a motor at constant speed, sample the counters and bin them by position"""
+
+import threading
+import time
+
+import numpy as np
+
+# Seconds between counter readings when they are sampled on a timer
+FLY_PERIOD = 0.01
+
+
+def fly_velocity(start, end, duration) -> float:
+    """Motor speed to go from start to end in duration seconds"""
+    if duration <= 0:
+        raise ValueError("The duration of a fly scan must be positive")
+    if start == end:
+        raise ValueError("The start and end of a fly scan must be different")
+    return abs(end - start) / duration
+
+
+class FlySampler:
+    """
+    Record the motor readback and the counters of a fly scan, as (time, value) samples.
+
+    On a timer every signal is read every period seconds. With monitor, the signal subscriptions record
+    every new value instead, with its own timestamp. Signals only need get, or subscribe and unsubscribe
+    with the ophyd callback signature, and a name.
+    """
+
+    def __init__(self, readback, counters, period=FLY_PERIOD, monitor=False):
+        self.readback = readback
+        self.counters = list(counters)
+        self.period = period
+        self.monitor = monitor
+        self.samples = {signal.name: ([], []) for signal in [readback] + self.counters}
+        self.stopped = threading.Event()
+        self.thread = None
+        self.subscriptions = []
+
+    def _record(self, name, timestamp, value):
+        times, values = self.samples[name]
+        times.append(timestamp)
+        values.append(float(value))
+
+    def _monitor_callback(self, name):
+        def callback(value, timestamp=None, **kwargs):
+            self._record(name, time.time() if timestamp is None else timestamp, value)
+
+        return callback
+
+    def _sample(self):
+        while not self.stopped.is_set():
+            now = time.time()
+            for signal in [self.readback] + self.counters:
+                self._record(signal.name, now, signal.get())
+            self.stopped.wait(self.period)
+
+    def start(self) -> None:
+        self.stopped.clear()
+        if self.monitor:
+            # The readback may not change for a while, positions are interpolated between samples
+            self._record(self.readback.name, time.time(), self.readback.get())
+            for signal in [self.readback] + self.counters:
+                subscription = signal.subscribe(
+                    self._monitor_callback(signal.name), run=False
+                )
+                self.subscriptions.append((signal, subscription))
+        else:
+            self.thread = threading.Thread(
+                target=self._sample, name="daf-fly-sampler", daemon=True
+            )
+            self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.subscriptions:
+            for signal, subscription in self.subscriptions:
+                signal.unsubscribe(subscription)
+            self.subscriptions = []
+            self._record(self.readback.name, time.time(), self.readback.get())
+
+    def arrays(self, name):
+        """Times and values sampled for a signal name, as arrays"""
+        times, values = self.samples[name]
+        return np.asarray(times, dtype=float), np.asarray(values, dtype=float)
+
+
+def bin_fly_samples(motor_samples, counter_samples, start, end, points):
+    """
+    Split the range from start to end in points bins and average the counter samples in each of them.
+
+    motor_samples are the (times, positions) of the motor and counter_samples a dict of (times, values)
+    of each counter, the position of a counter sample is interpolated from the motor samples at its time.
+    Return the bin centres, a dict with the mean of each counter in each bin (NaN for empty bins) and
+    the number of samples of the first counter in each bin.
+    """
+    points = int(points)
+    width = (end - start) / points
+    centres = start + (np.arange(points) + 0.5) * width
+    motor_times, motor_positions = motor_samples
+    means = {}
+    counts = np.zeros(points, dtype=int)
+    for i, (name, (times, values)) in enumerate(counter_samples.items()):
+        positions = np.interp(times, motor_times, motor_positions)
+        index = np.floor((positions - start) / width).astype(int)
+        # Samples exactly at the end belong to the last bin
+        index[np.isclose(positions, end)] = points - 1
+        inside = (index >= 0) & (index < points)
+        bin_counts = np.bincount(index[inside], minlength=points)
+        sums = np.bincount(index[inside], weights=values[inside], minlength=points)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[name] = np.where(bin_counts > 0, sums / bin_counts, np.nan)
+        if i == 0:
+            counts = bin_counts
+    return centres, means, counts
+
+
+class FlyMotion:
+    """
+    Drive a fly scan of motor, an ophyd EpicsMotor or anything with its velocity, user_readback, move
+    and set, from start to end in duration seconds, sampling counters with a FlySampler. The motor goes
+    to start at its own speed, moves to end at the fly speed and gets its speed back by finish.
+    """
+
+    def __init__(
+        self,
+        motor,
+        counters,
+        start,
+        end,
+        points,
+        duration,
+        period=FLY_PERIOD,
+        monitor=False,
+    ):
+        self.motor = motor
+        self.counters = list(counters)
+        self.start_position = start
+        self.end_position = end
+        self.points = int(points)
+        self.velocity = fly_velocity(start, end, duration)
+        self.sampler = FlySampler(motor.user_readback, self.counters, period, monitor)
+        self.saved_velocity = None
+
+    def prepare(self) -> None:
+        """Move to start and set the fly speed"""
+        self.saved_velocity = self.motor.velocity.get()
+        self.motor.move(self.start_position, wait=True)
+        self.motor.velocity.put(self.velocity)
+
+    def start(self):
+        """Start sampling and moving to end, return the status of the move"""
+        self.sampler.start()
+        return self.motor.set(self.end_position)
+
+    def finish(self) -> None:
+        """Stop sampling and restore the motor speed"""
+        self.sampler.stop()
+        if self.saved_velocity is not None:
+            self.motor.velocity.put(self.saved_velocity)
+            self.saved_velocity = None
+
+    def data_keys(self) -> list:
+        return [self.motor.name] + [counter.name for counter in self.counters]
+
+    def bins(self):
+        """Binned counters, see bin_fly_samples"""
+        return bin_fly_samples(
+            self.sampler.arrays(self.sampler.readback.name),
+            {
+                counter.name: self.sampler.arrays(counter.name)
+                for counter in self.counters
+            },
+            self.start_position,
+            self.end_position,
+            self.points,
+        )
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Vectorised conversion of diffractometer angles to HKL"""
+
+from collections import OrderedDict
+
+import numpy as np
+from numpy import linalg as la
+
+from daf.core.matrix_utils import (
+    calculate_rotation_matrix_from_diffractometer_angles_array,
+)
+
+# Number of experiment states whose engines are kept by get_forward_kinematics
+CACHE_SIZE = 32
+_ENGINES = OrderedDict()
+
+
+class ForwardKinematics:
+    """
+    Angles to HKL conversion for a fixed sample, orientation matrix and wave length.
+
+    UB⁻¹ and the wave vector are computed once, and every angle argument may be a scalar or
+    an (N,) array, so whole trajectories or motor streams are converted in a single call. It is
+    equivalent to hrxrd.Ang2HKL for the 4S+2D geometry of DAF.
+    """
+
+    def __init__(self, U, B, wave_length):
+        self.inverse_UB = la.inv(np.dot(U, B))
+        self.k = 2 * np.pi / wave_length
+
+    def q_lab(self, Nu, Del) -> np.ndarray:
+        """(N, 3) scattering vectors in the laboratory frame"""
+        nu, del_ = np.deg2rad(np.atleast_1d(Nu)), np.deg2rad(np.atleast_1d(Del))
+        return self.k * np.stack(
+            (np.sin(del_), np.cos(del_) * np.cos(nu) - 1, np.cos(del_) * np.sin(nu)),
+            axis=-1,
+        )
+
+    def q_phi(self, Mu, Eta, Chi, Phi, Nu, Del) -> np.ndarray:
+        """(N, 3) scattering vectors in the phi frame"""
+        matrixes = calculate_rotation_matrix_from_diffractometer_angles_array(
+            Mu, Eta, Chi, Phi, Nu, Del
+        )
+        sample = matrixes["mu"] @ matrixes["eta"] @ matrixes["chi"] @ matrixes["phi"]
+        q_lab = np.broadcast_to(self.q_lab(Nu, Del), (len(sample), 3))
+        return np.einsum("nji,nj->ni", sample, q_lab)
+
+    def hkl(self, Mu, Eta, Chi, Phi, Nu, Del) -> np.ndarray:
+        """(N, 3) HKL of N sets of diffractometer angles"""
+        return self.q_phi(Mu, Eta, Chi, Phi, Nu, Del) @ self.inverse_UB.T
+
+    def hkl_from_angles(self, angles) -> np.ndarray:
+        """(N, 3) HKL of an (N, 6) array with Mu, Eta, Chi, Phi, Nu and Del columns"""
+        angles = np.atleast_2d(np.asarray(angles, dtype=float))
+        return self.hkl(*angles[:, :6].T)
+
+
+def get_forward_kinematics(U, B, wave_length) -> ForwardKinematics:
+    """Return the ForwardKinematics of an experiment state, reusing it while U, B and the wave length
+    are the same. Useful when a new DAF object is built for every readout"""
+    U = np.asarray(U, dtype=float)
+    B = np.asarray(B, dtype=float)
+    key = (U.tobytes(), B.tobytes(), float(wave_length))
+    engine = _ENGINES.get(key)
+    if engine is None:
+        engine = ForwardKinematics(U, B, wave_length)
+        _ENGINES[key] = engine
+        if len(_ENGINES) > CACHE_SIZE:
+            _ENGINES.popitem(last=False)
+    else:
+        _ENGINES.move_to_end(key)
+    return engine
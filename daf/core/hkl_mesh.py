@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""Grids of HKL points, in snake order, for reciprocal space mesh scans"""
+
+import numpy as np
+
+
+def mesh_axis(values) -> np.ndarray:
+    """Points of one axis of the mesh: a single value keeps the axis fixed, (start, end, intervals) gives
+    intervals + 1 points from start to end, 0 intervals keeps the axis fixed at start"""
+    if len(values) == 1:
+        return np.array([float(values[0])])
+    if len(values) != 3:
+        raise ValueError(
+            "A mesh axis is a single value or start, end and number of intervals"
+        )
+    start, end, intervals = values
+    if intervals < 0:
+        raise ValueError("The number of intervals of a mesh axis can not be negative")
+    if float(intervals) != int(intervals):
+        raise ValueError("The number of intervals of a mesh axis must be an integer")
+    return np.linspace(float(start), float(end), int(intervals) + 1)
+
+
+def snake_indices(shape) -> list:
+    """Indices of a grid of the given shape, the last axis being the fastest one. Every axis runs back
+    and forth, so consecutive indices are always neighbours and the motors never go back to a row start"""
+    indices = [()]
+    for size in shape:
+        indices = [
+            prefix + (i,)
+            for row, prefix in enumerate(indices)
+            for i in (range(size) if row % 2 == 0 else range(size - 1, -1, -1))
+        ]
+    return indices
+
+
+def hkl_mesh(h, k, l) -> np.ndarray:
+    """(N, 3) array with every HKL of the grid of the h, k and l axis points, in snake order. L is the
+    fastest axis and H the slowest one"""
+    axes = [np.atleast_1d(np.asarray(axis, dtype=float)) for axis in (h, k, l)]
+    return np.array(
+        [
+            [axis[i] for axis, i in zip(axes, index)]
+            for index in snake_indices([len(axis) for axis in axes])
+        ]
+    )
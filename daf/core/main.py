@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import os
+
 import xrayutilities as xu
 import numpy as np
 import pandas as pd
@@ -8,9 +10,16 @@ from tqdm import tqdm
 from daf.utils.print_utils import TablePrinter
 from daf.core.reciprocal_map import ReciprocalMapWindow
 from daf.core.minimization import MinimizationProc
-from daf.core.utils import MODE_COLUMNS
+from daf.core.utils import MODE_COLUMNS, SCAN_COLUMNS
+from daf.core import solver
+from daf.core.hkl_mesh import hkl_mesh
+from daf.core.trajectory_cache import TrajectoryCache
+from daf.core.trajectory_writer import TrajectoryWriter, format_trajectory_row
+
 
 class DAF(MinimizationProc, ReciprocalMapWindow):
+    # On-disk cache of solved scan trajectories, disabled unless set_trajectory_cache is called
+    trajectory_cache = None
 
     def __init__(self, *args):
 
@@ -863,12 +872,20 @@ class DAF(MinimizationProc, ReciprocalMapWindow):
 
     def calc_from_angs(self, Mu, Eta, Chi, Phi, Nu, Del):
 
-        hkl = self.hrxrd.Ang2HKL(
-            Mu, Eta, Chi, Phi, Nu, Del, mat=self.samp, en=self.en, U=self.U
-        )
+        hkl = self.forward_kinematics().hkl(Mu, Eta, Chi, Phi, Nu, Del)
+        # Same layout as hrxrd.Ang2HKL, (3,) for one position and (3, N) for angle arrays
+        if all(np.ndim(angle) == 0 for angle in (Mu, Eta, Chi, Phi, Nu, Del)):
+            hkl = hkl[0]
+        else:
+            hkl = hkl.T
         self.hkl = hkl
         return hkl
 
+    def calc_from_angs_array(self, angles):
+        """Calculate the HKL of every row of an (N, 6) array of Mu, Eta, Chi, Phi, Nu, Del angles,
+        e.g. the points of an angle scan. Return an (N, 3) array"""
+        return self.forward_kinematics().hkl_from_angles(angles)
+
     def export_angles(self):
 
         return [
@@ -901,86 +918,238 @@ class DAF(MinimizationProc, ReciprocalMapWindow):
         name="testscan.txt",
         sep=",",
         startvalues=[0, 0, 0, 0, 0, 0],
+        workers=1,
+        adaptive_step=0,
+        merge_step=0,
     ):
 
+        scan_points = self.scan_points(
+            hkli,
+            hklf,
+            points,
+            diflimit=diflimit,
+            write=write,
+            name=name,
+            sep=sep,
+            startvalues=startvalues,
+            workers=workers,
+            adaptive_step=adaptive_step,
+            merge_step=merge_step,
+        )
+        # The number of points of an adaptive scan is only known once it is solved
+        for _ in tqdm(scan_points, total=None if adaptive_step else points + 1):
+            pass
+
+        pd.options.display.max_rows = None
+        pd.options.display.max_columns = 0
+
+        return self.formscantxt
+
+    def scan_points(
+        self,
+        hkli,
+        hklf,
+        points,
+        diflimit=0.1,
+        write=False,
+        name="testscan.txt",
+        sep=",",
+        startvalues=[0, 0, 0, 0, 0, 0],
+        look_ahead=0,
+        workers=1,
+        adaptive_step=0,
+        merge_step=0,
+    ):
+        """
+        Generator version of scan, yield the (mu, eta, chi, phi, nu, del) of each point as soon as it is
+        solved. With look_ahead > 0 the points are solved by a worker thread, up to look_ahead points
+        ahead of the consumer. With workers > 1 the whole trajectory is first solved in parallel chunks,
+        whose seams are checked against diflimit. With adaptive_step > 0 the points are not uniform in HKL:
+        starting from points intervals, those where a motor moves more than adaptive_step degrees are bisected
+        and the points where no motor moves more than merge_step are merged. The scan DataFrame and file are
+        built when the last point is consumed, the file is saved as .npy or HDF5 when name ends with .npy,
+        .h5 or .hdf5, and as CSV otherwise. When a trajectory cache is set, a scan already solved in the same
+        experiment state is not solved again, its points are read from the cache
+        """
         scl = self.scan_generator(hkli, hklf, points + 1)
+        # The solutions warm-start from startvalues and are checked against diflimit
+        cache_key = self.trajectory_cache_key(
+            hkli=hkli,
+            hklf=hklf,
+            points=points,
+            adaptive_step=adaptive_step,
+            merge_step=merge_step,
+            startvalues=startvalues,
+            diflimit=diflimit,
+        )
+        cached = self.cached_trajectory(cache_key)
+        if cached is not None:
+            solutions = self.trajectory_lists(cached)
+        elif adaptive_step > 0:
+            solutions = self.adaptive_motor_angles(
+                hkli,
+                hklf,
+                points,
+                adaptive_step,
+                min_step=merge_step,
+                start=startvalues,
+            )
+        elif workers > 1:
+            solutions = self.chunked_motor_angles(
+                scl, start=startvalues, workers=workers, diflimit=diflimit
+            )
+        elif look_ahead > 0:
+            solutions = self.stream_motor_angles(
+                scl, start=startvalues, look_ahead=look_ahead
+            )
+        else:
+            solutions = self.iter_motor_angles(scl, start=startvalues)
+        yield from self.trajectory_points(
+            solutions, len(scl), diflimit, write, name, sep, startvalues
+        )
+        self.store_trajectory(cache_key, name)
+
+    def trajectory_points(
+        self,
+        solutions,
+        points,
+        diflimit=0.1,
+        write=False,
+        name="testscan.txt",
+        sep=",",
+        startvalues=[0, 0, 0, 0, 0, 0],
+    ):
+        """Check and record the motor_angles results of a trajectory, yielding the (mu, eta, chi, phi, nu, del)
+        of each point. points is the expected number of points. Used by scan_points and hkl_mesh_points"""
         angslist = list()
-        for i in tqdm(scl):
-            self.hkl = i
-            a, b = self.motor_angles(self, sv=startvalues)
-            angslist.append(b)
-            teste = np.abs(np.array(a[:6]) - np.array(startvalues))
-
-            if np.max(teste) > diflimit and diflimit != 0:
-                raise ("Exceded max limit of angles variation")
-
-            if float(a[-1]) > 1e-5:
-                raise ("qerror is too big, process failed")
-
-            startvalues = a[:6]
-
-            pd.DataFrame(
-                [b],
-                columns=[
-                    "Mu",
-                    "Eta",
-                    "Chi",
-                    "Phi",
-                    "Nu",
-                    "Del",
-                    "2theta",
-                    "theta",
-                    "alpha",
-                    "qaz",
-                    "naz",
-                    "tau",
-                    "psi",
-                    "beta",
-                    "omega",
-                    "H",
-                    "K",
-                    "L",
-                    "Error",
-                ],
-            ).to_csv(".my_scan_counter.csv", mode="a", header=False)
+        with TrajectoryWriter(points) as writer:
+            for a, b in solutions:
+                angslist.append(b)
+                teste = np.abs(np.array(a[:6]) - np.array(startvalues))
+
+                if np.max(teste) > diflimit and diflimit != 0:
+                    raise ("Exceded max limit of angles variation")
+
+                if float(a[-1]) > 1e-5:
+                    raise ("qerror is too big, process failed")
+
+                startvalues = a[:6]
+
+                writer.append(a[:15] + [float(i) for i in b[15:18]] + [float(a[-1])])
+
+                yield [float(i) for i in a[:6]]
 
         self.isscan = True
+        self.scan_trajectory = writer.trajectory
 
-        self.formscantxt = pd.DataFrame(
-            angslist,
-            columns=[
-                "Mu",
-                "Eta",
-                "Chi",
-                "Phi",
-                "Nu",
-                "Del",
-                "2theta",
-                "theta",
-                "alpha",
-                "qaz",
-                "naz",
-                "tau",
-                "psi",
-                "beta",
-                "omega",
-                "H",
-                "K",
-                "L",
-                "Error",
-            ],
-        )
+        self.formscantxt = pd.DataFrame(angslist, columns=SCAN_COLUMNS)
 
         self.formscan = self.formscantxt[
             ["Mu", "Eta", "Chi", "Phi", "Nu", "Del", "Error"]
         ]
 
-        scan_points = [i[:6] for i in angslist]  ## Get only mu, eta, chi, phi, nu, del
-
         if write:
-            self.formscantxt.to_csv(name, sep=sep)
+            writer.write(name, sep=sep)
 
-        pd.options.display.max_rows = None
-        pd.options.display.max_columns = 0
+    def set_trajectory_cache(self, directory=None, max_entries=100):
+        """Store the solved scan trajectories in an on-disk cache in directory, None disables the cache"""
+        self.trajectory_cache = (
+            TrajectoryCache(directory, max_entries) if directory is not None else None
+        )
 
+    def trajectory_cache_key(self, **inputs):
+        """Hash of the scan inputs and everything that defines their solutions, None without a trajectory cache"""
+        if self.trajectory_cache is None:
+            return None
+        return solver.solution_cache_key(self.solver_context(), inputs)
+
+    def cached_trajectory(self, cache_key):
+        """Trajectory stored under cache_key in the trajectory cache, or None"""
+        cached = None
+        if cache_key is not None:
+            cached = self.trajectory_cache.get(cache_key)
+        self.from_cache = cached is not None
+        if self.from_cache:
+            self.trajectory_solve_stats = []
+        return cached
+
+    def store_trajectory(self, cache_key, name=None):
+        """Store the last solved trajectory in the trajectory cache, named by the base name of name"""
+        if cache_key is not None and not self.from_cache:
+            self.trajectory_cache.put(
+                cache_key,
+                self.scan_trajectory,
+                os.path.basename(name) if name is not None else None,
+            )
+
+    def trajectory_lists(self, trajectory):
+        """motor_angles like results of the rows of a trajectory array, see daf.core.trajectory_writer"""
+        for row in trajectory:
+            values = [float(value) for value in row]
+            yield values[:15] + ["{0:.2e}".format(values[-1])], format_trajectory_row(
+                values
+            )
+
+    def hkl_mesh_scan(
+        self,
+        h,
+        k,
+        l,
+        diflimit=0,
+        write=False,
+        name="testmesh.txt",
+        sep=",",
+        startvalues=[0, 0, 0, 0, 0, 0],
+        workers=1,
+    ):
+        """Solve a reciprocal space mesh, see hkl_mesh_points, and return it as the scan DataFrame"""
+        mesh_points = self.hkl_mesh_points(
+            h,
+            k,
+            l,
+            diflimit=diflimit,
+            write=write,
+            name=name,
+            sep=sep,
+            startvalues=startvalues,
+            workers=workers,
+        )
+        for _ in tqdm(mesh_points, total=len(h) * len(k) * len(l)):
+            pass
         return self.formscantxt
+
+    def hkl_mesh_points(
+        self,
+        h,
+        k,
+        l,
+        diflimit=0,
+        write=False,
+        name="testmesh.txt",
+        sep=",",
+        startvalues=[0, 0, 0, 0, 0, 0],
+        workers=1,
+    ):
+        """
+        Generator of a reciprocal space mesh scan, like scan_points. h, k and l are the points of each axis
+        of the grid, which is solved in snake order, see daf.core.hkl_mesh, every point warm-starting from
+        the previous one, or in parallel chunks with workers > 1. When a trajectory cache is set the solved
+        grid is stored in it, and a grid already solved in the same experiment state is not solved again
+        """
+        hkl_array = hkl_mesh(h, k, l)
+        cache_key = self.trajectory_cache_key(
+            mesh=hkl_array, startvalues=startvalues, diflimit=diflimit
+        )
+        cached = self.cached_trajectory(cache_key)
+        if cached is not None:
+            solutions = self.trajectory_lists(cached)
+        elif workers > 1:
+            solutions = self.chunked_motor_angles(
+                hkl_array, start=startvalues, workers=workers, diflimit=diflimit
+            )
+        else:
+            solutions = self.iter_motor_angles(hkl_array, start=startvalues)
+        yield from self.trajectory_points(
+            solutions, len(hkl_array), diflimit, write, name, sep, startvalues
+        )
+        self.store_trajectory(cache_key, name)
@@ -69,80 +69,88 @@ def calculate_rotation_matrix_from_diffractometer_angles(
     return result_dict
 
 
-def calculate_pseudo_angle_from_motor_angles(
-    Mu: float,
-    Eta: float,
-    Chi: float,
-    Phi: float,
-    Nu: float,
-    Del: float,
+def _angle_arrays(*angles) -> np.ndarray:
+    """Return the given angles as rows of a (len(angles), N) float array, broadcasting scalars"""
+    try:
+        result = np.array(angles, dtype=float)
+    except ValueError:
+        result = np.array(np.broadcast_arrays(*angles), dtype=float)
+    return result.reshape(len(angles), -1)
+
+
+def _x_rotation_stack(cos: np.ndarray, sin: np.ndarray) -> np.ndarray:
+    """Stack of rotations around x, same convention as mu and nu rotations"""
+    rotation = np.zeros((len(cos), 3, 3))
+    rotation[:, 0, 0] = 1
+    rotation[:, 1, 1] = cos
+    rotation[:, 1, 2] = -sin
+    rotation[:, 2, 1] = sin
+    rotation[:, 2, 2] = cos
+    return rotation
+
+
+def _y_rotation_stack(cos: np.ndarray, sin: np.ndarray) -> np.ndarray:
+    """Stack of rotations around y, same convention as chi rotation"""
+    rotation = np.zeros((len(cos), 3, 3))
+    rotation[:, 0, 0] = cos
+    rotation[:, 0, 2] = sin
+    rotation[:, 1, 1] = 1
+    rotation[:, 2, 0] = -sin
+    rotation[:, 2, 2] = cos
+    return rotation
+
+
+def _z_rotation_stack(cos: np.ndarray, sin: np.ndarray) -> np.ndarray:
+    """Stack of rotations around z, same convention as eta, phi and del rotations"""
+    rotation = np.zeros((len(cos), 3, 3))
+    rotation[:, 0, 0] = cos
+    rotation[:, 0, 1] = sin
+    rotation[:, 1, 0] = -sin
+    rotation[:, 1, 1] = cos
+    rotation[:, 2, 2] = 1
+    return rotation
+
+
+def calculate_rotation_matrix_from_diffractometer_angles_array(
+    mu, eta, chi, phi, nu, del_
+) -> dict:
+    """Vectorized calculate_rotation_matrix_from_diffractometer_angles. Take (N,) angle arrays and return a dict with (N, 3, 3) stacks"""
+    radians = np.deg2rad(_angle_arrays(mu, eta, chi, phi, nu, del_))
+    cos, sin = np.cos(radians), np.sin(radians)
+    result_dict = {
+        "mu": _x_rotation_stack(cos[0], sin[0]),
+        "eta": _z_rotation_stack(cos[1], sin[1]),
+        "chi": _y_rotation_stack(cos[2], sin[2]),
+        "phi": _z_rotation_stack(cos[3], sin[3]),
+        "nu": _x_rotation_stack(cos[4], sin[4]),
+        "del": _z_rotation_stack(cos[5], sin[5]),
+    }
+    return result_dict
+
+
+def calculate_pseudo_angle_sample_terms(
     sample: xu.materials.material.Crystal,
     hkl: "vector",
     wave_length: float,
     rdir: "vector",
     U: "3x3 array",
 ) -> dict:
-    """Calculate all pseudo angles from motor angles and return a dict with the calculated values"""
-
-    calculated_matrixes = calculate_rotation_matrix_from_diffractometer_angles(
-        Mu, Eta, Chi, Phi, Nu, Del
-    )
-
-    MU = calculated_matrixes["mu"]
-    ETA = calculated_matrixes["eta"]
-    CHI = calculated_matrixes["chi"]
-    PHI = calculated_matrixes["phi"]
-    NU = calculated_matrixes["nu"]
-    DEL = calculated_matrixes["del"]
-
-    Z = MU.dot(ETA).dot(CHI).dot(PHI)
+    """Calculate the terms of the pseudo angles that do not depend on the motor angles, so they can be reused
+    by calculate_pseudo_angles_from_motor_angles_array while the sample, HKL and reference vector are the same"""
     n = rdir
     nc = sample.B.dot(n)
     nchat = nc / la.norm(nc)
     nphi = U.dot(nc)
     nphihat = nphi / la.norm(nphi)
-    nz = Z.dot(nphihat)
-
-    ttB1 = np.rad2deg(np.arccos(np.cos(np.deg2rad(Nu)) * np.cos(np.deg2rad(Del))))
-    tB1 = ttB1 / 2
-
-    A1 = sample.a1
-    A2 = sample.a2
-    A3 = sample.a3
-
-    vcell = A1.dot(np.cross(A2, A3))
-
-    B1 = np.cross(sample.a2, sample.a3) / vcell
-    B2 = np.cross(sample.a3, sample.a1) / vcell
-    B3 = np.cross(sample.a1, sample.a2) / vcell
 
     q = sample.Q(hkl)  # eq (1)
     normQ = la.norm(q)
     Qhat = np.round(q / normQ, 5)
 
-    k = (2 * np.pi) / (wave_length)
-    Ki = k * np.array([0, 1, 0])
-    Kf0 = Ki  ##### eq (6)
-    Kfnu = k * np.array(
-        [
-            np.sin(np.deg2rad(Del)),
-            np.cos(np.deg2rad(Nu)) * np.cos(np.deg2rad(Del)),
-            np.sin(np.deg2rad(Nu)) * np.cos(np.deg2rad(Del)),
-        ]
-    )
-    Kfnunorm = la.norm(Kfnu)
-    Kfnuhat = Kfnu / Kfnunorm
-
     taupseudo = np.rad2deg(np.arccos(np.round(Qhat.dot(nchat), 5)))
 
-    alphain = np.rad2deg(np.arcsin(-np.dot(nz, [0, 1, 0])))
-
-    qaz = np.rad2deg(np.arctan2(np.tan(np.deg2rad(Del)), np.sin(np.deg2rad(Nu))))
-
-    naz = np.rad2deg(np.arctan2((nz.dot([1, 0, 0])), (nz.dot([0, 0, 1]))))
-
     if taupseudo == 0 or taupseudo == 180:
-
+        # Psi is not defined for a reference parallel to Q, use a perpendicular one
         Qphi = Qhat.dot(sample.B)
         Qphinorm = la.norm(Qphi)
         Qphihat = Qphi / Qphinorm
@@ -157,63 +165,271 @@ def calculate_pseudo_angle_from_motor_angles(
             ]
         )
 
-        ntmp = newref
-        nctmp = sample.B.dot(ntmp)
-        nchattmp = nc / la.norm(nctmp)
+        nctmp = sample.B.dot(newref)
         nphitmp = U.dot(nctmp)
-        nphihattmp = nphitmp / la.norm(nphitmp)
-
-        nztmp = Z.dot(nphihattmp)
-        alphatmp = np.rad2deg(np.arcsin(-np.dot(nztmp, [0, 1, 0])))
-        tautemp = np.rad2deg(np.arccos(Qhat.dot(newref)))
-
-        arg2 = np.round(
-            (
-                np.cos(np.deg2rad(tautemp)) * np.sin(np.deg2rad(tB1))
-                - np.sin(np.deg2rad(alphatmp))
-            )
-            / (np.sin(np.deg2rad(tautemp)) * np.cos(np.deg2rad(tB1))),
-            8,
-        )
+        psi_reference = nphitmp / la.norm(nphitmp)
+        psi_tau = np.rad2deg(np.arccos(Qhat.dot(newref)))
 
     else:
+        psi_reference = nphihat
+        psi_tau = taupseudo
 
-        arg2 = np.round(
-            (
-                np.cos(np.deg2rad(taupseudo)) * np.sin(np.deg2rad(tB1))
-                - np.sin(np.deg2rad(alphain))
-            )
-            / (np.sin(np.deg2rad(taupseudo)) * np.cos(np.deg2rad(tB1))),
-            8,
-        )
+    result_dict = {
+        "nphihat": nphihat,
+        "k": (2 * np.pi) / (wave_length),
+        "tau": taupseudo,
+        "psi_reference": psi_reference,
+        "psi_tau": psi_tau,
+        "q_vector": q,
+        "q_vector_norm": normQ,
+    }
 
-    psipseudo = np.rad2deg(np.arccos(arg2))
+    return result_dict
 
-    betaout = np.rad2deg(np.arcsin((np.dot(Kfnuhat, nz))))
 
-    arg4 = np.round(
-        (
-            np.sin(np.deg2rad(Eta)) * np.sin(np.deg2rad(qaz))
-            + np.sin(np.deg2rad(Mu)) * np.cos(np.deg2rad(Eta)) * np.cos(np.deg2rad(qaz))
-        )
-        * np.cos(np.deg2rad(tB1))
-        - np.cos(np.deg2rad(Mu)) * np.cos(np.deg2rad(Eta)) * np.sin(np.deg2rad(tB1)),
-        5,
+def calculate_pseudo_angles_from_motor_angles_array(
+    Mu, Eta, Chi, Phi, Nu, Del, sample_terms: dict, rounded: bool = True
+) -> dict:
+    """Vectorized calculate_pseudo_angle_from_motor_angles. Take (N,) angle arrays and the output of
+    calculate_pseudo_angle_sample_terms and return a dict of (N,) pseudo angles.
+    With rounded=False psi and omega are not rounded, giving the smooth functions an optimizer needs,
+    and they keep changing outside the domain of arccos and arcsin, see _continued_arcsin"""
+    if rounded:
+        arccos = lambda value: np.arccos(np.round(value, 8))
+        arcsin = lambda value: np.arcsin(np.round(value, 5))
+    else:
+        arccos = lambda value: np.pi / 2 - _continued_arcsin(value)
+        arcsin = _continued_arcsin
+    radians = np.deg2rad(_angle_arrays(Mu, Eta, Chi, Phi, Nu, Del))
+    cos, sin = np.cos(radians), np.sin(radians)
+    cos_mu, cos_eta, _, _, cos_nu, cos_del = cos
+    sin_mu, sin_eta, _, _, sin_nu, sin_del = sin
+
+    Z = (
+        _x_rotation_stack(cos[0], sin[0])
+        @ _z_rotation_stack(cos[1], sin[1])
+        @ _y_rotation_stack(cos[2], sin[2])
+        @ _z_rotation_stack(cos[3], sin[3])
     )
-    omega = np.rad2deg(np.arcsin(arg4))
+    nz = Z @ sample_terms["nphihat"]
+
+    two_theta = np.arccos(cos_nu * cos_del)
+    ttB1 = np.rad2deg(two_theta)
+    tB1 = ttB1 / 2
+    cos_theta, sin_theta = np.cos(two_theta / 2), np.sin(two_theta / 2)
+
+    # Kf has always norm k, so its unit vector comes directly from the detector angles
+    Kfnuhat = np.stack([sin_del, cos_nu * cos_del, sin_nu * cos_del], axis=-1)
+
+    alphain = np.rad2deg(np.arcsin(-nz[:, 1]))
+
+    qaz_radians = np.arctan2(np.tan(radians[5]), sin_nu)
+    qaz = np.rad2deg(qaz_radians)
+
+    naz = np.rad2deg(np.arctan2(nz[:, 0], nz[:, 2]))
+
+    psi_tau = np.deg2rad(sample_terms["psi_tau"])
+    sin_alpha_psi = -(Z @ sample_terms["psi_reference"])[:, 1]
+    arg2 = (np.cos(psi_tau) * sin_theta - sin_alpha_psi) / (np.sin(psi_tau) * cos_theta)
+    psipseudo = np.rad2deg(arccos(arg2))
+
+    betaout = np.rad2deg(np.arcsin(np.sum(Kfnuhat * nz, axis=-1)))
+
+    arg4 = (
+        sin_eta * np.sin(qaz_radians) + sin_mu * cos_eta * np.cos(qaz_radians)
+    ) * cos_theta - cos_mu * cos_eta * sin_theta
+    omega = np.rad2deg(arcsin(arg4))
 
     result_dict = {
         "alpha": alphain,
         "qaz": qaz,
         "naz": naz,
-        "tau": taupseudo,
+        "tau": np.full(len(alphain), sample_terms["tau"]),
         "psi": psipseudo,
         "beta": betaout,
         "omega": omega,
         "twotheta": ttB1,
         "theta": tB1,
-        "q_vector": q,
-        "q_vector_norm": normQ,
     }
 
     return result_dict
+
+
+def _rotation_derivative_stack(rotation_stack, cos, sin, axis) -> np.ndarray:
+    """Derivative (per radian) of a rotation stack, rotation_stack is one of the _*_rotation_stack functions"""
+    derivative = rotation_stack(-sin, cos)
+    derivative[:, axis, axis] = 0
+    return derivative
+
+
+def _continued_arcsin(value: np.ndarray) -> np.ndarray:
+    """arcsin of value, continued outside [-1, 1] by a line of slope 1. A fit that leaves the domain
+    gets a residual that keeps growing and pushes it back, instead of NaN or a flat clamp"""
+    inside = np.clip(value, -1, 1)
+    return np.arcsin(inside) + (value - inside)
+
+
+def _arc_derivative(value: np.ndarray) -> np.ndarray:
+    """1 / sqrt(1 - value ** 2), the derivative of arcsin, kept finite at +-1 and equal to the slope of
+    _continued_arcsin outside [-1, 1]"""
+    return np.where(
+        np.abs(value) > 1, 1.0, 1 / np.sqrt(np.maximum(1 - value**2, 1e-12))
+    )
+
+
+def calculate_pseudo_angle_jacobians(
+    Mu, Eta, Chi, Phi, Nu, Del, sample_terms: dict
+) -> dict:
+    """Analytic derivatives of the pseudo angles of calculate_pseudo_angles_from_motor_angles_array.
+    Return a dict of (N, 6) arrays, the derivative of each pseudo angle (degrees) with respect to
+    mu, eta, chi, phi, nu and del (degrees)"""
+    radians = np.deg2rad(_angle_arrays(Mu, Eta, Chi, Phi, Nu, Del))
+    cos, sin = np.cos(radians), np.sin(radians)
+    cos_mu, cos_eta, _, _, cos_nu, cos_del = cos
+    sin_mu, sin_eta, _, _, sin_nu, sin_del = sin
+    points = radians.shape[1]
+
+    stack_functions = (
+        _x_rotation_stack,
+        _z_rotation_stack,
+        _y_rotation_stack,
+        _z_rotation_stack,
+    )
+    axes = (0, 2, 1, 2)
+    rotations = [function(cos[i], sin[i]) for i, function in enumerate(stack_functions)]
+    derivatives = [
+        _rotation_derivative_stack(function, cos[i], sin[i], axes[i])
+        for i, function in enumerate(stack_functions)
+    ]
+    # dZ[i] is the derivative of Z = MU.ETA.CHI.PHI with respect to the i-th sample angle
+    dZ = []
+    for i in range(4):
+        factors = rotations[:i] + [derivatives[i]] + rotations[i + 1 :]
+        dZ.append(factors[0] @ factors[1] @ factors[2] @ factors[3])
+    Z = rotations[0] @ rotations[1] @ rotations[2] @ rotations[3]
+
+    nz = Z @ sample_terms["nphihat"]
+    # (N, 4, 3) derivatives of nz with respect to the sample angles
+    dnz = np.stack([i @ sample_terms["nphihat"] for i in dZ], axis=1)
+
+    def jacobian(sample_part=None, nu_part=None, del_part=None):
+        result = np.zeros((points, 6))
+        if sample_part is not None:
+            result[:, :4] = sample_part
+        if nu_part is not None:
+            result[:, 4] = nu_part
+        if del_part is not None:
+            result[:, 5] = del_part
+        # Both pseudo and motor angles are in degrees, so the derivative is the same as in radians
+        return result
+
+    alpha = jacobian(-dnz[:, :, 1] * _arc_derivative(nz[:, 1])[:, np.newaxis])
+
+    naz_norm = nz[:, 0] ** 2 + nz[:, 2] ** 2
+    naz = jacobian(
+        (nz[:, 2, np.newaxis] * dnz[:, :, 0] - nz[:, 0, np.newaxis] * dnz[:, :, 2])
+        / naz_norm[:, np.newaxis]
+    )
+
+    Kfnuhat = np.stack([sin_del, cos_nu * cos_del, sin_nu * cos_del], axis=-1)
+    dKf_nu = np.stack([np.zeros(points), -sin_nu * cos_del, cos_nu * cos_del], axis=-1)
+    dKf_del = np.stack([cos_del, -cos_nu * sin_del, -sin_nu * sin_del], axis=-1)
+    beta_derivative = _arc_derivative(np.sum(Kfnuhat * nz, axis=-1))
+    beta = jacobian(
+        np.einsum("nj,nij->ni", Kfnuhat, dnz) * beta_derivative[:, np.newaxis],
+        np.sum(dKf_nu * nz, axis=-1) * beta_derivative,
+        np.sum(dKf_del * nz, axis=-1) * beta_derivative,
+    )
+
+    tan_del = np.tan(radians[5])
+    qaz_norm = sin_nu**2 + tan_del**2
+    dqaz_nu = -tan_del * cos_nu / qaz_norm
+    dqaz_del = sin_nu / cos_del**2 / qaz_norm
+    qaz = jacobian(None, dqaz_nu, dqaz_del)
+    qaz_radians = np.arctan2(tan_del, sin_nu)
+
+    # theta = arccos(cos(nu) * cos(del)) / 2
+    cos_two_theta = cos_nu * cos_del
+    two_theta_derivative = -_arc_derivative(cos_two_theta) / 2
+    dtheta_nu = -sin_nu * cos_del * two_theta_derivative
+    dtheta_del = -cos_nu * sin_del * two_theta_derivative
+    cos_theta = np.cos(np.arccos(cos_two_theta) / 2)
+    sin_theta = np.sin(np.arccos(cos_two_theta) / 2)
+
+    psi_tau = np.deg2rad(sample_terms["psi_tau"])
+    psi_reference = Z @ sample_terms["psi_reference"]
+    dsin_alpha_psi = -np.stack(
+        [(i @ sample_terms["psi_reference"])[:, 1] for i in dZ], axis=1
+    )
+    numerator = np.cos(psi_tau) * sin_theta + psi_reference[:, 1]
+    denominator = np.sin(psi_tau) * cos_theta
+    arg2 = numerator / denominator
+    darg2_theta = (
+        np.cos(psi_tau) * cos_theta * denominator
+        + numerator * np.sin(psi_tau) * sin_theta
+    ) / denominator**2
+    psi_derivative = -_arc_derivative(arg2)
+    psi = jacobian(
+        -dsin_alpha_psi / denominator[:, np.newaxis] * psi_derivative[:, np.newaxis],
+        darg2_theta * dtheta_nu * psi_derivative,
+        darg2_theta * dtheta_del * psi_derivative,
+    )
+
+    sin_qaz, cos_qaz = np.sin(qaz_radians), np.cos(qaz_radians)
+    in_plane = sin_eta * sin_qaz + sin_mu * cos_eta * cos_qaz
+    arg4 = in_plane * cos_theta - cos_mu * cos_eta * sin_theta
+    darg4_qaz = (sin_eta * cos_qaz - sin_mu * cos_eta * sin_qaz) * cos_theta
+    darg4_theta = -in_plane * sin_theta - cos_mu * cos_eta * cos_theta
+    omega_derivative = _arc_derivative(arg4)
+    sample_part = np.zeros((points, 4))
+    sample_part[:, 0] = (
+        cos_mu * cos_eta * cos_qaz * cos_theta + sin_mu * cos_eta * sin_theta
+    )
+    sample_part[:, 1] = (
+        cos_eta * sin_qaz - sin_mu * sin_eta * cos_qaz
+    ) * cos_theta + cos_mu * sin_eta * sin_theta
+    omega = jacobian(
+        sample_part * omega_derivative[:, np.newaxis],
+        (darg4_qaz * dqaz_nu + darg4_theta * dtheta_nu) * omega_derivative,
+        (darg4_qaz * dqaz_del + darg4_theta * dtheta_del) * omega_derivative,
+    )
+
+    result_dict = {
+        "alpha": alpha,
+        "qaz": qaz,
+        "naz": naz,
+        "tau": np.zeros((points, 6)),
+        "psi": psi,
+        "beta": beta,
+        "omega": omega,
+    }
+
+    return result_dict
+
+
+def calculate_pseudo_angle_from_motor_angles(
+    Mu: float,
+    Eta: float,
+    Chi: float,
+    Phi: float,
+    Nu: float,
+    Del: float,
+    sample: xu.materials.material.Crystal,
+    hkl: "vector",
+    wave_length: float,
+    rdir: "vector",
+    U: "3x3 array",
+) -> dict:
+    """Calculate all pseudo angles from motor angles and return a dict with the calculated values"""
+    sample_terms = calculate_pseudo_angle_sample_terms(
+        sample, hkl, wave_length, rdir, U
+    )
+    pseudo_angles = calculate_pseudo_angles_from_motor_angles_array(
+        Mu, Eta, Chi, Phi, Nu, Del, sample_terms
+    )
+
+    result_dict = {key: value[0] for key, value in pseudo_angles.items()}
+    result_dict["q_vector"] = sample_terms["q_vector"]
+    result_dict["q_vector_norm"] = sample_terms["q_vector_norm"]
+
+    return result_dict
@@ -1,453 +1,232 @@
 #!/usr/bin/env python3
 
-import xrayutilities as xu
 import numpy as np
 from numpy import linalg as LA
 
+from daf.core import solver
+from daf.core.adaptive_trajectory import MAX_DEPTH, adaptive_hkl_trajectory
 from daf.core.ub_matrix_calc import UBMatrix
-from daf.core.matrix_utils import (
-    calculate_rotation_matrix_from_diffractometer_angles,
-    calculate_pseudo_angle_from_motor_angles,
-)
-from daf.core.math_utils import vector_angle
+from daf.core.forward_kinematics import get_forward_kinematics
+from daf.core.solution_cache import SolutionCache
+from daf.core.solver import PSEUDO_ANGLES, SolverContext, solve
+from daf.core.trajectory_chunks import solve_trajectory_in_chunks
+from daf.core.trajectory_stream import LOOK_AHEAD, LookAheadSolver
 
 
 class MinimizationProc(UBMatrix):
-    def pseudoAngleConst(self, angles, pseudo_angle, fix_angle):
-
-        if pseudo_angle == "eta=del/2":
-            return angles[1] - angles[5] / 2
-        elif pseudo_angle == "mu=nu/2":
-            return angles[0] - angles[4] / 2
-
-        PI = np.pi
-        MAT = np.array
-        rad = np.deg2rad
-        deg = np.rad2deg
-
-        Mu = angles[0] + 1e-6
-        if pseudo_angle == "Mu":
-            return Mu - fix_angle
-
-        Eta = angles[1] + 1e-6
-        if pseudo_angle == "Eta":
-            return Eta - fix_angle
-
-        Chi = angles[2] + 1e-6
-        if pseudo_angle == "Chi":
-            return Chi - fix_angle
+    # Phi start values tried when the first fit does not converge, and the number of fits run at the same
+    # time, one after the other by default
+    multi_start_seeds = (0, 90, 180, 270)
+    multi_start_workers = 1
+    # On-disk cache of solutions, disabled unless set_solution_cache is called
+    solution_cache = None
+    from_cache = False
+    # Profile of the last motor_angles call, see daf.core.solve_stats
+    last_solve_stats = None
+
+    def solver_context(self) -> SolverContext:
+        """Immutable snapshot of the experiment, to be used with daf.core.solver.solve"""
+        return SolverContext.from_daf(self)
 
-        Phi = angles[3] + 1e-6
-        if pseudo_angle == "Phi":
-            return Phi - fix_angle
-
-        Nu = angles[4] + 1e-6
-        if pseudo_angle == "Nu":
-            return Nu - fix_angle
-
-        Del = angles[5] + 1e-6
-        if pseudo_angle == "Del":
-            return Del - fix_angle
-
-        pseudo_angles_dict = calculate_pseudo_angle_from_motor_angles(
-            Mu, Eta, Chi, Phi, Nu, Del, self.samp, self.hkl, self.lam, self.nref, self.U
+    def pseudoAngleConst(self, angles, pseudo_angle, fix_angle):
+        return solver.pseudo_angle_constraint(
+            angles, pseudo_angle, fix_angle, self.pseudo_angle_sample_terms
         )
 
-        alphain = pseudo_angles_dict["alpha"]
-        betaout = pseudo_angles_dict["beta"]
-        qaz = pseudo_angles_dict["qaz"]
-        naz = pseudo_angles_dict["naz"]
-        taupseudo = pseudo_angles_dict["tau"]
-        psipseudo = pseudo_angles_dict["psi"]
-        omega = pseudo_angles_dict["omega"]
-
-        if pseudo_angle == "alpha":
-            return alphain - fix_angle
-
-        elif pseudo_angle == "beta":
-            return betaout - fix_angle
-
-        elif pseudo_angle == "qaz":
-            return qaz - fix_angle
+    def pseudoAngleConstJac(self, angles, pseudo_angle, fix_angle=None):
+        """Derivative of pseudoAngleConst with respect to (mu, eta, chi, phi, nu, del)"""
+        return solver.pseudo_angle_constraint_jacobian(
+            angles, pseudo_angle, self.pseudo_angle_sample_terms
+        )
 
-        elif pseudo_angle == "naz":
-            return naz - fix_angle
+    def closed_form_motor_angles(self, max_err=1e-5):
+        """Solve the current Q_lab analytically when the operation mode allows it.
+        Return the angles closest to self.start and its qerror, or None if there is no closed form solution"""
+        return solver.closed_form_solve(
+            self.solver_context(), self.Q_lab, self.start, max_err
+        )
 
-        elif pseudo_angle == "tau":
-            return taupseudo - fix_angle
+    def set_multi_start(self, seeds=None, workers=None):
+        """Configure the retry of motor_angles. seeds is the number of phi start values, evenly spaced
+        in 360 degrees, or a sequence of them. workers is the number of fits to run at the same time,
+        1 runs them one after the other"""
+        if seeds is not None:
+            if np.isscalar(seeds):
+                seeds = tuple(360 * i / int(seeds) for i in range(int(seeds)))
+            self.multi_start_seeds = tuple(seeds)
+        if workers is not None:
+            self.multi_start_workers = max(1, int(workers))
+
+    def multi_start_fit(self, restrict=(), max_err=1e-5):
+        """Retry Q2AngFit from the Q2Ang guess and from every phi in multi_start_seeds. With more than one
+        worker the fits run at the same time and the remaining ones are cancelled as soon as one gets a
+        qerror below max_err.
+        Return (angles, qerror, errcode) of the first converged fit, or of the best one if none converged"""
+        self.start, result = solver.multi_start_fit(
+            self.solver_context(), self.Q_lab, restrict, max_err, self.last_solve_stats
+        )
+        return result
 
-        elif pseudo_angle == "psi":
-            return psipseudo - fix_angle
+    def forward_kinematics(self):
+        """Angles to HKL engine of the current sample, U matrix and wave length"""
+        return get_forward_kinematics(self.U, self.samp.B, self.lam)
 
-        elif pseudo_angle == "omega":
-            return omega - fix_angle
+    def set_solution_cache(self, path=None, max_entries=1000):
+        """Store the solutions of motor_angles in an on-disk LRU cache at path, None disables the cache"""
+        self.solution_cache = (
+            SolutionCache(path, max_entries) if path is not None else None
+        )
 
-        elif pseudo_angle == "aeqb":
-            return betaout - alphain
+    def solution_cache_key(self, max_err=1e-5):
+        """Hash of everything that defines the solution of the current HKL"""
+        return solver.solution_cache_key(self.solver_context(), self.hkl, max_err)
 
-    def motor_angles(self, *args, qvec=False, max_err=1e-5, **kwargs):
+    def motor_angles(self, *args, qvec=False, max_err=1e-5, closed_form=True, **kwargs):
 
         self.isscan = False
 
-        if qvec is not False:
-            self.Q_lab = qvec
-
-        else:
-            self.Q_material = self.samp.Q(self.hkl)
-
-            self.Q_lab = self.hrxrd.Transform(self.Q_material)
-
-        self.dhkl = self.samp.planeDistance(self.hkl)
-        tilt = vector_angle(self.hkl, self.samp.Q(self.ndir), deg=True)
-
         if "sv" in kwargs.keys():
             self.start = kwargs["sv"]
         else:
             self.start = [0, 0, 0, 0, 0, 0]
 
-        media = lambda x, y: (x + y) / 2
-        # self.chute1 = [media(i[0], i[1]) if type(i) != float else i for i in self.bounds]
-        self.chute1 = [45, 45, 45, 45, 45, 45]
-
-        if len(self.pseudo_constraints_w_value_list) != 0:
-            pseudoconst = self.pseudoAngleConst
-
-            if len(self.pseudo_constraints_w_value_list) == 1:
-
-                restrict = [
-                    {
-                        "type": "eq",
-                        "fun": lambda a: pseudoconst(
-                            a,
-                            self.pseudo_constraints_w_value_list[0][0],
-                            self.pseudo_constraints_w_value_list[0][1],
-                        ),
-                    }
-                ]
-
-            elif len(self.pseudo_constraints_w_value_list) == 2:
-
-                restrict = [
-                    {
-                        "type": "eq",
-                        "fun": lambda a: pseudoconst(
-                            a,
-                            self.pseudo_constraints_w_value_list[0][0],
-                            self.pseudo_constraints_w_value_list[0][1],
-                        ),
-                    },
-                    {
-                        "type": "eq",
-                        "fun": lambda a: pseudoconst(
-                            a,
-                            self.pseudo_constraints_w_value_list[1][0],
-                            self.pseudo_constraints_w_value_list[1][1],
-                        ),
-                    },
-                ]
-
-            elif len(self.pseudo_constraints_w_value_list) == 3:
-
-                restrict = [
-                    {
-                        "type": "eq",
-                        "fun": lambda a: pseudoconst(
-                            a,
-                            self.pseudo_constraints_w_value_list[0][0],
-                            self.pseudo_constraints_w_value_list[0][1],
-                        ),
-                    },
-                    {
-                        "type": "eq",
-                        "fun": lambda a: pseudoconst(
-                            a,
-                            self.pseudo_constraints_w_value_list[1][0],
-                            self.pseudo_constraints_w_value_list[1][1],
-                        ),
-                    },
-                    {
-                        "type": "eq",
-                        "fun": lambda a: pseudoconst(
-                            a,
-                            self.pseudo_constraints_w_value_list[2][0],
-                            self.pseudo_constraints_w_value_list[2][1],
-                        ),
-                    },
-                ]
-
-            ang, qerror, errcode = xu.Q2AngFit(
-                self.Q_lab,
-                self.hrxrd,
-                self.bounds,
-                startvalues=self.start,
-                constraints=restrict,
-                ormat=self.U,
-            )
-
-            if qerror > max_err:
-                while True:
-                    self.preangs = self.hrxrd.Q2Ang(self.Q_lab)
-                    self.start = (0, 0, 0, 0, 0, self.preangs[3])
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        constraints=restrict,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        0,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        constraints=restrict,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    # self.start = [0, self.chute1[1], self.chute1[2], 90, self.chute1[4], self.preangs[3]]
-                    # ang, qerror, errcode = xu.Q2AngFit(self.Q_lab, self.hrxrd, self.bounds, startvalues = self.start, constraints=restrict, ormat=self.U)
-                    # if qerror < 1e-5:
-                    #     break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        90,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        constraints=restrict,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        180,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        constraints=restrict,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        270,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        constraints=restrict,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    break
-
-        else:
-
-            ang, qerror, errcode = xu.Q2AngFit(
-                self.Q_lab,
-                self.hrxrd,
-                self.bounds,
-                startvalues=self.start,
-                ormat=self.U,
-            )
-            if qerror > max_err:
-                while True:
-                    self.preangs = self.hrxrd.Q2Ang(self.Q_lab)
-                    self.start = (0, 0, 0, 0, 0, self.preangs[3])
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        0,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        90,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    # self.start = [0, self.chute1[1], self.chute1[2], 90, self.chute1[4], self.chute1[5]]
-                    # ang, qerror, errcode = xu.Q2AngFit(self.Q_lab, self.hrxrd, self.bounds, startvalues = self.start, ormat=self.U)
-                    # if qerror < 1e-5:
-                    #     break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        180,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    self.start = [
-                        self.chute1[0],
-                        self.chute1[1],
-                        self.chute1[2],
-                        270,
-                        self.chute1[4],
-                        self.chute1[5],
-                    ]
-                    ang, qerror, errcode = xu.Q2AngFit(
-                        self.Q_lab,
-                        self.hrxrd,
-                        self.bounds,
-                        startvalues=self.start,
-                        ormat=self.U,
-                    )
-                    if qerror < max_err:
-                        break
-                    break
-
-        self.qerror = qerror
-        self.hkl_calc = np.round(
-            self.hrxrd.Ang2HKL(*ang, mat=self.samp, en=self.en, U=self.U), 5
-        )
-
-        self.Mu, self.Eta, self.Chi, self.Phi = (ang[0], ang[1], ang[2], ang[3])
-        self.Nu, self.Del = (ang[4], ang[5])
-
-        calculated_matrixes = calculate_rotation_matrix_from_diffractometer_angles(
-            self.Mu, self.Eta, self.Chi, self.Phi, self.Nu, self.Del
-        )
-
-        pseudo_angles_dict = calculate_pseudo_angle_from_motor_angles(
-            self.Mu,
-            self.Eta,
-            self.Chi,
-            self.Phi,
-            self.Nu,
-            self.Del,
-            self.samp,
+        solution = solve(
+            self.solver_context(),
             self.hkl,
-            self.lam,
-            self.nref,
-            self.U,
+            self.start,
+            max_err=max_err,
+            closed_form=closed_form,
+            q_lab=None if qvec is False else qvec,
+            cache=self.solution_cache,
         )
 
-        self.ttB1 = pseudo_angles_dict["twotheta"]
-        self.tB1 = pseudo_angles_dict["theta"]
-        self.alphain = pseudo_angles_dict["alpha"]
-        self.qaz = pseudo_angles_dict["qaz"]
-        self.naz = pseudo_angles_dict["naz"]
-        self.taupseudo = pseudo_angles_dict["tau"]
-        self.psipseudo = pseudo_angles_dict["psi"]
-        self.betaout = pseudo_angles_dict["beta"]
-        self.omega = pseudo_angles_dict["omega"]
-        self.Qshow = pseudo_angles_dict["q_vector"]
-        self.Qnorm = pseudo_angles_dict["q_vector_norm"]
-        self.FHKL = LA.norm(
-            self.samp.StructureFactor(pseudo_angles_dict["q_vector"], self.en)
-        )
+        self.Q_lab = solution.q_lab
+        self.start = solution.start
+        self.pseudo_angle_sample_terms = solution.sample_terms
+        self.last_solve_stats = solution.stats
+        self.from_cache = solution.from_cache
+        self.qerror = solution.qerror
+        self.hkl_calc = solution.hkl_calc
+        self.dhkl = self.samp.planeDistance(self.hkl)
 
-        return [
-            self.Mu,
-            self.Eta,
-            self.Chi,
-            self.Phi,
-            self.Nu,
-            self.Del,
-            self.ttB1,
-            self.tB1,
-            self.alphain,
-            self.qaz,
-            self.naz,
-            self.taupseudo,
-            self.psipseudo,
-            self.betaout,
-            self.omega,
-            "{0:.2e}".format(self.qerror),
-        ], [
-            self.fcsv(self.Mu),
-            self.fcsv(self.Eta),
-            self.fcsv(self.Chi),
-            self.fcsv(self.Phi),
-            self.fcsv(self.Nu),
-            self.fcsv(self.Del),
-            self.fcsv(self.ttB1),
-            self.fcsv(self.tB1),
-            self.fcsv(self.alphain),
-            self.fcsv(self.qaz),
-            self.fcsv(self.naz),
-            self.fcsv(self.taupseudo),
-            self.fcsv(self.psipseudo),
-            self.fcsv(self.betaout),
-            self.fcsv(self.omega),
-            self.fcsv(self.hkl_calc[0]),
-            self.fcsv(self.hkl_calc[1]),
-            self.fcsv(self.hkl_calc[2]),
-            "{0:.2e}".format(self.qerror),
+        self.Mu, self.Eta, self.Chi, self.Phi, self.Nu, self.Del = solution.angles
+
+        pseudo_angles = solution.pseudo_angles
+        self.ttB1 = pseudo_angles["twotheta"]
+        self.tB1 = pseudo_angles["theta"]
+        self.alphain = pseudo_angles["alpha"]
+        self.qaz = pseudo_angles["qaz"]
+        self.naz = pseudo_angles["naz"]
+        self.taupseudo = pseudo_angles["tau"]
+        self.psipseudo = pseudo_angles["psi"]
+        self.betaout = pseudo_angles["beta"]
+        self.omega = pseudo_angles["omega"]
+        self.Qshow = solution.sample_terms["q_vector"]
+        self.Qnorm = solution.sample_terms["q_vector_norm"]
+        self.FHKL = LA.norm(self.samp.StructureFactor(self.Qshow, self.en))
+
+        return self.solution_lists(solution)
+
+    def solution_lists(self, solution):
+        """Results of motor_angles for a daf.core.solver.Solution: a list with the motor angles,
+        pseudo-angles and qerror, and the same values formatted for CSV files, with the calculated HKL"""
+        values = list(solution.angles) + [
+            solution.pseudo_angles[name] for name in PSEUDO_ANGLES
         ]
+        qerror = "{0:.2e}".format(solution.qerror)
+        return values + [qerror], [self.fcsv(i) for i in values] + [
+            self.fcsv(i) for i in solution.hkl_calc
+        ] + [qerror]
+
+    def iter_motor_angles(self, hkl_array, start=(0, 0, 0, 0, 0, 0), max_err=1e-5):
+        """Solve a sequence of HKLs, yielding the motor_angles result of each point.
+        Q vectors are computed once for the whole array and every point warm-starts from the previous solution.
+        The solver profile of every point is kept in trajectory_solve_stats"""
+        hkl_array = np.atleast_2d(np.asarray(hkl_array, dtype=float))
+        q_lab_array = np.atleast_2d(self.hrxrd.Transform(self.samp.Q(hkl_array)))
+        start = list(start)
+        self.trajectory_solve_stats = []
+        for hkl, q_lab in zip(hkl_array, q_lab_array):
+            self.hkl = hkl
+            result = self.motor_angles(qvec=q_lab, max_err=max_err, sv=start)
+            self.trajectory_solve_stats.append(self.last_solve_stats)
+            start = result[0][:6]
+            yield result
+
+    def stream_motor_angles(
+        self, hkl_array, start=(0, 0, 0, 0, 0, 0), max_err=1e-5, look_ahead=LOOK_AHEAD
+    ):
+        """Like iter_motor_angles, but the points are solved by a worker thread up to look_ahead points
+        ahead of the consumer, from a snapshot of the experiment. The DAF attributes of the solved point
+        (self.Mu, self.qerror, ...) are not updated"""
+        self.trajectory_solve_stats = []
+        for solution in LookAheadSolver(
+            self.solver_context(), hkl_array, start, max_err, look_ahead
+        ):
+            self.trajectory_solve_stats.append(solution.stats)
+            yield self.solution_lists(solution)
+
+    def chunked_motor_angles(
+        self,
+        hkl_array,
+        start=(0, 0, 0, 0, 0, 0),
+        max_err=1e-5,
+        workers=None,
+        chunks=None,
+        diflimit=0,
+    ):
+        """Like iter_motor_angles, but the trajectory is solved in parallel chunks by a process pool before
+        the first point is yielded, see daf.core.trajectory_chunks. The DAF attributes of the solved points
+        (self.Mu, self.qerror, ...) are not updated"""
+        solutions = solve_trajectory_in_chunks(
+            self.solver_context(), hkl_array, start, max_err, workers, chunks, diflimit
+        )
+        self.trajectory_solve_stats = [solution.stats for solution in solutions]
+        for solution in solutions:
+            yield self.solution_lists(solution)
+
+    def adaptive_motor_angles(
+        self,
+        hkli,
+        hklf,
+        points,
+        max_step,
+        min_step=0,
+        start=(0, 0, 0, 0, 0, 0),
+        max_err=1e-5,
+        max_depth=MAX_DEPTH,
+    ):
+        """Like iter_motor_angles for the line from hkli to hklf, but with a non-uniform step: the
+        intervals where a motor moves more than max_step are bisected and the points where no motor
+        moves more than min_step are merged, see daf.core.adaptive_trajectory. The DAF attributes of
+        the solved points (self.Mu, self.qerror, ...) are not updated"""
+        solutions = adaptive_hkl_trajectory(
+            self.solver_context(),
+            hkli,
+            hklf,
+            points,
+            max_step,
+            min_step,
+            start,
+            max_err,
+            max_depth,
+        )
+        self.trajectory_solve_stats = [solution.stats for solution in solutions]
+        for solution in solutions:
+            yield self.solution_lists(solution)
+
+    def motor_angles_batch(self, hkl_array, start=(0, 0, 0, 0, 0, 0), max_err=1e-5):
+        """Solve a (N, 3) array of HKLs. Return (N, 6) motor angles (mu, eta, chi, phi, nu, del),
+        (N, 9) pseudo-angles (2theta, theta, alpha, qaz, naz, tau, psi, beta, omega) and (N,) errors"""
+        hkl_array = np.atleast_2d(np.asarray(hkl_array, dtype=float))
+        points = len(hkl_array)
+        motor_angles = np.empty((points, 6))
+        pseudo_angles = np.empty((points, 9))
+        errors = np.empty(points)
+        for i, (angles, _) in enumerate(
+            self.iter_motor_angles(hkl_array, start=start, max_err=max_err)
+        ):
+            motor_angles[i] = angles[:6]
+            pseudo_angles[i] = angles[6:15]
+            errors[i] = self.qerror
+        return motor_angles, pseudo_angles, errors
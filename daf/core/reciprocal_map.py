@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import math
 import subprocess
 import xrayutilities as xu
 import numpy as np
@@ -13,6 +14,74 @@ from daf.core.matrix_utils import (
 from daf.core.math_utils import vector_angle, vec_norm
 
 
+def get_reciprocal_space_peaks(mat, exp, ttmax):
+    """
+    Parameters
+    ----------
+    mat:        Crystal
+        instance of Crystal for structure factor calculations
+    exp:        Experiment
+        instance of Experiment (likely HXRD, or FourC)
+    ttmax:      float
+        maximal 2Theta angle to consider
+
+    Returns
+    -------
+    ndarray
+        data array with columns for 'q', 'qvec', 'hkl', 'r' for the Bragg
+        peaks
+    """
+    # calculate maximal Bragg indices
+    hma = int(
+        math.ceil(
+            vec_norm(mat.a1) * exp.k0 / np.pi * math.sin(math.radians(ttmax / 2.0))
+        )
+    )
+    hmi = -hma
+    kma = int(
+        math.ceil(
+            vec_norm(mat.a2) * exp.k0 / np.pi * math.sin(math.radians(ttmax / 2.0))
+        )
+    )
+    kmi = -kma
+    lma = int(
+        math.ceil(
+            vec_norm(mat.a3) * exp.k0 / np.pi * math.sin(math.radians(ttmax / 2.0))
+        )
+    )
+    lmi = -lma
+
+    # calculate structure factors
+    qmax = 2 * exp.k0 * math.sin(math.radians(ttmax / 2.0))
+    hkl = (
+        np.mgrid[hma : hmi - 1 : -1, kma : kmi - 1 : -1, lma : lmi - 1 : -1]
+        .reshape(3, -1)
+        .T
+    )
+
+    q = mat.Q(hkl)
+    qnorm = vec_norm(q)
+    m = qnorm < qmax
+
+    data = np.zeros(
+        np.sum(m),
+        dtype=[
+            ("q", np.double),
+            ("qvec", np.ndarray),
+            ("r", np.double),
+            ("hkl", np.ndarray),
+        ],
+    )
+    data["q"] = qnorm[m]
+    data["qvec"] = list(exp.Transform(q[m]))
+    rref = abs(mat.StructureFactor((0, 0, 0), exp.energy)) ** 2
+    data["r"] = np.abs(mat.StructureFactorForQ(q[m], exp.energy)) ** 2
+    data["r"] /= rref
+    data["hkl"] = list(hkl[m])
+
+    return data
+
+
 class ReciprocalMapWindow:
     def two_theta_max(self):
         """Method to get the maximum 2theta to show in the 2D reciprocal map"""
@@ -119,81 +188,10 @@ class ReciprocalMapWindow:
 
                 # from .mpl_helper import SqrtAllowNegScale
                 return True, plt
-            except ImportError:  # print(d['qvec'][m][ind['ind'][0]])
+            except ImportError:
                 print("%s: Warning: plot functionality not available" % funcname)
                 return False, None
 
-        def get_peaks(mat, exp, ttmax):
-            """
-            Parameters
-            ----------
-            mat:        Crystal
-                instance of Crystal for structure factor calculations
-            exp:        Experiment
-                instance of Experiment (likely HXRD, or FourC)
-            tt_cutoff:  float
-                maximal 2Theta angle to consider, by default 180deg
-
-            Returns
-            -------
-            ndarray
-                data array with columns for 'q', 'qvec', 'hkl', 'r' for the Bragg
-                peaks
-            """
-            # print(exp)
-            ttmax = 180
-            # print(d['qvec'][m][ind['ind'][0]])
-
-            # calculate maximal Bragg indices
-            hma = int(
-                math.ceil(
-                    vec_norm(mat.a1) * exp.k0 / pi * math.sin(math.radians(ttmax / 2.0))
-                )
-            )
-            hmi = -hma
-            kma = int(
-                math.ceil(
-                    vec_norm(mat.a2) * exp.k0 / pi * math.sin(math.radians(ttmax / 2.0))
-                )
-            )
-            kmi = -kma
-            lma = int(
-                math.ceil(
-                    vec_norm(mat.a3) * exp.k0 / pi * math.sin(math.radians(ttmax / 2.0))
-                )
-            )
-            lmi = -lma
-
-            # calculate structure factors
-            qmax = 2 * exp.k0 * math.sin(math.radians(ttmax / 2.0))
-            hkl = (
-                numpy.mgrid[hma : hmi - 1 : -1, kma : kmi - 1 : -1, lma : lmi - 1 : -1]
-                .reshape(3, -1)
-                .T
-            )
-
-            q = mat.Q(hkl)
-            qnorm = vec_norm(q)
-            m = qnorm < qmax
-
-            data = numpy.zeros(
-                numpy.sum(m),
-                dtype=[
-                    ("q", numpy.double),
-                    ("qvec", numpy.ndarray),
-                    ("r", numpy.double),
-                    ("hkl", numpy.ndarray),
-                ],
-            )
-            data["q"] = qnorm[m]
-            data["qvec"] = list(exp.Transform(q[m]))
-            rref = abs(mat.StructureFactor((0, 0, 0), exp.energy)) ** 2
-            data["r"] = numpy.abs(mat.StructureFactorForQ(q[m], exp.energy)) ** 2
-            data["r"] /= rref
-            data["hkl"] = list(hkl[m])
-
-            return data
-
         plot, plt = import_matplotlib_pyplot("XU.materials")
 
         if not plot:
@@ -203,7 +201,7 @@ class ReciprocalMapWindow:
         if ttmax is None:
             ttmax = 180
 
-        d = get_peaks(mat, exp, ttmax)
+        d = get_reciprocal_space_peaks(mat, exp, ttmax)
         k0 = exp.k0
 
         if not ax:
@@ -377,7 +375,6 @@ class ReciprocalMapWindow:
                         if angles[6] < 1e-4:
                             print_str = self.__str__()
                             print(print_str)
-                            # print("daf.amv -m {} -e {} -c {} -p {} -n {} -d {}".format(lb(exp_dict['Mu']), lb(exp_dict['Eta']), lb(exp_dict['Chi']), lb(exp_dict['Phi']), lb(exp_dict['Nu']), lb(exp_dict['Del'])))
                             subprocess.Popen(
                                 "daf.amv -m {} -e {} -c {} -p {} -n {} -d {}".format(
                                     lb(exp_dict["mu"]),
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Estimate how long a scan takes from the kinematics of its motors, without moving anything"""
+
+import itertools
+
+import numpy as np
+
+# Motor record fields of the kinematics kept in the experiment file, and the values used when missing
+KINEMATICS_FIELDS = {"velocity": "VELO", "acceleration": "ACCL", "backlash": "BDST"}
+DEFAULT_KINEMATICS = {"velocity": 1.0, "acceleration": 0.2, "backlash": 0.0}
+
+
+def motor_kinematics(motor_info: dict) -> dict:
+    """Velocity (units/s), acceleration time (s) and backlash distance of a motor of the experiment file"""
+    return {
+        key: float(default if motor_info.get(key) is None else motor_info.get(key))
+        for key, default in DEFAULT_KINEMATICS.items()
+    }
+
+
+def trapezoid_time(distance, velocity, acceleration):
+    """
+    Time to move distance with a trapezoidal speed profile, reaching velocity in acceleration seconds,
+    as the EPICS motor record does. Short moves that never reach velocity follow a triangular profile.
+    distance may be an array.
+    """
+    distance = np.abs(np.asarray(distance, dtype=float))
+    if velocity <= 0:
+        raise ValueError("The velocity of a motor must be positive")
+    if acceleration <= 0:
+        return distance / velocity
+    ramp_distance = velocity * acceleration
+    return np.where(
+        distance >= ramp_distance,
+        distance / velocity + acceleration,
+        2 * np.sqrt(distance * acceleration / velocity),
+    )
+
+
+def move_time(distance, kinematics: dict):
+    """
+    Time of moves of distance, signed, with the backlash correction of the motor record: the motor stops
+    backlash before the target and does the last part as a second move. Moves against the backlash
+    direction go past the target and come back.
+    """
+    distance = np.asarray(distance, dtype=float)
+    velocity, acceleration = kinematics["velocity"], kinematics["acceleration"]
+    backlash = kinematics["backlash"]
+    if backlash == 0:
+        return trapezoid_time(distance, velocity, acceleration)
+    first_move = np.where(
+        np.sign(distance) == np.sign(backlash),
+        np.abs(distance) - abs(backlash),
+        np.abs(distance) + abs(backlash),
+    )
+    corrected = trapezoid_time(first_move, velocity, acceleration) + trapezoid_time(
+        backlash, velocity, acceleration
+    )
+    direct = trapezoid_time(distance, velocity, acceleration)
+    # Moves shorter than the backlash in its direction are done at once
+    return np.select([distance == 0, first_move < 0], [0.0, direct], corrected)
+
+
+def estimate_scan_duration(
+    points, motors, kinematics, acquisition_time, overhead=0.0, start=None
+) -> dict:
+    """
+    Time of a step scan through points, a (points, motors) array, with the motors moving together from
+    start (the first point by default) to each point, then acquisition_time and overhead seconds of
+    counting and bookkeeping. kinematics is a dict of motor_kinematics for each motor name.
+
+    Return a dict with the total, motion, acquisition and overhead times, the number of points, the time
+    each motor was the slowest one (motor_times) and the dominant_motor, slowest for longest.
+    """
+    points = np.atleast_2d(np.asarray(points, dtype=float))
+    motors = list(motors)
+    start = points[0] if start is None else np.asarray(start, dtype=float)
+    steps = np.diff(np.vstack([start, points]), axis=0)
+    motor_times = {motor: 0.0 for motor in motors}
+    motion = 0.0
+    if motors:
+        times = np.column_stack(
+            [
+                move_time(steps[:, i], kinematics.get(motor, DEFAULT_KINEMATICS))
+                for i, motor in enumerate(motors)
+            ]
+        )
+        slowest = np.argmax(times, axis=1)
+        step_times = times[np.arange(len(points)), slowest]
+        motion = float(step_times.sum())
+        for i, motor in enumerate(motors):
+            motor_times[motor] = float(step_times[slowest == i].sum())
+    acquisition = len(points) * float(acquisition_time)
+    overhead = len(points) * float(overhead)
+    return {
+        "total": motion + acquisition + overhead,
+        "motion": motion,
+        "acquisition": acquisition,
+        "overhead": overhead,
+        "points": len(points),
+        "motor_times": motor_times,
+        "dominant_motor": max(motor_times, key=motor_times.get) if motion else None,
+    }
+
+
+def _motor_name(motor) -> str:
+    return getattr(motor, "name", motor)
+
+
+def plan_points(scan_type: str, plan_args: list, positions: dict):
+    """
+    Motor names and (points, motors) positions visited by a DAFScan plan, from the arguments built by
+    DAFScan.build_scan_args. positions has the current position of each motor, for relative scans.
+    """
+    if scan_type in ("absolute", "relative"):
+        *groups, num = plan_args
+        motors = [_motor_name(motor) for motor in groups[::3]]
+        columns = [
+            np.linspace(start, end, int(num))
+            for start, end in zip(groups[1::3], groups[2::3])
+        ]
+        points = np.column_stack(columns)
+        if scan_type == "relative":
+            points = points + [positions[motor] for motor in motors]
+        return motors, points
+    if scan_type == "list_scan":
+        motors = [_motor_name(motor) for motor in plan_args[::2]]
+        return motors, np.column_stack([list(values) for values in plan_args[1::2]])
+    if scan_type == "grid_scan":
+        motors = [_motor_name(motor) for motor in plan_args[::4]]
+        axes = [
+            np.linspace(start, end, int(num))
+            for start, end, num in zip(
+                plan_args[1::4], plan_args[2::4], plan_args[3::4]
+            )
+        ]
+        return motors, np.array(list(itertools.product(*axes)))
+    if scan_type == "stream_list_scan":
+        # Its points are solved or read while the scan runs, taking them here would consume them
+        raise ValueError(
+            "The points of a stream_list_scan are only known while it runs, estimate it as a list_scan"
+        )
+    if scan_type == "count":
+        raise ValueError("Time scans count until they are stopped")
+    raise ValueError("Can not estimate the duration of {} scans".format(scan_type))
+
+
+def format_scan_duration(estimate: dict) -> str:
+    """Human readable summary of estimate_scan_duration"""
+    lines = [
+        "Estimated duration for {} points: {:.1f} s".format(
+            estimate["points"], estimate["total"]
+        ),
+        "  motion:      {:.1f} s".format(estimate["motion"]),
+        "  acquisition: {:.1f} s".format(estimate["acquisition"]),
+        "  overhead:    {:.1f} s".format(estimate["overhead"]),
+    ]
+    if estimate["dominant_motor"] is not None:
+        lines.append("  dominant motor: {}".format(estimate["dominant_motor"]))
+        for motor, elapsed in estimate["motor_times"].items():
+            lines.append("    {:<12} {:.1f} s".format(motor + ":", elapsed))
+    return "\n".join(lines)
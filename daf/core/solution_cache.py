@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""On-disk LRU cache of motor_angles solutions"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def _canonical(value):
+    """Turn nested experiment state into plain JSON types, rounding floats so equal states get equal keys"""
+    if isinstance(value, dict):
+        return {str(key): _canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_canonical(item) for item in value]
+    if isinstance(value, (bool, np.bool_, str)) or value is None:
+        return value
+    return round(float(value), 10)
+
+
+class SolutionCache:
+    """Store motor angles and qerror of solved HKLs in a sqlite file, keyed by a hash of the experiment state.
+    When there are more than max_entries solutions, the least recently used ones are removed"""
+
+    def __init__(self, path, max_entries=1000):
+        self.path = str(path)
+        self.max_entries = max_entries
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS solutions "
+                "(key TEXT PRIMARY KEY, angles TEXT, qerror REAL, last_used REAL)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        """Open the cache file, commit on success and always close it"""
+        connection = sqlite3.connect(self.path, timeout=5)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def make_key(state: dict) -> str:
+        """Hash a dict with the experiment state"""
+        text = json.dumps(_canonical(state), sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key: str):
+        """Return (angles, qerror) stored under key, or None if it is not in the cache"""
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT angles, qerror FROM solutions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE solutions SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+        return np.array(json.loads(row[0])), row[1]
+
+    def put(self, key: str, angles, qerror: float) -> None:
+        """Store a solution and evict the least recently used ones above max_entries"""
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps([float(angle) for angle in angles]),
+                    float(qerror),
+                    time.time(),
+                ),
+            )
+            connection.execute(
+                "DELETE FROM solutions WHERE key NOT IN "
+                "(SELECT key FROM solutions ORDER BY last_used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        """Remove all stored solutions"""
+        with self._connect() as connection:
+            connection.execute("DELETE FROM solutions")
+
+    def __len__(self):
+        with self._connect() as connection:
+            return connection.execute("SELECT COUNT(*) FROM solutions").fetchone()[0]
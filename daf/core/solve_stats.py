@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Instrumentation of the motor_angles solver: fit calls, start values, evaluation counts and stage timings"""
+
+import time
+
+import numpy as np
+import xrayutilities as xu
+
+
+class _CountingAng2Q:
+    """Forward Ang2Q.point, the Q2AngFit objective, counting the calls"""
+
+    def __init__(self, ang2q):
+        self.ang2q = ang2q
+        self.calls = 0
+
+    def point(self, *args, **kwargs):
+        self.calls += 1
+        return self.ang2q.point(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.ang2q, name)
+
+
+class CountingExperiment:
+    """Proxy of a xrayutilities experiment that counts how many times Q2AngFit evaluates its objective"""
+
+    def __init__(self, experiment):
+        self.experiment = experiment
+        self.Ang2Q = _CountingAng2Q(experiment.Ang2Q)
+
+    def __getattr__(self, name):
+        return getattr(self.experiment, name)
+
+
+def counted_q2angfit(q_lab, hrxrd, bounds, U, start, restrict=(), extra=()):
+    """Run xu.Q2AngFit counting the objective, constraint and constraint jacobian evaluations.
+    The constraints in extra are passed to the fit without being counted.
+    Return (angles, qerror, errcode) and a dict with the counts and the fit time"""
+    counts = {"constraint_evaluations": 0, "jacobian_evaluations": 0}
+
+    def counted(function, key):
+        def wrapper(*args):
+            counts[key] += 1
+            return function(*args)
+
+        return wrapper
+
+    constraints = []
+    for constraint in restrict:
+        constraint = dict(constraint)
+        constraint["fun"] = counted(constraint["fun"], "constraint_evaluations")
+        if "jac" in constraint:
+            constraint["jac"] = counted(constraint["jac"], "jacobian_evaluations")
+        constraints.append(constraint)
+
+    experiment = CountingExperiment(hrxrd)
+    started = time.perf_counter()
+    result = xu.Q2AngFit(
+        q_lab,
+        experiment,
+        bounds,
+        startvalues=start,
+        constraints=constraints + list(extra),
+        ormat=U,
+    )
+    counts["objective_evaluations"] = experiment.Ang2Q.calls
+    counts["time"] = time.perf_counter() - started
+    return result, counts
+
+
+def new_solve_stats(hkl, mode) -> dict:
+    """Empty profile of a motor_angles call"""
+    return {
+        "hkl": [float(i) for i in np.ravel(hkl)],
+        "mode": "".join(str(i) for i in mode),
+        "method": None,
+        "q2angfit_calls": 0,
+        "start_vectors": [],
+        "objective_evaluations": 0,
+        "constraint_evaluations": 0,
+        "jacobian_evaluations": 0,
+        "stage_times": {},
+        "qerror": None,
+        "total_time": 0.0,
+    }
+
+
+def add_fit_to_stats(stats: dict, start, counts: dict) -> None:
+    """Account a Q2AngFit call in the solve profile"""
+    stats["q2angfit_calls"] += 1
+    stats["start_vectors"].append([float(i) for i in start])
+    for key in (
+        "objective_evaluations",
+        "constraint_evaluations",
+        "jacobian_evaluations",
+    ):
+        stats[key] += counts[key]
+
+
+def _format_hkl(hkl) -> str:
+    return "({})".format(", ".join("{:g}".format(round(i, 5)) for i in hkl))
+
+
+def format_solve_stats(stats: dict) -> str:
+    """Human readable profile of a single solve"""
+    lines = [
+        "Solver profile for HKL {} (mode {})".format(
+            _format_hkl(stats["hkl"]), stats["mode"]
+        ),
+        "  method:                 {}".format(stats["method"]),
+        "  total time:             {:.4f} s".format(stats["total_time"]),
+    ]
+    for stage, elapsed in stats["stage_times"].items():
+        lines.append("    {:<21} {:.4f} s".format(stage + ":", elapsed))
+    lines += [
+        "  Q2AngFit calls:         {}".format(stats["q2angfit_calls"]),
+        "  objective evaluations:  {}".format(stats["objective_evaluations"]),
+        "  constraint evaluations: {}".format(stats["constraint_evaluations"]),
+        "  jacobian evaluations:   {}".format(stats["jacobian_evaluations"]),
+        "  qerror:                 {:.2e}".format(stats["qerror"]),
+    ]
+    for start in stats["start_vectors"]:
+        lines.append("  start: " + " ".join("{:.3f}".format(i) for i in start))
+    return "\n".join(lines)
+
+
+def format_trajectory_stats(stats_list: list, slowest: int = 5) -> str:
+    """Human readable summary of the profiles of every point of a trajectory"""
+    if not stats_list:
+        return "No solver profile recorded"
+    total = sum(stats["total_time"] for stats in stats_list)
+    stages = {}
+    methods = {}
+    for stats in stats_list:
+        methods[stats["method"]] = methods.get(stats["method"], 0) + 1
+        for stage, elapsed in stats["stage_times"].items():
+            stages[stage] = stages.get(stage, 0) + elapsed
+    lines = [
+        "Solver profile for {} points".format(len(stats_list)),
+        "  total time:             {:.4f} s".format(total),
+        "  mean time per point:    {:.4f} s".format(total / len(stats_list)),
+    ]
+    for stage, elapsed in stages.items():
+        lines.append("    {:<21} {:.4f} s".format(stage + ":", elapsed))
+    lines += [
+        "  methods:                "
+        + ", ".join("{}: {}".format(key, value) for key, value in methods.items()),
+        "  Q2AngFit calls:         {}".format(
+            sum(stats["q2angfit_calls"] for stats in stats_list)
+        ),
+        "  objective evaluations:  {}".format(
+            sum(stats["objective_evaluations"] for stats in stats_list)
+        ),
+        "  constraint evaluations: {}".format(
+            sum(stats["constraint_evaluations"] for stats in stats_list)
+        ),
+        "  max qerror:             {:.2e}".format(
+            max(stats["qerror"] for stats in stats_list)
+        ),
+        "  slowest points:",
+    ]
+    for stats in sorted(stats_list, key=lambda i: i["total_time"], reverse=True)[
+        :slowest
+    ]:
+        lines.append(
+            "    HKL {} {:.4f} s ({}, {} fits)".format(
+                _format_hkl(stats["hkl"]),
+                stats["total_time"],
+                stats["method"],
+                stats["q2angfit_calls"],
+            )
+        )
+    return "\n".join(lines)
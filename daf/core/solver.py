@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Stateless HKL solver.
+
+SolverContext holds everything a solution depends on (geometry, sample, U matrix, bounds, mode and
+constraints) and is immutable, solve is a pure function of a context, an HKL and start values. One
+context can be shared by threads, process pools, GUIs and servers without copying DAF objects.
+MinimizationProc.motor_angles is a wrapper around solve that keeps the results as DAF attributes.
+"""
+
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import dataclasses
+from dataclasses import dataclass, field
+
+import numpy as np
+from numpy import linalg as LA
+import xrayutilities as xu
+
+from daf.core.analytic_solver import (
+    MOTOR_ORDER,
+    closed_form_solutions,
+    has_closed_form,
+    wrap_to_bounds,
+)
+from daf.core.forward_kinematics import get_forward_kinematics
+from daf.core.matrix_utils import (
+    calculate_pseudo_angle_jacobians,
+    calculate_pseudo_angle_sample_terms,
+    calculate_pseudo_angles_from_motor_angles_array,
+)
+from daf.core.solution_cache import SolutionCache
+from daf.core.solve_stats import add_fit_to_stats, counted_q2angfit, new_solve_stats
+
+MOTOR_CONSTRAINTS = ("Mu", "Eta", "Chi", "Phi", "Nu", "Del")
+PSEUDO_ANGLES = (
+    "twotheta",
+    "theta",
+    "alpha",
+    "qaz",
+    "naz",
+    "tau",
+    "psi",
+    "beta",
+    "omega",
+)
+# Start values of the multi start fits, phi is replaced by each seed
+MULTI_START_GUESS = (45, 45, 45, 45, 45, 45)
+
+
+class FitCancelled(Exception):
+    """Raised inside a running fit to stop it once another start value already converged"""
+
+
+# Fit of the worker processes of multi_start_fit, set by _set_multi_start_job when they are forked
+_WORKER_JOB = None
+
+
+def _frozen_array(value) -> np.ndarray:
+    array = np.array(value, dtype=float)
+    array.setflags(write=False)
+    return array
+
+
+def _frozen_bounds(bounds) -> tuple:
+    return tuple(
+        tuple(float(i) for i in bound)
+        if isinstance(bound, (list, tuple, np.ndarray))
+        else float(bound)
+        for bound in bounds
+    )
+
+
+@dataclass(frozen=True, eq=False)
+class SolverContext:
+    """Immutable description of an experiment, everything solve needs besides the HKL and start values.
+    Bounds follow the DAF convention: a number for fixed motors and (min, max) for free ones"""
+
+    sample: xu.materials.Crystal
+    U: np.ndarray
+    energy: float
+    bounds: tuple
+    mode: tuple = (0, 0, 0, 0, 0)
+    constraints: tuple = ()
+    idir: tuple = (0, 0, 1)
+    ndir: tuple = (1, 1, 0)
+    rdir: tuple = (0, 0, 1)
+    sampleor: str = "x+"
+    multi_start_seeds: tuple = (0, 90, 180, 270)
+    multi_start_workers: int = 1
+    # Built from the fields above when it is not given
+    hrxrd: xu.HXRD = field(default=None, repr=False)
+
+    def __post_init__(self):
+        # Fields are normalized to immutable types, frozen dataclasses only allow it through object
+        set_field = object.__setattr__
+        set_field(self, "U", _frozen_array(self.U))
+        set_field(self, "bounds", _frozen_bounds(self.bounds))
+        mode = tuple(int(i) for i in self.mode)
+        set_field(self, "mode", mode + (0,) * (5 - len(mode)))
+        set_field(self, "constraints", tuple((str(k), v) for k, v in self.constraints))
+        for name in ("idir", "ndir", "rdir", "multi_start_seeds"):
+            set_field(self, name, tuple(getattr(self, name)))
+        if self.hrxrd is None:
+            set_field(
+                self,
+                "hrxrd",
+                xu.HXRD(
+                    self.idir,
+                    self.ndir,
+                    en=self.energy,
+                    qconv=xu.experiment.QConversion(
+                        ["x+", "z-", "y+", "z-"], ["x+", "z-"], [0, 1, 0]
+                    ),
+                    sampleor=self.sampleor,
+                ),
+            )
+
+    def __reduce__(self):
+        # xrayutilities crystals can not be pickled, send the sample as its lattice so contexts
+        # can be passed to process pools
+        sample = self.sample
+        fields = {
+            item.name: getattr(self, item.name)
+            for item in dataclasses.fields(self)
+            if item.name != "sample"
+        }
+        return (
+            _unpickle_context,
+            ((sample.name, sample.lattice, sample.cij, sample.thetaDebye), fields),
+        )
+
+    @classmethod
+    def from_daf(cls, exp):
+        """Snapshot of the current state of a DAF object"""
+        return cls(
+            sample=exp.samp,
+            U=exp.U,
+            energy=exp.en,
+            bounds=exp.bounds,
+            mode=(exp.col1, exp.col2, exp.col3, exp.col4, exp.col5),
+            constraints=exp.pseudo_constraints_w_value_list,
+            idir=exp.idir,
+            ndir=exp.ndir,
+            rdir=exp.nref,
+            sampleor=exp.sampleor,
+            multi_start_seeds=exp.multi_start_seeds,
+            multi_start_workers=exp.multi_start_workers,
+            hrxrd=exp.hrxrd,
+        )
+
+    @property
+    def wave_length(self) -> float:
+        return xu.en2lam(self.energy)
+
+    def replace(self, **changes):
+        """Return a new context with some fields changed"""
+        if not {"idir", "ndir", "sampleor", "energy"}.isdisjoint(changes):
+            changes.setdefault("hrxrd", None)
+        return dataclasses.replace(self, **changes)
+
+    def q_lab(self, hkl) -> np.ndarray:
+        """Scattering vector of hkl in the laboratory frame, for one HKL or an (N, 3) array"""
+        return self.hrxrd.Transform(self.sample.Q(hkl))
+
+
+def _unpickle_context(sample, fields):
+    return SolverContext(sample=xu.materials.Crystal(*sample), **fields)
+
+
+@dataclass(frozen=True, eq=False)
+class Solution:
+    """Result of solve. angles are (mu, eta, chi, phi, nu, del), pseudo_angles maps the names in
+    PSEUDO_ANGLES to their values and stats is the solver profile, see daf.core.solve_stats"""
+
+    hkl: np.ndarray
+    angles: np.ndarray
+    pseudo_angles: dict
+    hkl_calc: np.ndarray
+    qerror: float
+    start: tuple
+    method: str
+    from_cache: bool
+    q_lab: np.ndarray
+    sample_terms: dict
+    stats: dict
+
+    def as_list(self) -> list:
+        """Motor angles, pseudo-angles and qerror in the order of the first list returned by motor_angles"""
+        return (
+            list(self.angles)
+            + [self.pseudo_angles[name] for name in PSEUDO_ANGLES]
+            + ["{0:.2e}".format(self.qerror)]
+        )
+
+
+def pseudo_angle_constraint(angles, pseudo_angle, fix_angle, sample_terms):
+    """Residual of a constraint for the fit, zero when it is satisfied"""
+    if pseudo_angle == "eta=del/2":
+        return angles[1] - angles[5] / 2
+    elif pseudo_angle == "mu=nu/2":
+        return angles[0] - angles[4] / 2
+
+    angles = np.asarray(angles, dtype=float) + 1e-6
+    if pseudo_angle in MOTOR_CONSTRAINTS:
+        return angles[MOTOR_CONSTRAINTS.index(pseudo_angle)] - fix_angle
+
+    pseudo_angles_dict = calculate_pseudo_angles_from_motor_angles_array(
+        *angles, sample_terms, rounded=False
+    )
+    if pseudo_angle == "aeqb":
+        return pseudo_angles_dict["beta"][0] - pseudo_angles_dict["alpha"][0]
+    if pseudo_angle in pseudo_angles_dict:
+        return pseudo_angles_dict[pseudo_angle][0] - fix_angle
+
+
+def pseudo_angle_constraint_jacobian(angles, pseudo_angle, sample_terms):
+    """Derivative of pseudo_angle_constraint with respect to (mu, eta, chi, phi, nu, del)"""
+    if pseudo_angle == "eta=del/2":
+        return np.array([0, 1, 0, 0, 0, -0.5])
+    elif pseudo_angle == "mu=nu/2":
+        return np.array([1, 0, 0, 0, -0.5, 0])
+    elif pseudo_angle in MOTOR_CONSTRAINTS:
+        return np.eye(6)[MOTOR_CONSTRAINTS.index(pseudo_angle)]
+
+    jacobians = calculate_pseudo_angle_jacobians(
+        *(np.asarray(angles) + 1e-6), sample_terms
+    )
+    if pseudo_angle == "aeqb":
+        return jacobians["beta"][0] - jacobians["alpha"][0]
+    return jacobians[pseudo_angle][0]
+
+
+def constraint_functions(constraints, sample_terms) -> list:
+    """scipy constraints, with analytic jacobians, of the (name, value) pseudo-angle constraints"""
+    return [
+        {
+            "type": "eq",
+            "fun": lambda a, name=name, value=value: pseudo_angle_constraint(
+                a, name, value, sample_terms
+            ),
+            "jac": lambda a, name=name: pseudo_angle_constraint_jacobian(
+                a, name, sample_terms
+            ),
+        }
+        for name, value in constraints
+    ]
+
+
+def closed_form_solve(context, q_lab, start, max_err=1e-5):
+    """Solve q_lab analytically when the operation mode allows it.
+    Return the angles closest to start and its qerror, or None if there is no closed form solution"""
+    if not has_closed_form(*context.mode):
+        return None
+
+    fixed_values = dict(zip(MOTOR_ORDER, context.bounds))
+    fixed_values.update(dict(context.constraints))
+    q_lab = np.asarray(q_lab, dtype=float)
+    found = []
+    for solution in closed_form_solutions(
+        context.U.dot(q_lab), context.hrxrd.k0, context.mode, fixed_values
+    ):
+        angles = [
+            wrap_to_bounds(angle, bound, reference)
+            for angle, bound, reference in zip(solution, context.bounds, start)
+        ]
+        if None in angles:
+            continue
+        qerror = LA.norm(
+            np.array(context.hrxrd.Ang2Q.point(*angles, UB=context.U)) - q_lab
+        )
+        if qerror > max_err:
+            continue
+        distance = np.sum((np.array(angles) - np.array(start)) ** 2)
+        found.append((distance, np.array(angles), qerror))
+
+    if not found:
+        return None
+    # Mirror solutions can be as far from start, prefer non-negative Del and Nu as the numeric fit does
+    nearest = min(distance for distance, _, _ in found)
+    _, angles, qerror = min(
+        (solution for solution in found if np.isclose(solution[0], nearest)),
+        key=lambda solution: (solution[1][5] < 0, solution[1][4] < 0),
+    )
+    return angles, qerror
+
+
+def _set_multi_start_job(job) -> None:
+    """Initializer of the forked workers of multi_start_fit. Arguments of forked processes are inherited,
+    not pickled, so the constraint functions and the xrayutilities experiment of job never are"""
+    global _WORKER_JOB
+    _WORKER_JOB = job
+
+
+def _multi_start_worker(start, job=None):
+    """Run the Q2AngFit of job, the one of the worker process by default, from the given start values"""
+    q_lab, hrxrd, bounds, U, restrict, cancel = job or _WORKER_JOB
+
+    def guard(angles):
+        if cancel.is_set():
+            raise FitCancelled
+        return 1.0
+
+    # An always satisfied constraint that lets a fit be stopped from outside
+    result, counts = counted_q2angfit(
+        q_lab, hrxrd, bounds, U, start, restrict, [{"type": "ineq", "fun": guard}]
+    )
+    return start, result, counts
+
+
+def _can_fork() -> bool:
+    """Forking is only safe from the main thread of a process without other threads"""
+    return (
+        "fork" in multiprocessing.get_all_start_methods()
+        and threading.current_thread() is threading.main_thread()
+        and threading.active_count() == 1
+    )
+
+
+def multi_start_seeds(context, q_lab) -> list:
+    """Start values of multi_start_fit: the Q2Ang guess and MULTI_START_GUESS with every seed as phi"""
+    guess = context.hrxrd.Q2Ang(q_lab)
+    return [(0, 0, 0, 0, 0, guess[3])] + [
+        MULTI_START_GUESS[:3] + (phi,) + MULTI_START_GUESS[4:]
+        for phi in context.multi_start_seeds
+    ]
+
+
+def multi_start_fit(context, q_lab, restrict=(), max_err=1e-5, stats=None):
+    """Retry Q2AngFit from every start of multi_start_seeds. With more than one worker the fits run at the
+    same time, in forked processes, or in threads when forking is not safe, and the remaining ones are
+    cancelled as soon as one gets a qerror below max_err.
+    Return the start values and (angles, qerror, errcode) of the first converged fit, or of the best one"""
+    seeds = multi_start_seeds(context, q_lab)
+    workers = min(context.multi_start_workers, len(seeds))
+    fork = workers > 1 and _can_fork()
+    cancel = multiprocessing.get_context("fork").Event() if fork else threading.Event()
+    job = (q_lab, context.hrxrd, context.bounds, context.U, restrict, cancel)
+
+    executor = None
+    if fork:
+        executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_set_multi_start_job,
+            initargs=(job,),
+        )
+        futures = [executor.submit(_multi_start_worker, start) for start in seeds]
+    elif workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        futures = [executor.submit(_multi_start_worker, start, job) for start in seeds]
+    if executor is None:
+        results = (_multi_start_worker(start, job) for start in seeds)
+    else:
+        results = (future.result() for future in as_completed(futures))
+
+    best = None
+    try:
+        for start, result, counts in results:
+            if stats is not None:
+                add_fit_to_stats(stats, start, counts)
+            if best is None or result[1] < best[1][1]:
+                best = (start, result)
+            if result[1] < max_err:
+                break
+    finally:
+        cancel.set()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    return best
+
+
+def solution_cache_key(context, hkl, max_err=1e-5) -> str:
+    """Hash of everything that defines the solution of hkl"""
+    sample = context.sample
+    return SolutionCache.make_key(
+        {
+            "hkl": hkl,
+            "U": context.U,
+            "material": sample.name,
+            "lattice": [
+                sample.a,
+                sample.b,
+                sample.c,
+                sample.alpha,
+                sample.beta,
+                sample.gamma,
+            ],
+            "energy": context.energy,
+            "mode": list(context.mode),
+            "constraints": list(context.constraints),
+            "bounds": context.bounds,
+            "idir": context.idir,
+            "ndir": context.ndir,
+            "rdir": context.rdir,
+            "sampleor": context.sampleor,
+            "max_err": max_err,
+        }
+    )
+
+
+def _record_stage(stats, stage, started):
+    """Add the time since started to a stage of stats, return the current time"""
+    now = time.perf_counter()
+    stats["stage_times"][stage] = stats["stage_times"].get(stage, 0) + now - started
+    return now
+
+
+def solve(
+    context,
+    hkl,
+    start=(0, 0, 0, 0, 0, 0),
+    max_err=1e-5,
+    closed_form=True,
+    q_lab=None,
+    cache=None,
+) -> Solution:
+    """
+    Find the motor angles of hkl in the given context.
+
+    The cache (a SolutionCache) is looked up first, then the closed form solution, then Q2AngFit from
+    start and at last the multi start fits. q_lab may be given to skip its calculation, in that case the
+    cache is not used. Nothing but the cache is changed, so it can be called from many threads at once.
+    """
+    solve_started = stage_started = time.perf_counter()
+    hkl = np.asarray(hkl, dtype=float)
+    stats = new_solve_stats(hkl, context.mode)
+    use_cache = cache is not None and q_lab is None
+    if q_lab is None:
+        q_lab = context.q_lab(hkl)
+    sample_terms = calculate_pseudo_angle_sample_terms(
+        context.sample, hkl, context.wave_length, context.rdir, context.U
+    )
+    start = tuple(start)
+    stage_started = _record_stage(stats, "setup", stage_started)
+
+    solution = None
+    if use_cache:
+        cache_key = solution_cache_key(context, hkl, max_err)
+        solution = cache.get(cache_key)
+        stage_started = _record_stage(stats, "cache", stage_started)
+    from_cache = solution is not None
+    if from_cache:
+        stats["method"] = "cache"
+
+    if solution is None and closed_form:
+        solution = closed_form_solve(context, q_lab, start, max_err)
+        stage_started = _record_stage(stats, "closed_form", stage_started)
+        if solution is not None:
+            stats["method"] = "closed_form"
+
+    if solution is not None:
+        angles, qerror = solution
+    else:
+        restrict = constraint_functions(context.constraints, sample_terms)
+        result, counts = counted_q2angfit(
+            q_lab, context.hrxrd, context.bounds, context.U, start, restrict
+        )
+        add_fit_to_stats(stats, start, counts)
+        angles, qerror, _ = result
+        stage_started = _record_stage(stats, "fit", stage_started)
+        stats["method"] = "fit"
+
+        if qerror > max_err:
+            start, (angles, qerror, _) = multi_start_fit(
+                context, q_lab, restrict, max_err, stats
+            )
+            stage_started = _record_stage(stats, "multi_start", stage_started)
+            stats["method"] = "multi_start"
+
+    angles = np.array(angles[:6], dtype=float)
+    if use_cache and not from_cache and qerror < max_err:
+        cache.put(cache_key, angles, qerror)
+
+    hkl_calc = np.round(
+        get_forward_kinematics(context.U, context.sample.B, context.wave_length).hkl(
+            *angles
+        )[0],
+        5,
+    )
+    pseudo_angles_dict = calculate_pseudo_angles_from_motor_angles_array(
+        *angles, sample_terms
+    )
+    pseudo_angles = {name: pseudo_angles_dict[name][0] for name in PSEUDO_ANGLES}
+
+    _record_stage(stats, "pseudo_angles", stage_started)
+    stats["qerror"] = float(qerror)
+    stats["total_time"] = time.perf_counter() - solve_started
+
+    return Solution(
+        hkl=hkl,
+        angles=angles,
+        pseudo_angles=pseudo_angles,
+        hkl_calc=hkl_calc,
+        qerror=float(qerror),
+        start=start,
+        method=stats["method"],
+        from_cache=from_cache,
+        q_lab=np.asarray(q_lab),
+        sample_terms=sample_terms,
+        stats=stats,
+    )
+
+
+def iter_solve(context, hkl_array, start=(0, 0, 0, 0, 0, 0), max_err=1e-5):
+    """Solve a sequence of HKLs, every point warm-starting from the previous solution"""
+    hkl_array = np.atleast_2d(np.asarray(hkl_array, dtype=float))
+    q_lab_array = np.atleast_2d(context.q_lab(hkl_array))
+    for hkl, q_lab in zip(hkl_array, q_lab_array):
+        solution = solve(context, hkl, start, max_err=max_err, q_lab=q_lab)
+        start = solution.angles
+        yield solution
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""On-disk cache of solved scan trajectories, content addressed by a hash of the scan inputs and experiment state"""
+
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from daf.core.trajectory_writer import TRAJECTORY_DTYPE
+
+NAMES_FILE = "names.json"
+
+
+class TrajectoryCache:
+    """
+    Store solved trajectories, structured arrays with the TRAJECTORY_DTYPE fields, as .npy files named by
+    their key in directory, so they can be loaded with memory mapping. Trajectories may also be given a
+    name, e.g. the scan name, to be found by it later. When there are more than max_entries trajectories,
+    the least recently used ones are removed.
+    """
+
+    def __init__(self, directory, max_entries=100):
+        self.directory = str(directory)
+        self.max_entries = max_entries
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".npy")
+
+    def names(self) -> dict:
+        """Map of trajectory names to keys"""
+        try:
+            with open(os.path.join(self.directory, NAMES_FILE)) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_atomically(self, file_name, write) -> None:
+        """Write to a temporary file and move it to file_name, so readers never see partial files"""
+        descriptor, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                write(file)
+            os.replace(tmp_path, os.path.join(self.directory, file_name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def get(self, key: str):
+        """Return the memory mapped trajectory stored under key, or None if it is not in the cache"""
+        path = self.path(key)
+        try:
+            trajectory = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if trajectory.dtype != TRAJECTORY_DTYPE:
+            return None
+        os.utime(path)
+        return trajectory
+
+    def put(self, key: str, trajectory, name=None) -> None:
+        """Store a trajectory, and name it if name is given. Evict the least recently used ones above max_entries"""
+        trajectory = np.asarray(trajectory, dtype=TRAJECTORY_DTYPE)
+        self._save_atomically(
+            os.path.basename(self.path(key)), lambda file: np.save(file, trajectory)
+        )
+        if name is not None:
+            names = self.names()
+            names[str(name)] = key
+            self._save_names(names)
+        self.evict()
+
+    def _save_names(self, names) -> None:
+        self._save_atomically(
+            NAMES_FILE, lambda file: file.write(json.dumps(names, indent=1).encode())
+        )
+
+    def keys(self) -> list:
+        """Keys of the stored trajectories, the most recently used first"""
+        paths = [
+            os.path.join(self.directory, file_name)
+            for file_name in os.listdir(self.directory)
+            if file_name.endswith(".npy")
+        ]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        return [os.path.basename(path)[: -len(".npy")] for path in paths]
+
+    def evict(self) -> None:
+        keys = self.keys()
+        if len(keys) <= self.max_entries:
+            return
+        for key in keys[self.max_entries :]:
+            os.remove(self.path(key))
+        kept = set(keys[: self.max_entries])
+        self._save_names(
+            {name: key for name, key in self.names().items() if key in kept}
+        )
+
+    def resolve(self, key_or_name: str):
+        """Key of a trajectory given its name, its key or a unique prefix of its key. None if not found"""
+        names = self.names()
+        if key_or_name in names:
+            return names[key_or_name]
+        matches = [key for key in self.keys() if key.startswith(key_or_name)]
+        return matches[0] if len(matches) == 1 else None
+
+    def load(self, key_or_name: str):
+        """Memory mapped trajectory given its name, key or key prefix, see resolve. None if not found"""
+        key = self.resolve(key_or_name)
+        return self.get(key) if key is not None else None
+
+    def clear(self) -> None:
+        """Remove all stored trajectories"""
+        for key in self.keys():
+            os.remove(self.path(key))
+        self._save_names({})
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Solve long HKL trajectories in parallel chunks, stitching the chunks so the motors stay on one branch"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from daf.core.solver import iter_solve, solve
+
+# Accepted difference between the independent and the warm-started solution of a seam point
+SEAM_TOLERANCE = 1e-3
+
+
+def _solve_chunk(context, hkl_chunk, start, max_err, seed_first):
+    """Solve a chunk warm-starting every point from the previous one. With seed_first the first point
+    is solved on its own from start, as a serial scan would not have reached it yet"""
+    if seed_first:
+        start = solve(context, hkl_chunk[0], start, max_err=max_err).angles
+    return list(iter_solve(context, hkl_chunk, start, max_err))
+
+
+def _seam_is_continuous(context, previous, chunk, max_err, diflimit):
+    """Check if chunk starts on the branch that warm-starting from the previous chunk would follow.
+    With diflimit the jump between the chunks must not exceed it, otherwise the first point of chunk
+    is solved again from the last angles of previous and both solutions must match"""
+    last, first = previous[-1].angles, chunk[0].angles
+    if diflimit:
+        return np.max(np.abs(first - last)) <= diflimit
+    warm = solve(context, chunk[0].hkl, last, max_err=max_err, q_lab=chunk[0].q_lab)
+    return np.max(np.abs(warm.angles - first)) <= SEAM_TOLERANCE
+
+
+def solve_trajectory_in_chunks(
+    context,
+    hkl_array,
+    start=(0, 0, 0, 0, 0, 0),
+    max_err=1e-5,
+    workers=None,
+    chunks=None,
+    diflimit=0,
+):
+    """
+    Solve an (N, 3) HKL trajectory split in chunks solved at the same time by a process pool.
+
+    The first chunk starts from start, every other one from an independent solve of its first point.
+    Each seam is then checked with the previous chunk, see _seam_is_continuous, and the chunks that
+    landed on another branch are solved again warm-starting from the previous chunk, as DAF.scan would.
+    Return the list of daf.core.solver.Solution of every point.
+    """
+    hkl_array = np.atleast_2d(np.asarray(hkl_array, dtype=float))
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    chunks = max(1, min(int(chunks or workers), len(hkl_array)))
+    hkl_chunks = np.array_split(hkl_array, chunks)
+    args = [
+        (context, hkl_chunk, start, max_err, i > 0)
+        for i, hkl_chunk in enumerate(hkl_chunks)
+    ]
+
+    if workers == 1 or chunks == 1:
+        solved = [_solve_chunk(*arg) for arg in args]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, chunks)) as executor:
+            solved = list(executor.map(_solve_chunk, *zip(*args)))
+
+    for i in range(1, len(solved)):
+        if not _seam_is_continuous(
+            context, solved[i - 1], solved[i], max_err, diflimit
+        ):
+            solved[i] = list(
+                iter_solve(context, hkl_chunks[i], solved[i - 1][-1].angles, max_err)
+            )
+
+    return [solution for chunk in solved for solution in chunk]
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Read the motor positions of scan trajectories in chunks, from CSV, .npy, .npz, HDF5 or Parquet files"""
+
+import os
+
+import h5py
+import numpy as np
+import pandas as pd
+
+from daf.core.utils import DIFFRACTOMETER_MOTOR_NAMES, SCAN_COLUMNS
+
+# Points read at once
+CHUNK_SIZE = 4096
+# Group of the HDF5 files written by daf.core.trajectory_writer
+HDF5_GROUP = "trajectory"
+
+
+class TrajectoryReader:
+    """
+    Iterate over the (mu, eta, chi, phi, nu, del) points of a trajectory file, reading chunk_size points
+    at a time, so long trajectories are never fully loaded in memory.
+
+    The format is chosen by the extension of path: .npy, .npz, .h5/.hdf5, .parquet or CSV for anything
+    else. By default the column of each motor is the one DAF writes (Mu, Eta, ...) or the motor name
+    (mu, eta, ...), column_map maps motor names to other columns. Arrays without named columns, (N, 6)
+    .npy or .npz arrays, are read by position, and column_map may then give the column indices.
+    .npy files are memory mapped, Parquet files need pyarrow.
+    """
+
+    def __init__(self, path, column_map=None, chunk_size=CHUNK_SIZE, sep=","):
+        self.path = str(path)
+        self.column_map = dict(column_map or {})
+        self.chunk_size = max(1, int(chunk_size))
+        self.sep = sep
+        self.extension = os.path.splitext(self.path)[1].lower()
+
+    def columns(self, names) -> list:
+        """Column of each motor, given the column names of the file. None names means columns by position"""
+        if names is None:
+            return [
+                int(self.column_map.get(motor, index))
+                for index, motor in enumerate(DIFFRACTOMETER_MOTOR_NAMES)
+            ]
+        names = list(names)
+        columns = []
+        for motor, daf_column in zip(DIFFRACTOMETER_MOTOR_NAMES, SCAN_COLUMNS):
+            candidates = (
+                [self.column_map[motor]]
+                if motor in self.column_map
+                else [daf_column, motor]
+            )
+            found = [name for name in candidates if name in names]
+            if not found:
+                raise KeyError(
+                    "No column for {} in {}, columns are: {}".format(
+                        motor, self.path, ", ".join(map(str, names))
+                    )
+                )
+            columns.append(found[0])
+        return columns
+
+    def _array_chunks(self, array):
+        """Chunks of a structured or (N, 6) array"""
+        if array.dtype.names is not None:
+            fields = self.columns(array.dtype.names)
+            for start in range(0, len(array), self.chunk_size):
+                chunk = array[start : start + self.chunk_size]
+                yield np.column_stack([chunk[field] for field in fields])
+        else:
+            array = np.atleast_2d(array)
+            indices = self.columns(None)
+            for start in range(0, len(array), self.chunk_size):
+                yield np.asarray(array[start : start + self.chunk_size, indices])
+
+    def _npz_chunks(self):
+        with np.load(self.path) as arrays:
+            if len(arrays.files) == 1:
+                yield from self._array_chunks(arrays[arrays.files[0]])
+                return
+            # One array for each column, NpzFile only loads the ones used
+            columns = [arrays[name] for name in self.columns(arrays.files)]
+            for start in range(0, len(columns[0]), self.chunk_size):
+                yield np.column_stack(
+                    [column[start : start + self.chunk_size] for column in columns]
+                )
+
+    def _hdf5_chunks(self):
+        with h5py.File(self.path, "r") as file:
+            group = file[HDF5_GROUP] if HDF5_GROUP in file else file
+            datasets = [group[name] for name in self.columns(group.keys())]
+            for start in range(0, len(datasets[0]), self.chunk_size):
+                yield np.column_stack(
+                    [dataset[start : start + self.chunk_size] for dataset in datasets]
+                )
+
+    def _parquet_file(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading Parquet trajectories needs pyarrow installed")
+        return pq.ParquetFile(self.path)
+
+    def _parquet_chunks(self):
+        parquet_file = self._parquet_file()
+        columns = self.columns(parquet_file.schema_arrow.names)
+        for batch in parquet_file.iter_batches(
+            batch_size=self.chunk_size, columns=columns
+        ):
+            yield np.column_stack(
+                [batch.column(column).to_numpy() for column in columns]
+            )
+
+    def _csv_chunks(self):
+        names = pd.read_csv(self.path, sep=self.sep, nrows=0).columns
+        columns = self.columns(names)
+        for chunk in pd.read_csv(
+            self.path, sep=self.sep, usecols=columns, chunksize=self.chunk_size
+        ):
+            yield chunk[columns].to_numpy(dtype=float)
+
+    def chunks(self):
+        """Yield (n, 6) arrays with the next n points of the trajectory"""
+        if self.extension == ".npy":
+            yield from self._array_chunks(np.load(self.path, mmap_mode="r"))
+        elif self.extension == ".npz":
+            yield from self._npz_chunks()
+        elif self.extension in (".h5", ".hdf5"):
+            yield from self._hdf5_chunks()
+        elif self.extension == ".parquet":
+            yield from self._parquet_chunks()
+        else:
+            yield from self._csv_chunks()
+
+    def __iter__(self):
+        """Yield the [mu, eta, chi, phi, nu, del] of each point"""
+        for chunk in self.chunks():
+            yield from chunk.astype(float).tolist()
+
+    def __len__(self):
+        """Number of points, read from the file metadata when the format has it"""
+        if self.extension == ".npy":
+            return len(np.load(self.path, mmap_mode="r"))
+        if self.extension == ".parquet":
+            return self._parquet_file().metadata.num_rows
+        if self.extension in (".h5", ".hdf5"):
+            with h5py.File(self.path, "r") as file:
+                group = file[HDF5_GROUP] if HDF5_GROUP in file else file
+                return len(group[self.columns(group.keys())[0]])
+        if self.extension == ".npz":
+            return sum(len(chunk) for chunk in self.chunks())
+        # CSV, one line for each point after the header
+        with open(self.path, "rb") as file:
+            return max(0, sum(1 for line in file if line.strip()) - 1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Solve HKL trajectories ahead of their consumer, so a scan can start moving before every point is solved"""
+
+import queue
+import threading
+
+import numpy as np
+
+from daf.core.solver import iter_solve
+
+# Points solved in advance by default
+LOOK_AHEAD = 8
+
+
+class LookAheadSolver:
+    """
+    Iterate over the solutions of an HKL trajectory, solved by a worker thread.
+
+    The worker runs daf.core.solver.iter_solve, so every point warm-starts from the previous one, and
+    it stays at most look_ahead points ahead of the consumer. Solver errors are raised to the consumer
+    at the point where they happened. Stopping the iteration early, or calling close, stops the worker.
+    """
+
+    def __init__(
+        self,
+        context,
+        hkl_array,
+        start=(0, 0, 0, 0, 0, 0),
+        max_err=1e-5,
+        look_ahead=LOOK_AHEAD,
+    ):
+        self.hkl_array = np.atleast_2d(np.asarray(hkl_array, dtype=float))
+        self.queue = queue.Queue(maxsize=max(1, int(look_ahead)))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self._solve,
+            args=(context, start, max_err),
+            name="daf-look-ahead",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def _put(self, kind, value=None) -> bool:
+        """Wait for room in the queue, give up if the consumer stopped"""
+        while not self.stopped.is_set():
+            try:
+                self.queue.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _solve(self, context, start, max_err):
+        try:
+            for solution in iter_solve(context, self.hkl_array, start, max_err):
+                if not self._put("solution", solution):
+                    return
+        except Exception as exception:
+            self._put("error", exception)
+            return
+        self._put("done")
+
+    def __len__(self):
+        return len(self.hkl_array)
+
+    def __iter__(self):
+        try:
+            while True:
+                kind, value = self.queue.get()
+                if kind == "done":
+                    return
+                if kind == "error":
+                    raise value
+                yield value
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop the worker thread, the points not yet consumed are discarded"""
+        self.stopped.set()
+        self.thread.join()
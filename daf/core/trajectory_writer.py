@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Buffered writer of the scan trajectories computed by DAF.scan"""
+
+import os
+import time
+
+import h5py
+import numpy as np
+
+from daf.core.utils import SCAN_COLUMNS
+
+TRAJECTORY_DTYPE = np.dtype([(name, np.float64) for name in SCAN_COLUMNS])
+# File watched by the GUI and other tools to follow the progress of a scan
+PROGRESS_FILE = ".my_scan_counter.csv"
+
+
+def format_trajectory_row(row) -> list:
+    """Same text as the values of motor_angles: 4 decimals for angles and HKL, 2 for the error"""
+    return ["{0:.4f}".format(value) for value in tuple(row)[:-1]] + [
+        "{0:.2e}".format(row[-1])
+    ]
+
+
+class TrajectoryWriter:
+    """
+    Keep the points of a scan in a preallocated NumPy structured array, with the SCAN_COLUMNS fields.
+
+    The new rows are appended to the progress file, in the same format DAF always used for it, every
+    chunk_size rows or flush_interval seconds, keeping a single open file instead of opening it for
+    every point. write saves the whole trajectory as CSV, .npy or HDF5.
+    """
+
+    def __init__(
+        self,
+        points=1024,
+        progress_file=PROGRESS_FILE,
+        chunk_size=64,
+        flush_interval=0.5,
+    ):
+        self.data = np.empty(max(1, int(points)), dtype=TRAJECTORY_DTYPE)
+        self.rows = 0
+        self.flushed = 0
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.progress = (
+            open(progress_file, "a", newline="") if progress_file is not None else None
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def trajectory(self) -> np.ndarray:
+        """Structured array with the rows written so far"""
+        return self.data[: self.rows]
+
+    def append(self, values) -> None:
+        """Add a row with one value for each of SCAN_COLUMNS"""
+        if self.rows == len(self.data):
+            self.data = np.resize(self.data, 2 * len(self.data))
+        self.data[self.rows] = tuple(values)
+        self.rows += 1
+        if (
+            self.rows - self.flushed >= self.chunk_size
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self) -> None:
+        """Append the pending rows to the progress file"""
+        if self.progress is not None and self.rows > self.flushed:
+            self.progress.write(
+                "".join(
+                    ",".join(["0"] + format_trajectory_row(row)) + "\n"
+                    for row in self.data[self.flushed : self.rows]
+                )
+            )
+            self.progress.flush()
+        self.flushed = self.rows
+        self.last_flush = time.monotonic()
+
+    def close(self) -> None:
+        self.flush()
+        if self.progress is not None:
+            self.progress.close()
+            self.progress = None
+
+    def write(self, name, sep=",") -> None:
+        """Save the trajectory, the format is chosen by the extension of name: .npy, .h5/.hdf5 or CSV"""
+        extension = os.path.splitext(name)[1].lower()
+        if extension == ".npy":
+            np.save(name, self.trajectory)
+        elif extension in (".h5", ".hdf5"):
+            with h5py.File(name, "w") as file:
+                group = file.create_group("trajectory")
+                for column in SCAN_COLUMNS:
+                    group.create_dataset(column, data=self.trajectory[column])
+        else:
+            with open(name, "w", newline="") as file:
+                file.write(sep.join([""] + SCAN_COLUMNS) + "\n")
+                for index, row in enumerate(self.trajectory):
+                    file.write(
+                        sep.join([str(index)] + format_trajectory_row(row)) + "\n"
+                    )
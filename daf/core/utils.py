@@ -44,4 +44,30 @@ MODE_COLUMNS = {
         5: "--",
         6: "--",
     },
-}
\ No newline at end of file
+}
+
+# Names of the diffractometer motors in the experiment file, in the order of the motor angles
+DIFFRACTOMETER_MOTOR_NAMES = ["mu", "eta", "chi", "phi", "nu", "del"]
+
+# Columns of the files written by DAF.scan
+SCAN_COLUMNS = [
+    "Mu",
+    "Eta",
+    "Chi",
+    "Phi",
+    "Nu",
+    "Del",
+    "2theta",
+    "theta",
+    "alpha",
+    "qaz",
+    "naz",
+    "tau",
+    "psi",
+    "beta",
+    "omega",
+    "H",
+    "K",
+    "L",
+    "Error",
+]
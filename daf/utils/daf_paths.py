@@ -8,6 +8,8 @@ class DAFPaths:
     HOME = os.getenv("HOME")
     DAF_CONFIGS = path.join(HOME, ".daf")
     SCAN_CONFIGS = path.join(DAF_CONFIGS, "scan")
+    SOLUTION_CACHE = path.join(DAF_CONFIGS, "solution_cache.db")
+    TRAJECTORY_CACHE = path.join(DAF_CONFIGS, "trajectories")
     GLOBAL_EXPERIMENT_DEFAULT = path.join(DAF_CONFIGS, DEFAULT_FILE_NAME)
     LOCAL_EXPERIMENT_DEFAULT = path.join(".", DEFAULT_FILE_NAME)
 
@@ -8,6 +8,7 @@ import time
 import epics
 import yaml
 
+from daf.core.scan_duration import KINEMATICS_FIELDS
 from daf.utils.daf_paths import DAFPaths as dp
 
 DEFAULT = dp.check_for_local_config()
@@ -30,6 +31,12 @@ def fetch_pvs_and_check_for_connection():
         if val is None:
             print("Cannot connect to {}, PV: {}".format(key, data["motors"][key]["pv"]))
             data["motors"][key]["up"] = 0
+            continue
+        # Kept to estimate scan durations offline
+        for name, field in KINEMATICS_FIELDS.items():
+            val = epics.caget(data["motors"][key]["pv"] + "." + field, timeout=2)
+            if val is not None:
+                data["motors"][key][name] = float(val)
     return data
 
 
@@ -176,6 +183,17 @@ class DAFIO:
             if not dict_["beamline_pvs"][bl_pv]["up"]:
                 dict_["beamline_pvs"]["value"] = 0
 
+    @staticmethod
+    def update(dict_, filepath=DEFAULT):
+        """Replace the given top level keys of the experiment file, without any epics command"""
+        data = DAFIO.only_read(filepath)
+        data.update(dict_)
+        temporary = filepath + ".tmp"
+        with open(temporary, "w") as file:
+            yaml.dump(data, file)
+            file.flush()
+        os.replace(temporary, filepath)
+
     def write(self, dict_, filepath=DEFAULT):
         """Write data to experiment file and also move motors if needed"""
         if self.epics_put_flag:
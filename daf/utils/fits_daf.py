@@ -1,3 +1,6 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from lmfit.models import GaussianModel, LinearModel
 import numpy as np
 
@@ -46,3 +49,158 @@ def fitGauss(xarray, yarray):
     minv = np.min(y)
     COM = (np.multiply(x, y).sum()) / y.sum()
     return (peak, peak_position, minv, minv_position, fwhm, fwhm_position, COM, result)
+
+
+FWHM_PER_SIGMA = 2 * np.sqrt(2 * np.log(2))
+# Fraction of the peak height below which points are left out of the centre of mass guess
+GUESS_FLOOR = 0.1
+# Columns of the table returned by fit_gauss_batch
+FIT_RESULT_DTYPE = np.dtype(
+    [
+        ("counter", "U64"),
+        ("peak", float),
+        ("peak_position", float),
+        ("min", float),
+        ("min_position", float),
+        ("center", float),
+        ("fwhm", float),
+        ("amplitude", float),
+        ("slope", float),
+        ("intercept", float),
+        ("com", float),
+        ("redchi", float),
+        ("status", "U16"),
+    ]
+)
+
+
+def gauss_guesses(xarray, counters):
+    """
+    Initial Gaussian + linear parameters of each row of counters, a (counters, points) array.
+
+    The line goes through the first and last points. The centre is the centre of mass of the counter above
+    that line, counting the points higher than GUESS_FLOOR of the peak, and sigma comes from the width of
+    the points above half of the peak. Return a dict of arrays with slope, intercept, center, sigma,
+    amplitude and com, com and center being NaN when nothing is above the line.
+    """
+    x = np.asarray(xarray, dtype=float)
+    y = np.atleast_2d(np.asarray(counters, dtype=float))
+    finite = np.isfinite(y)
+    first = np.argmax(finite, axis=1)
+    last = y.shape[1] - 1 - np.argmax(finite[:, ::-1], axis=1)
+    rows = np.arange(len(y))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(
+            last > first,
+            (y[rows, last] - y[rows, first]) / (x[last] - x[first]),
+            0.0,
+        )
+        intercept = y[rows, first] - slope * x[first]
+        signal = np.where(finite, y - (slope[:, None] * x + intercept[:, None]), 0.0)
+        signal = np.clip(signal, 0, None)
+        height = signal.max(axis=1)
+        # Points below a tenth of the height are mostly noise, they would bias the centre of mass
+        signal = np.where(signal > GUESS_FLOOR * height[:, None], signal, 0.0)
+        weight = signal.sum(axis=1)
+        com = (signal * x).sum(axis=1) / weight
+    step = np.mean(np.abs(np.diff(x))) if len(x) > 1 else 1.0
+    width = np.count_nonzero(signal > height[:, None] / 2, axis=1) * step
+    sigma = np.maximum(width, step) / FWHM_PER_SIGMA
+    amplitude = height * sigma * np.sqrt(2 * np.pi)
+    return {
+        "slope": slope,
+        "intercept": intercept,
+        "center": com,
+        "sigma": sigma,
+        "amplitude": amplitude,
+        "com": com,
+    }
+
+
+def _fit_gauss_rows(xarray, counters, guesses):
+    """Fit Gaussian + linear models to each row of counters, starting from guesses. One job of a pool"""
+    model = GaussianModel() + LinearModel()
+    results = []
+    for i, y in enumerate(counters):
+        if not np.isfinite(guesses["com"][i]):
+            results.append((np.nan,) * 6 + ("no_peak",))
+            continue
+        finite = np.isfinite(y)
+        pars = model.make_params(
+            amplitude=guesses["amplitude"][i],
+            center=guesses["center"][i],
+            sigma=guesses["sigma"][i],
+            slope=guesses["slope"][i],
+            intercept=guesses["intercept"][i],
+        )
+        pars["sigma"].set(min=0)
+        try:
+            result = model.fit(y[finite], pars, x=xarray[finite])
+        except Exception:
+            results.append((np.nan,) * 6 + ("failed",))
+            continue
+        values = result.params
+        results.append(
+            (
+                values["center"].value,
+                values["fwhm"].value,
+                values["amplitude"].value,
+                values["slope"].value,
+                values["intercept"].value,
+                result.redchi,
+                "ok" if result.success else "failed",
+            )
+        )
+    return results
+
+
+def fit_gauss_batch(xarray, counters, names=None, workers=None):
+    """
+    Fit a Gaussian + linear model to many counters scanned along the same xarray.
+
+    counters is a (counters, points) array or a dict of counter name: values, names default to the dict
+    keys or to the row numbers. The initial guesses of every counter are computed at once by gauss_guesses
+    and the fits are split among workers processes, all CPUs by default, 1 fits in this process. Return a
+    structured array of FIT_RESULT_DTYPE, one row for each counter, with status "ok", "failed" (the fit
+    raised or did not converge, fit values are NaN or the last ones) or "no_peak" (nothing above the line
+    through the first and last points, nothing is fitted).
+    """
+    if isinstance(counters, dict):
+        names = list(counters) if names is None else names
+        counters = list(counters.values())
+    x = np.asarray(xarray, dtype=float)
+    y = np.atleast_2d(np.asarray(counters, dtype=float))
+    names = [str(i) for i in range(len(y))] if names is None else list(names)
+    guesses = gauss_guesses(x, y)
+
+    table = np.zeros(len(y), dtype=FIT_RESULT_DTYPE)
+    table["counter"] = names
+    masked = np.ma.masked_invalid(y)
+    table["peak"] = masked.max(axis=1).filled(np.nan)
+    table["min"] = masked.min(axis=1).filled(np.nan)
+    table["peak_position"] = x[masked.argmax(axis=1, fill_value=-np.inf)]
+    table["min_position"] = x[masked.argmin(axis=1, fill_value=np.inf)]
+    table["com"] = guesses["com"]
+
+    workers = min(workers or os.cpu_count() or 1, len(y))
+    if workers > 1:
+        chunks = np.array_split(np.arange(len(y)), workers)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    _fit_gauss_rows,
+                    x,
+                    y[chunk],
+                    {key: value[chunk] for key, value in guesses.items()},
+                )
+                for chunk in chunks
+            ]
+            results = [row for future in futures for row in future.result()]
+    else:
+        results = _fit_gauss_rows(x, y, guesses)
+    for column, values in zip(
+        ("center", "fwhm", "amplitude", "slope", "intercept", "redchi", "status"),
+        zip(*results),
+    ):
+        table[column] = values
+    return table
@@ -76,6 +76,11 @@ default = {
     "simulated": False,  # Defines in DAF will use simulated motors or not
     "kafka_topic": "EMA_bluesky",  # Defines topic used in scans
     "scan_db": "temp",  # Defines DB used in scans
+    "solver_seeds": 4,  # Number of phi start values retried when a HKL calculation does not converge
+    "solver_workers": None,  # Number of retries run at the same time, None runs them one after the other
+    "solution_cache_size": 1000,  # Max number of daf.ca/daf.mv solutions kept in the cache, 0 disables it
+    "trajectory_cache_size": 100,  # Max number of daf.scan/daf.hklmesh trajectories kept in the cache, 0 disables it
+    "scan_point_overhead": 0.0,  # Seconds lost in each scan point besides motion and counting, measured by the last scans
     "version": VERSION,
 }
 
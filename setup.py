@@ -82,7 +82,10 @@ setup(
             "daf.ffscan = daf.command_line.scan.from_file_scan:main",
             "daf.scan = daf.command_line.scan.hkl_scan:main",
             "daf.mesh = daf.command_line.scan.mesh_scan:main",
+            "daf.hklmesh = daf.command_line.scan.hkl_mesh_scan:main",
             "daf.tscan = daf.command_line.scan.time_scan:main",
+            "daf.fscan = daf.command_line.scan.fly_scan:main",
+            "daf.queue = daf.command_line.scan.scan_queue:main",
             "daf.init = daf.command_line.support.init:main",
             "daf.fetch = daf.command_line.support.fetch_pvs:main",
             "daf.guiall = daf.command_line.support.gui_all:main",
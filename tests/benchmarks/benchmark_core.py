@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Hardware-free benchmarks of the DAF calculation engine.
+
+Every case runs on pure in-memory DAF experiments, no IOC or container is needed.
+The timings are divided by the time of a fixed numpy calibration loop, so results
+from different machines can be compared against the stored baseline.
+
+Run it from the repository root:
+
+    python -m tests.benchmarks.benchmark_core
+    python -m tests.benchmarks.benchmark_core --filter motor_angles --repeat 5
+    python -m tests.benchmarks.benchmark_core --update-baseline
+
+The script exits with status 1 when a case is slower than the baseline by more
+than the tolerance factor.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from functools import partial
+
+import numpy as np
+import xrayutilities as xu
+
+from daf.core.matrix_utils import calculate_pseudo_angle_from_motor_angles
+from daf.core.reciprocal_map import get_reciprocal_space_peaks
+from tests.core.test_daf_calculations import TestDAF
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+MODES_TO_TEST = TestDAF.MODES_TO_TEST
+HKLS_TO_TEST = TestDAF.HKLS_TO_TEST
+SAMPLE_LIST = TestDAF.SAMPLE_LIST
+# Non coplanar reflections used to build the U matrix cases
+U_REFLECTIONS = ((1, 1, 1), (0, 0, 2), (2, 0, 0))
+# Reachable in every mode of MODES_TO_TEST for every sample of SAMPLE_LIST
+SCAN_RANGE = ((1, 0, 1), (1, 0, 1.1))
+ANGLE_SAMPLES = 200
+SCAN_POINTS = 10
+# Cases faster than this (seconds) are not flagged as regressions, their timings are mostly noise
+NOISE_FLOOR = 1e-3
+
+
+def mode_name(mode):
+    return "".join(str(i) for i in mode)
+
+
+def build_experiment(mode=(2, 0, 5, 2), sample="Si"):
+    exp = TestDAF.build_experiment(mode)
+    exp.set_material(sample)
+    exp.build_xrd_experiment()
+    return exp
+
+
+def calibrate(repeat=5):
+    """Time of a fixed numpy workload, used to normalize the benchmark timings"""
+    matrix = np.random.default_rng(0).random((200, 200))
+
+    def workload():
+        result = matrix
+        for _ in range(20):
+            result = np.sin(result.dot(matrix) / 200)
+        return result
+
+    return measure(workload, repeat)
+
+
+def measure(function, repeat):
+    """Best wall time of repeat runs of function"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def random_angles(count, seed=0):
+    rng = np.random.default_rng(seed)
+    angles = rng.uniform(-20, 90, (count, 6))
+    angles[:, 4:] = rng.uniform(5, 60, (count, 2))
+    return angles
+
+
+def motor_angles_case(mode, sample):
+    exp = build_experiment(mode, sample)
+
+    def run():
+        for hkl in HKLS_TO_TEST:
+            exp.set_hkl(hkl)
+            exp.motor_angles()
+
+    return run
+
+
+def scan_case(mode, sample):
+    exp = build_experiment(mode, sample)
+
+    def run():
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                with contextlib.redirect_stderr(io.StringIO()):
+                    exp.scan(*SCAN_RANGE, SCAN_POINTS, diflimit=0)
+            finally:
+                os.chdir(cwd)
+
+    return run
+
+
+def calc_from_angs_case(sample):
+    exp = build_experiment(sample=sample)
+    angles = random_angles(ANGLE_SAMPLES)
+
+    def run():
+        for angle in angles:
+            exp.calc_from_angs(*angle)
+
+    return run
+
+
+def pseudo_angles_case(sample):
+    exp = build_experiment(sample=sample)
+    angles = random_angles(ANGLE_SAMPLES)
+    hkl = np.array((1, 1, 1))
+
+    def run():
+        for angle in angles:
+            calculate_pseudo_angle_from_motor_angles(
+                *angle, exp.samp, hkl, exp.lam, exp.nref, exp.U
+            )
+
+    return run
+
+
+def reflections_for_u(sample):
+    exp = build_experiment((0, 0, 1, 2, 3), sample)
+    exp.set_constraints(Mu=0, Chi=40, Phi=45)
+    exp.build_bounds()
+    reflections = []
+    for hkl in U_REFLECTIONS:
+        exp.set_hkl(hkl)
+        angles, _ = exp.motor_angles()
+        reflections.append((hkl, [float(i) for i in angles[:6]]))
+    return exp, reflections
+
+
+def calc_u_case(sample, n_reflections):
+    exp, reflections = reflections_for_u(sample)
+    args = [item for reflection in reflections[:n_reflections] for item in reflection]
+    calc = exp.calc_U_2HKL if n_reflections == 2 else exp.calc_U_3HKL
+
+    def run():
+        for _ in range(ANGLE_SAMPLES):
+            calc(*args)
+
+    return run
+
+
+def reciprocal_space_case(sample):
+    # two_theta_max needs free detector motors
+    exp = build_experiment((0, 0, 1, 2, 3), sample)
+    hxrd = xu.HXRD(
+        exp.idir, exp.ndir, en=exp.en, qconv=exp.qconv, sampleor=exp.sampleor
+    )
+
+    def run():
+        ttmax, _ = exp.two_theta_max()
+        get_reciprocal_space_peaks(exp.samp, hxrd, ttmax)
+
+    return run
+
+
+def benchmark_cases():
+    """Return a dict with the name and a factory of every benchmark case.
+    The factories do the setup, and return the function to be timed"""
+    cases = {}
+    for mode in MODES_TO_TEST:
+        for sample in SAMPLE_LIST:
+            key = "{},{}".format(mode_name(mode), sample)
+            cases["motor_angles[{}]".format(key)] = partial(
+                motor_angles_case, mode, sample
+            )
+            cases["scan[{}]".format(key)] = partial(scan_case, mode, sample)
+    for sample in SAMPLE_LIST:
+        cases["calc_from_angs[{}]".format(sample)] = partial(
+            calc_from_angs_case, sample
+        )
+        cases["pseudo_angles[{}]".format(sample)] = partial(pseudo_angles_case, sample)
+        cases["calc_U_2HKL[{}]".format(sample)] = partial(calc_u_case, sample, 2)
+        cases["calc_U_3HKL[{}]".format(sample)] = partial(calc_u_case, sample, 3)
+        cases["reciprocal_space_peaks[{}]".format(sample)] = partial(
+            reciprocal_space_case, sample
+        )
+    return cases
+
+
+def run_benchmarks(repeat=3, name_filter=None, verbose=True):
+    """Time every case and return a dict ready to be dumped as JSON"""
+    calibration = calibrate()
+    results = {}
+    for name, factory in benchmark_cases().items():
+        if name_filter and name_filter not in name:
+            continue
+        try:
+            elapsed = measure(factory(), repeat)
+        except Exception as exception:
+            results[name] = {"time": None, "normalized": None, "error": str(exception)}
+            if verbose:
+                print("{:<40} failed: {}".format(name, exception))
+            continue
+        results[name] = {"time": elapsed, "normalized": elapsed / calibration}
+        if verbose:
+            print("{:<40} {:.4f} s".format(name, elapsed))
+    return {
+        "machine": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "xrayutilities": xu.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+        },
+        "repeat": repeat,
+        "calibration": calibration,
+        "results": results,
+    }
+
+
+def compare(current, baseline, tolerance):
+    """Return the list of (name, ratio) of the cases slower than baseline by more than tolerance"""
+    regressions = []
+    for name, result in current["results"].items():
+        reference = baseline["results"].get(name)
+        if reference is None or reference["normalized"] is None:
+            continue
+        if result["normalized"] is None:
+            regressions.append((name, float("inf")))
+            continue
+        ratio = result["normalized"] / reference["normalized"]
+        if ratio > tolerance and result["time"] > NOISE_FLOOR:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the DAF calculation engine without hardware"
+    )
+    parser.add_argument("-o", "--output", help="Write the timings to this JSON file")
+    parser.add_argument(
+        "-b", "--baseline", default=BASELINE, help="Baseline JSON to compare against"
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        type=float,
+        default=2.0,
+        help="Slowdown factor above which a case is a regression",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="Runs per case, the best is kept"
+    )
+    parser.add_argument("-f", "--filter", help="Only run cases containing this text")
+    parser.add_argument(
+        "-u",
+        "--update-baseline",
+        action="store_true",
+        help="Store the timings as the new baseline",
+    )
+    args = parser.parse_args(argv)
+
+    xu.config.VERBOSITY = 0
+    current = run_benchmarks(args.repeat, args.filter)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(current, file, indent=2)
+        print("Baseline written to {}".format(args.baseline))
+        return 0
+    if not os.path.isfile(args.baseline):
+        print("No baseline found at {}".format(args.baseline))
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = compare(current, baseline, args.tolerance)
+    for name, ratio in regressions:
+        print("REGRESSION {:<40} {:.2f}x slower than baseline".format(name, ratio))
+    if not regressions:
+        print("No regressions above {}x".format(args.tolerance))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from daf.command_line.scan.document_publisher import (
+    DocumentPublisher,
+    FileTransport,
+    MemoryTransport,
+    read_file_transport,
+)
+
+
+def serialize(document):
+    return json.dumps(document).encode()
+
+
+class SlowTransport(MemoryTransport):
+    """Transport that only sends after release is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def send(self, topic, payload):
+        self.release.wait()
+        super().send(topic, payload)
+
+
+class TestDocumentPublisher(unittest.TestCase):
+    DOCUMENTS = (
+        [("start", {"uid": "a"})]
+        + [("event", {"seq_num": i}) for i in range(1, 50)]
+        + [("stop", {"exit_status": "success"})]
+    )
+
+    def test_GIVEN_a_memory_transport_WHEN_publishing_a_run_THEN_check_if_every_document_is_sent_in_order(
+        self,
+    ):
+        transport = MemoryTransport()
+        publisher = DocumentPublisher("topic", transport, serialize)
+        for name, doc in self.DOCUMENTS:
+            publisher(name, doc)
+        # The stop document flushes the queue
+        self.assertEqual(len(transport.messages), len(self.DOCUMENTS))
+        publisher.close()
+        self.assertEqual(
+            [json.loads(payload) for _, payload in transport.messages],
+            [list(document) for document in self.DOCUMENTS],
+        )
+        self.assertEqual({topic for topic, _ in transport.messages}, {"topic"})
+        self.assertEqual(publisher.metrics["sent"], len(self.DOCUMENTS))
+
+    def test_GIVEN_documents_of_another_topic_WHEN_publishing_them_THEN_check_they_share_the_transport(
+        self,
+    ):
+        transport = MemoryTransport()
+        publisher = DocumentPublisher("topic", transport, serialize)
+        publisher("start", {"uid": "a"})
+        publisher("peak_stats", {"diode": {"cen": 1.0}}, topic="topic_peak_stats")
+        publisher("stop", {"exit_status": "success"})
+        self.assertEqual(
+            [topic for topic, _ in transport.messages],
+            ["topic", "topic_peak_stats", "topic"],
+        )
+        publisher.close()
+
+    def test_GIVEN_a_file_transport_WHEN_publishing_a_run_THEN_check_if_file_has_the_documents(
+        self,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "documents.bin")
+            publisher = DocumentPublisher("topic", FileTransport(path), serialize)
+            for name, doc in self.DOCUMENTS:
+                publisher(name, doc)
+            publisher.close()
+            payloads = read_file_transport(path)
+        self.assertEqual(
+            [json.loads(payload) for payload in payloads],
+            [list(document) for document in self.DOCUMENTS],
+        )
+
+    def test_GIVEN_a_slow_transport_WHEN_the_queue_is_full_THEN_check_if_documents_are_dropped_or_wait(
+        self,
+    ):
+        transport = SlowTransport()
+        publisher = DocumentPublisher(
+            "topic", transport, serialize, max_queued=5, block=False
+        )
+        for name, doc in self.DOCUMENTS[:-1]:
+            publisher(name, doc)
+        self.assertGreater(publisher.metrics["dropped"], 0)
+        self.assertLessEqual(publisher.metrics["max_queued"], 5)
+        transport.release.set()
+        publisher.close()
+        self.assertEqual(
+            publisher.metrics["sent"] + publisher.metrics["dropped"],
+            len(self.DOCUMENTS) - 1,
+        )
+
+        transport = SlowTransport()
+        publisher = DocumentPublisher("topic", transport, serialize, max_queued=5)
+        threading.Timer(0.1, transport.release.set).start()
+        for name, doc in self.DOCUMENTS:
+            publisher(name, doc)
+        publisher.close()
+        self.assertEqual(publisher.metrics["dropped"], 0)
+        self.assertGreater(publisher.metrics["blocked_time"], 0)
+        self.assertEqual(len(transport.messages), len(self.DOCUMENTS))
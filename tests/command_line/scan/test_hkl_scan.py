@@ -0,0 +1,46 @@
+import sys
+
+import pytest
+
+from daf.command_line.scan.hkl_scan import HKLScan
+
+HKL_SCAN = ["daf.scan", "1", "1", "1", "1.1", "1.1", "1.1", "10", ".1"]
+
+
+class RecordedExperiment:
+    """Experiment keeping the arguments of scan_points instead of solving the scan"""
+
+    def __init__(self):
+        self.kwargs = None
+
+    def set_trajectory_cache(self, path, size):
+        pass
+
+    def scan_points(self, *args, **kwargs):
+        self.kwargs = kwargs
+        return iter([])
+
+
+def hkl_scan(monkeypatch, arguments):
+    """HKLScan of daf.scan with arguments, without reading an experiment file"""
+    monkeypatch.setattr(sys, "argv", HKL_SCAN + arguments)
+    obj = HKLScan.__new__(HKLScan)
+    obj.experiment_file_dict = {"trajectory_cache_size": 0}
+    obj.parsed_args = obj.parse_command_line()
+    obj.parsed_args_dict = vars(obj.parsed_args)
+    return obj
+
+
+def test_stream_with_adaptive_steps_is_rejected(monkeypatch, capsys):
+    with pytest.raises(SystemExit):
+        hkl_scan(monkeypatch, ["--stream", "--adaptive", "0.5"])
+    assert "--adaptive can not be used with --stream" in capsys.readouterr().err
+
+
+def test_streamed_scan_is_solved_with_the_workers(monkeypatch):
+    obj = hkl_scan(monkeypatch, ["--stream", "-w", "4"])
+    exp = RecordedExperiment()
+    monkeypatch.setattr(obj, "build_exp", lambda: exp)
+    monkeypatch.setattr(obj, "diffractometer_motor_start_values", lambda: [0] * 6)
+    obj.generate_streamed_data_for_scan()
+    assert exp.kwargs["workers"] == 4
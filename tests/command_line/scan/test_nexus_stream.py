@@ -0,0 +1,137 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+import h5py
+import numpy as np
+
+from daf.command_line.scan.nexus_stream import StreamingNexusWriter
+
+
+class TestStreamingNexusWriter(unittest.TestCase):
+    def test_GIVEN_a_running_scan_WHEN_reading_the_nexus_file_THEN_check_if_events_are_visible_before_the_end(
+        self,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "scan.nxs")
+            writer = StreamingNexusWriter(path, flush_rows=10, flush_interval=60)
+            writer(
+                "start",
+                {
+                    "uid": "s",
+                    "time": 1.0,
+                    "motors": ["eta"],
+                    "main_counter": "roi",
+                    "plan_name": "scan",
+                },
+            )
+            writer(
+                "descriptor",
+                {
+                    "uid": "d",
+                    "run_start": "s",
+                    "name": "primary",
+                    "data_keys": {
+                        "eta": {"dtype": "number", "shape": [], "source": "PV:eta"},
+                        "roi": {"dtype": "integer", "shape": [], "source": "PV:roi"},
+                        "image": {
+                            "dtype": "array",
+                            "shape": [4, 4],
+                            "source": "AD",
+                            "external": "FILESTORE:",
+                        },
+                    },
+                },
+            )
+            for i in range(25):
+                writer(
+                    "event",
+                    {
+                        "descriptor": "d",
+                        "seq_num": i + 1,
+                        "time": 2.0 + i,
+                        "data": {"eta": 0.5 * i, "roi": i * i, "image": "ref"},
+                    },
+                )
+
+            with h5py.File(path, "r", libver="latest", swmr=True) as reader:
+                data = reader["entry/data"]
+                self.assertEqual(data.attrs["signal"], "roi")
+                self.assertNotIn("image", data)
+                self.assertEqual(len(data["eta"]), 20)
+                np.testing.assert_array_equal(data["roi"][:], np.arange(20) ** 2)
+                self.assertTrue(np.isnan(reader["entry/end_time"][()]))
+
+            writer(
+                "stop",
+                {"uid": "e", "run_start": "s", "time": 30.0, "exit_status": "success"},
+            )
+            with h5py.File(path, "r") as reader:
+                np.testing.assert_allclose(
+                    reader["entry/data/eta"][:], 0.5 * np.arange(25)
+                )
+                np.testing.assert_allclose(
+                    reader["entry/data/time"][:], 2.0 + np.arange(25)
+                )
+                self.assertEqual(reader["entry/end_time"][()], 30.0)
+                self.assertEqual(reader["entry/exit_status"][()].strip(), b"success")
+                self.assertEqual(reader["entry/metadata"].attrs["plan_name"], "scan")
+
+    def test_GIVEN_events_missing_data_keys_WHEN_writing_them_THEN_check_the_fill_value_of_each_dtype(
+        self,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "scan.nxs")
+            writer = StreamingNexusWriter(path)
+            writer("start", {"uid": "s", "time": 1.0, "motors": ["eta"]})
+            writer(
+                "descriptor",
+                {
+                    "uid": "d",
+                    "name": "primary",
+                    "data_keys": {
+                        "eta": {"dtype": "number", "shape": []},
+                        "roi": {"dtype": "integer", "shape": []},
+                        "spectrum": {"dtype": "array", "shape": [3]},
+                        "status": {"dtype": "string", "shape": []},
+                    },
+                },
+            )
+            events = [
+                {"eta": 0.0, "roi": 7, "spectrum": [1, 2, 3], "status": "ok"},
+                {"eta": 1.0},
+            ]
+            for i, data in enumerate(events):
+                writer(
+                    "event",
+                    {
+                        "descriptor": "d",
+                        "seq_num": i + 1,
+                        "time": 2.0 + i,
+                        "data": data,
+                    },
+                )
+            writer("stop", {"uid": "e", "time": 4.0, "exit_status": "success"})
+            with h5py.File(path, "r") as reader:
+                data = reader["entry/data"]
+                np.testing.assert_array_equal(data["roi"][:], [7, 0])
+                np.testing.assert_array_equal(data["spectrum"][0], [1, 2, 3])
+                self.assertTrue(np.isnan(data["spectrum"][1]).all())
+                self.assertEqual(list(data["status"].asstr()[:]), ["ok", ""])
+
+    def test_GIVEN_an_error_writing_the_file_WHEN_receiving_documents_THEN_check_the_scan_is_not_stopped(
+        self,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            writer = StreamingNexusWriter(
+                os.path.join(tmp, "missing_directory", "scan.nxs")
+            )
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+                io.StringIO()
+            ):
+                writer("start", {"uid": "s", "time": 1.0})
+                writer("stop", {"uid": "e", "time": 2.0})
+            self.assertTrue(writer.failed)
+            self.assertIsNone(writer.file)
@@ -0,0 +1,135 @@
+import unittest
+
+import numpy as np
+from bluesky.callbacks.fitting import PeakStats
+
+from daf.command_line.scan.peak_stats import CounterPeakStats, OnlinePeakStats
+
+
+def gaussian(x, centre, fwhm, height=100.0, background=5.0):
+    sigma = fwhm / (2 * np.sqrt(2 * np.log(2)))
+    return background + height * np.exp(-((x - centre) ** 2) / (2 * sigma**2))
+
+
+class TestPeakStats(unittest.TestCase):
+    def run_documents(self, x, counters, published=None, interval=0):
+        callback = OnlinePeakStats(publish=published, interval=interval)
+        callback("start", {"uid": "run", "motors": ["eta"], "main_motor": "eta"})
+        data_keys = {
+            "eta": {"dtype": "number", "shape": [], "object_name": "eta"},
+            "eta_user_setpoint": {"dtype": "number", "shape": [], "object_name": "eta"},
+            "image": {"dtype": "array", "shape": [10, 10], "external": "FILESTORE:"},
+        }
+        data_keys.update({name: {"dtype": "number", "shape": []} for name in counters})
+        callback(
+            "descriptor", {"uid": "primary", "name": "primary", "data_keys": data_keys}
+        )
+        for i, position in enumerate(x):
+            data = {"eta": position, "eta_user_setpoint": position}
+            data.update({name: values[i] for name, values in counters.items()})
+            callback("event", {"descriptor": "primary", "seq_num": i + 1, "data": data})
+        callback("stop", {"exit_status": "success"})
+        return callback
+
+    def test_GIVEN_a_gaussian_scan_WHEN_streaming_its_events_THEN_check_peak_statistics(
+        self,
+    ):
+        x = np.linspace(10, 20, 201)
+        y = gaussian(x, 14.3, 1.2)
+        callback = self.run_documents(x, {"diode": y})
+        peaks = callback.peaks
+        self.assertEqual(list(callback.counters), ["diode"])
+        # The background is not subtracted, as in bluesky PeakStats
+        self.assertAlmostEqual(peaks["com"]["diode"], np.average(x, weights=y), 10)
+        self.assertAlmostEqual(peaks["cen"]["diode"], 14.3, places=2)
+        self.assertAlmostEqual(peaks["fwhm"]["diode"], 1.2, places=2)
+        self.assertAlmostEqual(peaks["max"]["diode"][0], 14.3, places=1)
+        self.assertAlmostEqual(peaks["min"]["diode"][1], 5.0, places=3)
+
+    def test_GIVEN_a_publish_function_WHEN_streaming_events_THEN_check_it_gets_the_statistics_of_each_event(
+        self,
+    ):
+        x = np.linspace(0, 1, 5)
+        published = []
+        self.run_documents(x, {"a": x, "b": 1 - x}, published.append)
+        # One for each event and the final statistics at the stop
+        self.assertEqual(len(published), 6)
+        self.assertEqual(published[-1]["a"]["max"], (1.0, 1.0))
+        self.assertEqual(published[-1]["b"]["max"], (0.0, 1.0))
+        published = []
+        self.run_documents(x, {"a": x}, published.append, interval=60)
+        self.assertEqual(len(published), 2)
+        self.assertEqual(published[-1]["a"]["max"], (1.0, 1.0))
+
+    def test_GIVEN_a_flat_counter_WHEN_computing_statistics_THEN_check_com_and_fwhm_are_none(
+        self,
+    ):
+        stats = CounterPeakStats()
+        for position in range(5):
+            stats.update(position, 3.0)
+        stats.update(5, float("nan"))
+        self.assertEqual(stats.points, 5)
+        self.assertEqual(stats.com, 2.0)
+        self.assertIsNone(stats.cen)
+        self.assertIsNone(stats.fwhm)
+        self.assertEqual(stats.max, (0.0, 3.0))
+
+    def test_GIVEN_a_noisy_gaussian_on_a_high_background_WHEN_computing_statistics_THEN_check_they_match_peak_stats(
+        self,
+    ):
+        x = np.linspace(-10, 10, 401)
+        noise = np.random.default_rng(0).uniform(-5, 5, len(x))
+        y = gaussian(x, 0.0, 2.355, background=100.0) + noise
+        callback = self.run_documents(x, {"diode": y})
+        reference = PeakStats("eta", "diode")
+        reference("start", {"uid": "run", "time": 0.0})
+        reference(
+            "descriptor",
+            {"uid": "primary", "run_start": "run", "name": "primary", "data_keys": {}},
+        )
+        for i, (position, value) in enumerate(zip(x, y)):
+            reference(
+                "event",
+                {
+                    "uid": str(i),
+                    "descriptor": "primary",
+                    "seq_num": i + 1,
+                    "time": 0.0,
+                    "data": {"eta": position, "diode": value},
+                    "timestamps": {},
+                },
+            )
+        reference("stop", {"uid": "stop", "run_start": "run", "time": 0.0})
+        peaks = callback.peaks
+        for key in ("com", "cen", "fwhm"):
+            self.assertAlmostEqual(peaks[key]["diode"], getattr(reference, key), 10)
+        self.assertAlmostEqual(peaks["fwhm"]["diode"], 2.355, delta=0.2)
+        for key in ("max", "min"):
+            np.testing.assert_allclose(peaks[key]["diode"], getattr(reference, key))
+
+    def test_GIVEN_an_edge_WHEN_computing_statistics_THEN_check_the_centre_is_its_half_maximum(
+        self,
+    ):
+        x = np.linspace(0, 10, 101)
+        stats = CounterPeakStats()
+        for position in x:
+            stats.update(position, 100 / (1 + np.exp(-(position - 1.8) / 0.1)))
+        self.assertAlmostEqual(stats.cen, 1.8, places=2)
+        self.assertIsNone(stats.fwhm)
+
+    def test_GIVEN_a_scan_longer_than_the_history_WHEN_computing_statistics_THEN_check_the_estimate(
+        self,
+    ):
+        x = np.linspace(10, 20, 10001)
+        stats = CounterPeakStats(history_points=64)
+        for position, value in zip(x, gaussian(x, 14.3, 1.2)):
+            stats.update(position, value)
+        self.assertEqual(stats.points, 10001)
+        self.assertLessEqual(stats.kept, 64)
+        self.assertAlmostEqual(stats.cen, 14.3, delta=0.05)
+        self.assertAlmostEqual(stats.fwhm, 1.2, delta=0.1)
+        self.assertEqual(stats.max, (14.3, 105.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
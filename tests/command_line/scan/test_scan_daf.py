@@ -0,0 +1,233 @@
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+from bluesky import RunEngine
+from bluesky.utils import RunEngineInterrupted
+from event_model import unpack_event_page
+from ophyd.signal import DerivedSignal
+from ophyd.sim import SynAxis, hw
+
+from daf.command_line.scan import scan_daf as sd
+from daf.command_line.scan.time_scan import TimeScan
+
+
+class CountedPoints:
+    """Iterator of points that counts how many were taken"""
+
+    def __init__(self, points):
+        self.points = iter(points)
+        self.taken = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        point = next(self.points)
+        self.taken += 1
+        return point
+
+
+class FlyAxis(SynAxis):
+    """SynAxis moving at its velocity, with the user_readback and move of an EpicsMotor"""
+
+    def __init__(self, *, name):
+        super().__init__(name=name, events_per_move=100)
+
+    @property
+    def user_readback(self):
+        return self.readback
+
+    def set(self, value):
+        self.delay = abs(value - self.sim_state["setpoint"]) / self.velocity.get()
+        return super().set(value)
+
+    def move(self, position, wait=True):
+        status = self.set(position)
+        if wait:
+            status.wait()
+        return status
+
+
+class PositionCounter(DerivedSignal):
+    """Counter reading 100 times the position of the motor it is derived from"""
+
+    def inverse(self, value):
+        return 100 * value
+
+    def forward(self, value):
+        return value / 100
+
+
+class TestStreamListScan(unittest.TestCase):
+    def test_GIVEN_a_points_iterator_WHEN_running_a_stream_list_scan_THEN_check_events_and_lazy_points(
+        self,
+    ):
+        devices = hw()
+        points = CountedPoints([(i, 2 * i) for i in range(5)])
+        documents = []
+        taken_at_event = []
+
+        def callback(name, doc):
+            documents.append((name, doc))
+            if name == "event":
+                taken_at_event.append(points.taken)
+
+        RE = RunEngine({})
+        RE(
+            sd.stream_list_scan(
+                [devices.det], [devices.motor1, devices.motor2], points, num_points=5
+            ),
+            callback,
+        )
+        start = [doc for name, doc in documents if name == "start"][0]
+        events = [doc for name, doc in documents if name == "event"]
+        self.assertEqual(start["num_points"], 5)
+        self.assertEqual(start["plan_name"], "stream_list_scan")
+        self.assertEqual(len(events), 5)
+        self.assertEqual([event["data"]["motor2"] for event in events], [0, 2, 4, 6, 8])
+        # Each point is taken right before the motors move to it
+        self.assertEqual(taken_at_event, [1, 2, 3, 4, 5])
+
+    def test_GIVEN_a_stream_list_scan_WHEN_estimating_its_duration_THEN_check_its_points_are_not_taken(
+        self,
+    ):
+        points = CountedPoints([(i,) for i in range(5)])
+        with tempfile.TemporaryDirectory() as tmp:
+            scan = sd.DAFScan(
+                sd.DAFScanInputs(
+                    scan_data={"points": points, "num_points": 5},
+                    inputed_motors=("mu",),
+                    motors_data_dict={"mu": {"pv": "SIM:mu", "value": 0.0}},
+                    scan_type="stream_list_scan",
+                    acquisition_time=0.1,
+                    output=os.path.join(tmp, "scan"),
+                ),
+                dry_run=True,
+            )
+            with self.assertRaises(ValueError):
+                scan.estimate_duration()
+        self.assertEqual(points.taken, 0)
+
+
+class TestDAFScan(unittest.TestCase):
+    def scan(self, **inputs):
+        with tempfile.TemporaryDirectory() as tmp:
+            return sd.DAFScan(
+                sd.DAFScanInputs(
+                    motors_data_dict={},
+                    acquisition_time=0.1,
+                    output=os.path.join(tmp, "scan"),
+                    **inputs
+                ),
+                dry_run=True,
+            )
+
+    def test_GIVEN_scan_inputs_WHEN_choosing_how_to_write_the_nexus_file_THEN_check_streaming_is_opt_in(
+        self,
+    ):
+        self.assertFalse(self.scan(scan_type="count", scan_data={}).stream_nexus)
+        self.assertTrue(
+            self.scan(scan_type="count", scan_data={}, stream_nexus=True).stream_nexus
+        )
+        # A ring buffer can not be exported from the databroker at the end
+        self.assertTrue(
+            self.scan(scan_type="count", scan_data={"buffer": 100}).stream_nexus
+        )
+
+
+class TestDryRun(unittest.TestCase):
+    def test_GIVEN_a_time_scan_WHEN_running_it_dry_THEN_check_it_says_its_duration_is_unknown(
+        self,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            # A daf.tscan .1 --dry_run without parsing the command line nor reading an experiment file
+            time_scan = TimeScan.__new__(TimeScan)
+            time_scan.scan_type = "count"
+            time_scan.get_counters = dict
+            time_scan.experiment_file_dict = {"kafka_topic": "daf", "scan_db": "temp"}
+            time_scan.parsed_args_dict = {
+                "time": 0.1,
+                "delay": 0,
+                "output": os.path.join(tmp, "scan"),
+                "buffer": None,
+                "window": 10,
+                "dry_run": True,
+            }
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                time_scan.run_scan()
+        self.assertIn(
+            "The duration of this scan can not be estimated", output.getvalue()
+        )
+
+
+class TestFlyScan(unittest.TestCase):
+    def test_GIVEN_a_moving_motor_WHEN_running_a_fly_scan_THEN_check_the_binned_events(
+        self,
+    ):
+        motor = FlyAxis(name="eta")
+        motor.velocity.put(5.0)
+        # The counter follows the motor position, so each bin must get the counter at its centre
+        diode = PositionCounter(derived_from=motor.readback, name="diode")
+        documents = []
+        RE = RunEngine({})
+        RE(
+            sd.fly_scan([diode], motor, 0, 1, 5, 0.5, period=0.002),
+            lambda name, doc: documents.append((name, doc)),
+        )
+        start = [doc for name, doc in documents if name == "start"][0]
+        descriptor = [doc for name, doc in documents if name == "descriptor"][0]
+        # Collected events come in pages
+        events = [
+            event
+            for name, doc in documents
+            if name == "event_page"
+            for event in unpack_event_page(doc)
+        ]
+        self.assertEqual(start["num_points"], 5)
+        self.assertEqual(descriptor["name"], "primary")
+        self.assertEqual(set(descriptor["data_keys"]), {"eta", "diode"})
+        self.assertAlmostEqual(
+            descriptor["configuration"]["daf_flyer"]["data"]["daf_flyer_velocity"], 2.0
+        )
+        self.assertEqual(len(events), 5)
+        centres = [event["data"]["eta"] for event in events]
+        np.testing.assert_allclose(centres, [0.1, 0.3, 0.5, 0.7, 0.9])
+        np.testing.assert_allclose(
+            [event["data"]["diode"] for event in events],
+            np.multiply(centres, 100),
+            atol=5,
+        )
+        # The speed of the motor is restored at the end
+        self.assertEqual(motor.velocity.get(), 5.0)
+
+    def test_GIVEN_a_fly_scan_WHEN_aborting_it_while_the_motor_moves_THEN_check_the_motor_speed_is_restored(
+        self,
+    ):
+        motor = FlyAxis(name="eta")
+        motor.velocity.put(5.0)
+        diode = PositionCounter(derived_from=motor.readback, name="diode")
+        flyers = []
+        RE = RunEngine({})
+        RE.msg_hook = lambda msg: flyers.extend(
+            [msg.obj] if msg.command == "kickoff" else []
+        )
+        # Ctrl-C: pause while the motor moves at the fly speed, then abort
+        threading.Timer(0.5, RE.request_pause).start()
+        with self.assertRaises(RunEngineInterrupted):
+            RE(sd.fly_scan([diode], motor, 0, 1, 5, 2.0, period=0.002))
+        self.assertEqual(motor.velocity.get(), 0.5)
+        RE.abort()
+        self.assertEqual(RE.state, "idle")
+        self.assertEqual(motor.velocity.get(), 5.0)
+        self.assertTrue(flyers[0].stopped)
+        self.assertIsNone(flyers[0].motion.sampler.thread)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import shlex
+import sys
+
+import databroker
+import msgpack
+import pytest
+from ophyd.sim import SynAxis, SynGauss
+
+import daf.command_line.scan.scan_daf as sd
+from daf.command_line.scan.daf_scan_utils import ScanBase
+from daf.command_line.scan.document_publisher import MemoryTransport
+from daf.command_line.scan.scan_queue import SCAN_COMMANDS, ScanQueue, read_queue
+
+
+@pytest.fixture
+def queue_file(tmp_path):
+    path = tmp_path / "my_scans.txt"
+    path.write_text(
+        "#!/usr/bin/env bash\n"
+        "daf.mv -m 10\n"
+        "\n"
+        "daf.ascan -e 10 20 100 .1 -o 'my scan'  # first scan\n"
+        "   daf.scan 1 1 1 1 1 1.1 100 .1\n"
+    )
+    return path
+
+
+def test_read_queue(queue_file):
+    commands = read_queue(queue_file)
+    assert commands == [
+        ["daf.mv", "-m", "10"],
+        ["daf.ascan", "-e", "10", "20", "100", ".1", "-o", "my scan"],
+        ["daf.scan", "1", "1", "1", "1", "1", "1.1", "100", ".1"],
+    ]
+    assert [command[0] in SCAN_COMMANDS for command in commands] == [
+        False,
+        True,
+        True,
+    ]
+
+
+# Motors of the ascans of the queue files, nu can not be connected
+ASCAN_MOTORS = {"-m": "mu", "-n": "nu"}
+
+
+def ascan(tmp_path, command, session):
+    """The DAFScan of daf.ascan -m start end points time, without an experiment file"""
+    motor = ASCAN_MOTORS[command[1]]
+    start, end, points, time = command[2:6]
+    return sd.DAFScan(
+        sd.DAFScanInputs(
+            scan_data={motor: [float(start), float(end)]},
+            inputed_motors=(motor,),
+            motors_data_dict={motor: {"pv": "SIM:" + motor, "value": 0.0}},
+            counters={
+                "det": {"class": "EpicsSignalRO", "type": "scaler", "pv": "SIM:det"}
+            },
+            main_counter="det",
+            scan_type="absolute",
+            steps=int(points),
+            acquisition_time=float(time),
+            output=str(tmp_path / "scan"),
+            kafka_topic="daf_queue",
+            scan_db="temp",
+            live_plots=False,
+        ),
+        session=session,
+    )
+
+
+def simulated_sessions(monkeypatch):
+    """
+    Make DAFScanSession send the documents to a MemoryTransport and start with ophyd.sim devices, as if
+    a previous scan had connected them. Motors not in the session fail to connect. Return the list of
+    the sessions created.
+    """
+    motor = SynAxis(name="mu")
+    det = SynGauss("det", motor, "mu", center=1.5, Imax=1, sigma=0.3)
+    sessions = []
+    session_class = sd.DAFScanSession
+
+    def new_session(document_transport=None):
+        session = session_class(MemoryTransport())
+        session.objects[("motor", "mu", "SIM:mu")] = motor
+        session.objects[("counter", "det", "SIM:det")] = det
+        session.objects[("databroker", "temp")] = databroker.Broker.named("temp")
+        sessions.append(session)
+        return session
+
+    def connected_motor(pv, name):
+        raise TimeoutError("{} could not connect to {}".format(name, pv))
+
+    monkeypatch.setattr(sd, "DAFScanSession", new_session)
+    monkeypatch.setattr(sd.DAFScan, "connected_motor", staticmethod(connected_motor))
+    monkeypatch.setattr(sd.du.DAFIO, "update", staticmethod(lambda dict_: None))
+    return sessions
+
+
+def queue_scans(tmp_path, monkeypatch, keep_going, middle_command=None):
+    """
+    Run a queue of two ascans with a failing command between them, a failing subprocess by default.
+    Return the sessions created and the scans run.
+    """
+    sessions = simulated_sessions(monkeypatch)
+    scans = []
+
+    def run_scan_command(command):
+        scans.append(ascan(tmp_path, command, ScanBase.session))
+        scans[-1].run()
+
+    if middle_command is None:
+        middle_command = "{} -c 'raise SystemExit(1)'".format(
+            shlex.quote(sys.executable)
+        )
+    path = tmp_path / "my_scans.txt"
+    path.write_text(
+        "daf.ascan -m 0 1 3 .01\n"
+        "{}\n"
+        "daf.ascan -m 1 2 5 .01\n".format(middle_command)
+    )
+    argv = ["daf.queue", str(path)] + (["--keep_going"] if keep_going else [])
+    monkeypatch.setattr(sys, "argv", argv)
+    monkeypatch.setattr(ScanQueue, "run_scan_command", staticmethod(run_scan_command))
+    ScanQueue().run_cmd()
+    return sessions, scans
+
+
+def test_queue_of_two_scans_in_one_session(tmp_path, monkeypatch, capsys):
+    sessions, scans = queue_scans(tmp_path, monkeypatch, keep_going=True)
+    assert "3 of 3 commands run, 1 failed" in capsys.readouterr().out
+    assert len(sessions) == 1 and len(scans) == 2
+    session = sessions[0]
+    assert ScanBase.session is None
+    assert all(scan.session is session and not scan.owns_session for scan in scans)
+    assert scans[0].ophyd_motors["mu"] is scans[1].ophyd_motors["mu"]
+    assert scans[0].publisher is scans[1].publisher
+    # The peak statistics go through the same publisher, with a single producer
+    assert [key for key in session.objects if key[0] == "publisher"] == [
+        ("publisher", "daf_queue")
+    ]
+    assert sorted(path.name for path in tmp_path.glob("scan*")) == [
+        "scan0001",
+        "scan0002",
+    ]
+    # The callbacks of the first scan are not called by the second one
+    assert [scan.callbacks["stats"].events for scan in scans] == [3, 5]
+    assert [scan.callback_tokens for scan in scans] == [{}, {}]
+    # Each scan has its own count plan, the one of the class is not changed
+    assert sd.DAFScan.PLANS_MAP["count"] is None
+    assert scans[0].plans["count"] is not scans[1].plans["count"]
+    # The session is closed at the end, after every document was sent
+    assert not scans[0].publisher.worker.is_alive()
+    messages = [
+        (topic, msgpack.loads(payload))
+        for topic, payload in scans[0].publisher.transport.messages
+    ]
+    queue_documents = [doc for topic, doc in messages if topic == "daf_queue"]
+    assert [name for name, doc in queue_documents].count("stop") == 2
+    assert {topic for topic, doc in messages} == {"daf_queue", "daf_queue_peak_stats"}
+
+
+def test_queue_stops_at_the_first_failure(tmp_path, monkeypatch, capsys):
+    sessions, scans = queue_scans(tmp_path, monkeypatch, keep_going=False)
+    out = capsys.readouterr().out
+    assert "Queue stopped, use --keep_going to run the next commands" in out
+    assert "2 of 3 commands run, 1 failed" in out
+    assert len(scans) == 1
+    assert not scans[0].publisher.worker.is_alive()
+
+
+def test_queue_with_a_scan_that_can_not_be_configured(tmp_path, monkeypatch, capsys):
+    sessions, scans = queue_scans(
+        tmp_path, monkeypatch, keep_going=True, middle_command="daf.ascan -n 0 1 3 .01"
+    )
+    out = capsys.readouterr().out
+    assert "TimeoutError: nu could not connect to SIM:nu" in out
+    assert "3 of 3 commands run, 1 failed" in out
+    assert len(sessions) == 1 and len(scans) == 3
+    # The callbacks of the failed scan were unsubscribed, they get no document of the next scan
+    assert [scan.callbacks["stats"].events for scan in scans] == [3, 0, 5]
+    assert [scan.callback_tokens for scan in scans] == [{}, {}, {}]
+    documents = [
+        msgpack.loads(payload)
+        for topic, payload in scans[0].publisher.transport.messages
+        if topic == "daf_queue"
+    ]
+    names = [name for name, doc in documents]
+    assert names.count("start") == 2
+    assert names.count("event") == 8
+    # Each run is inserted once in the databroker
+    assert len(scans[0].db.v2) == 2
+
+
+def test_scan_that_can_not_be_configured_closes_its_session(tmp_path, monkeypatch):
+    sessions = simulated_sessions(monkeypatch)
+    scan = ascan(tmp_path, ["daf.ascan", "-n", "0", "1", "3", ".01"], None)
+    with pytest.raises(TimeoutError):
+        scan.run()
+    assert scan.owns_session and scan.session is sessions[0]
+    assert scan.callback_tokens == {}
+    assert not scan.publisher.worker.is_alive()
@@ -0,0 +1,82 @@
+import unittest
+
+import numpy as np
+
+from daf.command_line.scan.time_buffer import DecimatedPublisher, RingBuffer
+
+
+class TestTimeBuffer(unittest.TestCase):
+    def test_GIVEN_more_points_than_the_capacity_WHEN_appending_THEN_check_only_the_last_ones_are_kept(
+        self,
+    ):
+        buffer = RingBuffer(["diode"], capacity=100)
+        for i in range(250):
+            buffer.append(float(i), {"diode": 2.0 * i})
+        self.assertEqual(len(buffer), 100)
+        self.assertEqual(buffer.data.shape, (100, 2))
+        np.testing.assert_array_equal(buffer.last()[:, 0], np.arange(150, 250))
+        np.testing.assert_array_equal(buffer.last(3)[:, 1], [494, 496, 498])
+        decimated = buffer.decimate(10, start=200)
+        np.testing.assert_array_equal(decimated["time"], np.arange(202, 250, 5))
+        np.testing.assert_array_equal(decimated["diode_min"], np.arange(400, 500, 10))
+        np.testing.assert_array_equal(decimated["diode_max"], np.arange(408, 500, 10))
+
+    def test_GIVEN_missing_values_WHEN_decimating_the_last_points_THEN_check_they_are_ignored(
+        self,
+    ):
+        buffer = RingBuffer(["diode", "temperature"], capacity=10)
+        for i in range(6):
+            buffer.append(float(i), {"diode": float(i)} if i % 2 else {})
+        decimated = buffer.decimate(2, points=4)
+        np.testing.assert_array_equal(decimated["time"], [2.5, 4.5])
+        np.testing.assert_array_equal(decimated["diode"], [3, 5])
+        np.testing.assert_array_equal(decimated["diode_min"], [3, 5])
+        self.assertTrue(np.isnan(decimated["temperature_max"]).all())
+
+    def test_GIVEN_a_time_scan_WHEN_decimating_its_documents_THEN_check_the_live_events(
+        self,
+    ):
+        received = []
+        publisher = DecimatedPublisher(
+            lambda name, doc: received.append((name, doc)), capacity=20, window=10
+        )
+        publisher("start", {"uid": "run"})
+        publisher(
+            "descriptor",
+            {
+                "uid": "primary",
+                "name": "primary",
+                "data_keys": {"diode": {"dtype": "number", "shape": []}},
+            },
+        )
+        for i in range(25):
+            publisher(
+                "event",
+                {
+                    "descriptor": "primary",
+                    "seq_num": i + 1,
+                    "time": float(i),
+                    "data": {"diode": float(i)},
+                },
+            )
+        publisher("stop", {"exit_status": "abort", "num_events": {"primary": 25}})
+
+        names = [name for name, doc in received]
+        self.assertEqual(
+            names, ["start", "descriptor", "event", "event", "event", "stop"]
+        )
+        self.assertEqual(
+            set(received[1][1]["data_keys"]), {"diode", "diode_min", "diode_max"}
+        )
+        events = [doc for name, doc in received if name == "event"]
+        self.assertEqual(
+            [event["data"]["diode"] for event in events], [4.5, 14.5, 22.0]
+        )
+        self.assertEqual([event["data"]["diode_max"] for event in events], [9, 19, 24])
+        self.assertEqual([event["time"] for event in events], [4.5, 14.5, 22.0])
+        self.assertEqual(received[-1][1]["num_events"], {"primary": 3})
+        self.assertEqual(len(publisher.buffer), 20)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,92 @@
+import dataclasses
+import os
+import pickle
+import tempfile
+import threading
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+import h5py
 import numpy as np
 
 from daf.core.matrix_utils import (
     calculate_rotation_matrix_from_diffractometer_angles,
     calculate_pseudo_angle_from_motor_angles,
+    calculate_rotation_matrix_from_diffractometer_angles_array,
+    calculate_pseudo_angle_sample_terms,
+    calculate_pseudo_angles_from_motor_angles_array,
+    calculate_pseudo_angle_jacobians,
 )
 from daf.core.main import DAF
+from daf.core.adaptive_trajectory import adaptive_hkl_trajectory, motor_step
+from daf.core.analytic_solver import has_closed_form
+from daf.core.fly_scan import FlyMotion
+from daf.core.hkl_mesh import hkl_mesh, mesh_axis
+from daf.core.scan_duration import (
+    estimate_scan_duration,
+    move_time,
+    plan_points,
+    trapezoid_time,
+)
+from daf.core.solver import iter_solve, solve
+from daf.core.trajectory_chunks import solve_trajectory_in_chunks
+from daf.core.trajectory_stream import LookAheadSolver
+from daf.core.trajectory_cache import TrajectoryCache
+from daf.core.trajectory_reader import TrajectoryReader
+from daf.core.trajectory_writer import TrajectoryWriter
+
+
+class SimulatedSignal:
+    """Stand-in of an ophyd signal, value may be a function called on every get"""
+
+    def __init__(self, name, value=0.0):
+        self.name = name
+        self.value = value
+        self.callbacks = {}
+
+    def get(self):
+        return self.value() if callable(self.value) else self.value
+
+    def put(self, value):
+        self.value = value
+        for callback in list(self.callbacks.values()):
+            callback(value=self.get(), timestamp=time.time())
+
+    def subscribe(self, callback, run=True):
+        self.callbacks[len(self.callbacks)] = callback
+        return len(self.callbacks) - 1
+
+    def unsubscribe(self, cid):
+        self.callbacks.pop(cid)
+
+
+class SimulatedMotor:
+    """Stand-in of an ophyd EpicsMotor moving at its velocity in a thread"""
+
+    def __init__(self, name, velocity=1.0):
+        self.name = name
+        self.velocity = SimulatedSignal(name + "_velocity", velocity)
+        self.user_readback = SimulatedSignal(name)
+
+    def move(self, position, wait=True):
+        self.user_readback.put(position)
+
+    def set(self, position):
+        start = self.user_readback.get()
+        duration = abs(position - start) / self.velocity.get()
+
+        def run():
+            started = time.time()
+            while time.time() - started < duration:
+                fraction = (time.time() - started) / duration
+                self.user_readback.put(start + fraction * (position - start))
+                time.sleep(0.001)
+            self.user_readback.put(position)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.wait = thread.join
+        return thread
 
 
 class TestDAF(unittest.TestCase):
@@ -14,6 +95,27 @@ class TestDAF(unittest.TestCase):
     HKLS_TO_TEST = ((1, 1, 1), (0, 1, 1), (0, 0, 1), (1, 0, 1), (2, 3, 10))
     SAMPLE_LIST = ("Si", "Ge", "AlAs", "Mo", "Ir20Mn80")
 
+    @staticmethod
+    def build_experiment(mode=(2, 0, 5, 2), en=8000, **constraints):
+        exp = DAF(*mode)
+        exp.set_material("Si")
+        exp.set_exp_conditions(
+            idir=(0, 1, 0), ndir=(0, 0, 1), rdir=(0, 0, 1), en=en, sampleor="z+"
+        )
+        exp.set_circle_constrain(
+            Mu=[-20, 160],
+            Eta=[-20, 160],
+            Chi=[-5, 95],
+            Phi=[-400, 400],
+            Nu=[-20, 160],
+            Del=[-20, 160],
+        )
+        exp.set_constraints(**constraints)
+        exp.set_U(np.identity(3))
+        exp.build_xrd_experiment()
+        exp.build_bounds()
+        return exp
+
     def test_GIVEN_diffractometer_angles_WHEN_performing_rotation_matrix_calculation_THEN_check_if_is_correct(
         self,
     ):
@@ -257,6 +359,582 @@ class TestDAF(unittest.TestCase):
                 pseudo_angles_to_compare[key], calculated_pseudo_angles[key], 4
             )
 
+    def test_GIVEN_a_hkl_trajectory_WHEN_solving_it_in_batch_THEN_check_if_matches_point_by_point_solution(
+        self,
+    ):
+        hkl_array = np.linspace((1, 1, 1), (1, 1, 1.2), 5)
+        exp = self.build_experiment()
+        motor_angles, pseudo_angles, errors = exp.motor_angles_batch(hkl_array)
+
+        assert motor_angles.shape == (5, 6)
+        assert pseudo_angles.shape == (5, 9)
+        assert errors.shape == (5,)
+
+        exp_point = self.build_experiment()
+        for i, hkl in enumerate(hkl_array):
+            exp_point.set_hkl(hkl)
+            angles, _ = exp_point()
+            for j in range(6):
+                self.assertAlmostEqual(angles[j], motor_angles[i][j], 4)
+            for j in range(9):
+                self.assertAlmostEqual(angles[j + 6], pseudo_angles[i][j], 4)
+            assert errors[i] < 1e-5
+
+    def test_GIVEN_operation_modes_WHEN_checking_for_closed_form_THEN_check_if_is_correct(
+        self,
+    ):
+        assert has_closed_form(2, 0, 5, 2, 0)
+        assert has_closed_form(2, 0, 2, 3, 0)
+        assert has_closed_form(1, 0, 0, 1, 0)
+        assert has_closed_form(0, 0, 1, 2, 3)
+        assert not has_closed_form(2, 1, 5, 0, 0)
+        assert not has_closed_form(0, 2, 1, 3, 0)
+        assert not has_closed_form(2, 0, 1, 1, 0)
+        assert not has_closed_form(1, 0, 0, 3, 0)
+
+    def test_GIVEN_mode_2023_WHEN_solving_in_closed_form_THEN_check_if_is_correct(
+        self,
+    ):
+        expected_angles = {
+            (1, 2, 3): (0.0, 61.98212, 90.0, -26.56505, 0.0, 50.56580),
+            (1, 1, 1): (0.0, 66.13830, 90.0, -45.00000, 0.0, 22.80538),
+            (4, 2, 3): (0.0, 94.07449, 90.0, -63.43495, 0.0, 75.85801),
+        }
+        exp = self.build_experiment((2, 0, 2, 3), en=10000, Mu=0, Chi=90, Nu=0)
+        for hkl, angles in expected_angles.items():
+            exp.set_hkl(hkl)
+            exp.Q_lab = exp.hrxrd.Transform(exp.samp.Q(hkl))
+            exp.start = [0, 0, 0, 0, 0, 0]
+            calculated_angles, qerror = exp.closed_form_motor_angles()
+            assert qerror < 1e-10
+            for calculated, expected in zip(calculated_angles, angles):
+                self.assertAlmostEqual(calculated, expected, 4)
+
+    def test_GIVEN_closed_form_modes_WHEN_solving_THEN_check_if_matches_numeric_minimization(
+        self,
+    ):
+        modes = (
+            ((2, 0, 5, 2), {}, (1, 1, 1)),
+            ((2, 0, 1, 2), {"Eta": 10}, (1, 1, 1)),
+            ((1, 0, 3, 2), {"Del": 20, "Chi": 30}, (1, 1, 1)),
+            # Mirror solutions as far from the start, with opposite Del and Phi
+            ((0, 0, 1, 2, 3), {}, (0, 1, 1)),
+        )
+        for mode, constraints, hkl in modes:
+            exp = self.build_experiment(mode, **constraints)
+            exp.set_hkl(hkl)
+            closed_form_angles, _ = exp()
+            assert float(closed_form_angles[-1]) < 1e-10
+            numeric_angles, _ = exp(closed_form=False)
+            for i in range(15):
+                self.assertAlmostEqual(closed_form_angles[i], numeric_angles[i], 3)
+
+    def test_GIVEN_mode_2002_WHEN_solving_in_closed_form_THEN_check_if_omega_is_fixed(
+        self,
+    ):
+        for omega in (0, 5, -10):
+            exp = self.build_experiment((2, 0, 0, 2), omega=omega)
+            exp.set_hkl((1, 1, 1))
+            angles, _ = exp()
+            assert float(angles[-1]) < 1e-10
+            self.assertAlmostEqual(angles[14], omega, 3)
+
+    def test_GIVEN_angle_arrays_WHEN_performing_vectorized_calculations_THEN_check_if_matches_scalar_calculations(
+        self,
+    ):
+        exp = self.build_experiment()
+        exp.set_hkl((1, 2, 3))
+        rng = np.random.default_rng(0)
+        angles = rng.uniform(-90, 90, (20, 6))
+
+        matrixes = calculate_rotation_matrix_from_diffractometer_angles_array(*angles.T)
+        for i, (mu, eta, chi, phi, nu, del_) in enumerate(angles):
+            scalar_matrixes = calculate_rotation_matrix_from_diffractometer_angles(
+                mu, eta, chi, phi, nu, del_
+            )
+            for key, value in scalar_matrixes.items():
+                self.assertEqual(matrixes[key].shape, (20, 3, 3))
+                np.testing.assert_allclose(matrixes[key][i], value, atol=1e-12)
+
+        # Mu, Eta, Chi, Phi, Nu, Del and the pseudo angles given by the scalar formulas of the
+        # pseudo angles before they were vectorized
+        angles = np.array(
+            [
+                [1.5, 22.3, 31.0, -12.0, 4.5, 47.8],
+                [0.0, 35.2, 80.5, 45.0, 0.0, 70.4],
+                [10.0, 5.0, 60.0, 120.0, 15.0, 25.0],
+            ]
+        )
+        expected = {
+            "alpha": [12.58017, 34.64757, 9.27403],
+            "qaz": [85.93070, 90.0, 60.96801],
+            "naz": [29.22495, 78.42645, 60.94526],
+            "tau": [36.69958, 36.69958, 36.69958],
+            "psi": [78.58677, 102.57915, 86.14112],
+            "beta": [14.59846, 34.64757, 19.63052],
+            "omega": [-1.63258, 0.0, -5.14980],
+            "twotheta": [47.95995, 70.4, 28.90456],
+            "theta": [23.97998, 35.2, 14.45228],
+        }
+        sample_terms = calculate_pseudo_angle_sample_terms(
+            exp.samp, exp.hkl, exp.lam, exp.nref, exp.U
+        )
+        pseudo_angles = calculate_pseudo_angles_from_motor_angles_array(
+            *angles.T, sample_terms
+        )
+        for key, values in expected.items():
+            self.assertEqual(pseudo_angles[key].shape, (3,))
+            np.testing.assert_allclose(pseudo_angles[key], values, atol=1e-4)
+        for i, (mu, eta, chi, phi, nu, del_) in enumerate(angles):
+            scalar_pseudo_angles = calculate_pseudo_angle_from_motor_angles(
+                mu, eta, chi, phi, nu, del_, exp.samp, exp.hkl, exp.lam, exp.nref, exp.U
+            )
+            for key, values in expected.items():
+                self.assertAlmostEqual(scalar_pseudo_angles[key], values[i], 4)
+
+    def test_GIVEN_multi_start_options_WHEN_retrying_a_fit_THEN_check_if_converges(
+        self,
+    ):
+        exp = self.build_experiment((2, 0, 1, 2), Eta=10)
+        exp.set_hkl((1, 1, 1))
+        exp()
+        self.assertEqual(exp.multi_start_workers, 1)
+        exp.set_multi_start(seeds=3)
+        self.assertEqual(exp.multi_start_seeds, (0, 120, 240))
+        for workers in (1, 2):
+            exp.set_multi_start(workers=workers)
+            angles, qerror, _ = exp.multi_start_fit(max_err=1e-5)
+            assert qerror < 1e-5
+            self.assertAlmostEqual(angles[1], 10, 5)
+
+        # Outside the main thread the fits run in threads instead of forked processes
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(exp.multi_start_fit(max_err=1e-5))
+        )
+        thread.start()
+        thread.join()
+        angles, qerror, _ = results[0]
+        assert qerror < 1e-5
+        self.assertAlmostEqual(angles[1], 10, 5)
+
+    def test_GIVEN_a_solution_cache_WHEN_solving_the_same_hkl_again_THEN_check_if_comes_from_cache(
+        self,
+    ):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "cache.db")
+            exp = self.build_experiment()
+            exp.set_solution_cache(path, max_entries=2)
+            exp.set_hkl((1, 1, 1))
+            angles, _ = exp()
+            assert not exp.from_cache
+
+            exp = self.build_experiment()
+            exp.set_solution_cache(path, max_entries=2)
+            exp.set_hkl((1, 1, 1))
+            cached_angles, _ = exp()
+            assert exp.from_cache
+            for i in range(15):
+                self.assertAlmostEqual(angles[i], cached_angles[i], 10)
+
+            exp = self.build_experiment(en=10000)
+            exp.set_solution_cache(path, max_entries=2)
+            exp.set_hkl((1, 1, 1))
+            exp()
+            assert not exp.from_cache
+
+            exp.set_hkl((2, 2, 0))
+            exp()
+            self.assertEqual(len(exp.solution_cache), 2)
+
+    def test_GIVEN_motor_angles_WHEN_calculating_pseudo_angle_jacobians_THEN_check_if_matches_finite_differences(
+        self,
+    ):
+        exp = self.build_experiment()
+        exp.set_hkl((1, 2, 3))
+        sample_terms = calculate_pseudo_angle_sample_terms(
+            exp.samp, exp.hkl, exp.lam, exp.nref, exp.U
+        )
+        rng = np.random.default_rng(1)
+        angles = rng.uniform(-40, 40, (10, 6))
+        jacobians = calculate_pseudo_angle_jacobians(*angles.T, sample_terms)
+        # Pseudo angles are undefined (nan) where the reflection can not satisfy them, the unrounded
+        # ones used by the fit are continued there, with the slope of the jacobians
+        with np.errstate(invalid="ignore"):
+            rounded = calculate_pseudo_angles_from_motor_angles_array(
+                *angles.T, sample_terms
+            )
+        unrounded = calculate_pseudo_angles_from_motor_angles_array(
+            *angles.T, sample_terms, rounded=False
+        )
+        self.assertTrue(np.isnan(rounded["psi"]).any())
+        for key, value in unrounded.items():
+            self.assertTrue(np.isfinite(value).all())
+        step = 1e-6
+        for i in range(6):
+            forward, backward = angles.copy(), angles.copy()
+            forward[:, i] += step
+            backward[:, i] -= step
+            forward = calculate_pseudo_angles_from_motor_angles_array(
+                *forward.T, sample_terms, rounded=False
+            )
+            backward = calculate_pseudo_angles_from_motor_angles_array(
+                *backward.T, sample_terms, rounded=False
+            )
+            for key, value in jacobians.items():
+                self.assertEqual(value.shape, (10, 6))
+                finite_difference = (forward[key] - backward[key]) / (2 * step)
+                np.testing.assert_allclose(value[:, i], finite_difference, atol=1e-5)
+
+    def test_GIVEN_a_solve_WHEN_reading_last_solve_stats_THEN_check_if_describes_the_solve(
+        self,
+    ):
+        exp = self.build_experiment()
+        exp.set_hkl((1, 1, 1))
+        exp()
+        stats = exp.last_solve_stats
+        self.assertEqual(stats["method"], "closed_form")
+        self.assertEqual(stats["q2angfit_calls"], 0)
+        self.assertEqual(stats["hkl"], [1, 1, 1])
+
+        angles, _ = exp(closed_form=False)
+        stats = exp.last_solve_stats
+        self.assertIn(stats["method"], ("fit", "multi_start"))
+        self.assertEqual(stats["q2angfit_calls"], len(stats["start_vectors"]))
+        assert stats["objective_evaluations"] > 0
+        self.assertAlmostEqual(stats["qerror"], float(angles[-1]), 9)
+        self.assertAlmostEqual(
+            sum(stats["stage_times"].values()), stats["total_time"], 3
+        )
+
+    def test_GIVEN_angle_arrays_WHEN_calculating_hkl_THEN_check_if_matches_xrayutilities(
+        self,
+    ):
+        exp = self.build_experiment()
+        theta = np.deg2rad(20)
+        exp.set_U(
+            np.array(
+                [
+                    [1, 0, 0],
+                    [0, np.cos(theta), -np.sin(theta)],
+                    [0, np.sin(theta), np.cos(theta)],
+                ]
+            )
+        )
+        angles = np.random.default_rng(2).uniform(-30, 90, (20, 6))
+        expected = np.array(
+            exp.hrxrd.Ang2HKL(*angles.T, mat=exp.samp, en=exp.en, U=exp.U)
+        ).T
+
+        np.testing.assert_allclose(
+            exp.calc_from_angs_array(angles), expected, atol=1e-10
+        )
+        np.testing.assert_allclose(
+            exp.calc_from_angs(*angles.T), expected.T, atol=1e-10
+        )
+        np.testing.assert_allclose(
+            exp.calc_from_angs(*angles[0]), expected[0], atol=1e-10
+        )
+        self.assertIs(exp.forward_kinematics(), exp.forward_kinematics())
+
+    def test_GIVEN_a_solver_context_WHEN_solving_from_many_threads_THEN_check_if_matches_motor_angles(
+        self,
+    ):
+        exp = self.build_experiment((2, 0, 1, 2), Eta=10)
+        context = exp.solver_context()
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            context.energy = 10000
+        with self.assertRaises(ValueError):
+            context.U[0, 0] = 2
+
+        expected = {}
+        for hkl in self.HKLS_TO_TEST[:4]:
+            exp.set_hkl(hkl)
+            expected[hkl] = exp()[0][:6]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            solutions = dict(
+                zip(expected, executor.map(lambda hkl: solve(context, hkl), expected))
+            )
+        for hkl, solution in solutions.items():
+            np.testing.assert_allclose(solution.angles, expected[hkl], atol=1e-6)
+            self.assertEqual(solution.as_list()[:6], list(solution.angles))
+
+        copy = pickle.loads(pickle.dumps(context))
+        np.testing.assert_allclose(
+            solve(copy, (1, 1, 1)).angles, expected[(1, 1, 1)], atol=1e-6
+        )
+        higher_energy = context.replace(energy=10000)
+        self.assertEqual(context.energy, 8000)
+        assert higher_energy.hrxrd is not context.hrxrd
+
+    def test_GIVEN_an_hkl_trajectory_WHEN_solving_ahead_in_a_thread_THEN_check_if_matches_serial_solving(
+        self,
+    ):
+        exp = self.build_experiment()
+        context = exp.solver_context()
+        hkl_array = np.linspace((1, 1, 1), (1, 1, 1.2), 6)
+        expected = [solution.angles for solution in iter_solve(context, hkl_array)]
+        streamed = [
+            solution.angles
+            for solution in LookAheadSolver(context, hkl_array, look_ahead=2)
+        ]
+        np.testing.assert_allclose(streamed, expected, atol=1e-10)
+
+        stream = LookAheadSolver(context, hkl_array, look_ahead=1)
+        next(iter(stream))
+        stream.close()
+        assert not stream.thread.is_alive()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                scan = exp.scan((1, 1, 1), (1, 1, 1.2), 5, diflimit=0)
+                points = list(
+                    exp.scan_points((1, 1, 1), (1, 1, 1.2), 5, diflimit=0, look_ahead=3)
+                )
+            finally:
+                os.chdir(cwd)
+        np.testing.assert_allclose(
+            points,
+            scan[["Mu", "Eta", "Chi", "Phi", "Nu", "Del"]].astype(float),
+            atol=1e-4,
+        )
+        self.assertEqual(len(exp.trajectory_solve_stats), 6)
+
+    def test_GIVEN_a_scan_WHEN_writing_the_trajectory_THEN_check_if_every_format_has_the_points(
+        self,
+    ):
+        exp = self.build_experiment()
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                scan = exp.scan(
+                    (1, 1, 1), (1, 1, 1.2), 5, diflimit=0, write=True, name="scan.csv"
+                )
+                with open(".my_scan_counter.csv") as file:
+                    progress = file.read().splitlines()
+                with open("scan.csv") as file:
+                    written = file.read().splitlines()
+
+                with TrajectoryWriter(2, progress_file=None) as writer:
+                    for row in exp.scan_trajectory:
+                        writer.append(row)
+                    writer.write("scan.npy")
+                    writer.write("scan.h5")
+                npy = np.load("scan.npy")
+                with h5py.File("scan.h5") as file:
+                    h5_mu = file["trajectory"]["Mu"][()]
+            finally:
+                os.chdir(cwd)
+
+        self.assertEqual(len(progress), 6)
+        self.assertEqual(progress[0], ",".join(["0"] + list(scan.iloc[0])))
+        self.assertEqual(written[0], ",".join([""] + list(scan.columns)))
+        self.assertEqual(written[-1], ",".join(["5"] + list(scan.iloc[-1])))
+        np.testing.assert_allclose(npy["L"], np.linspace(1, 1.2, 6), atol=1e-4)
+        np.testing.assert_allclose(h5_mu, npy["Mu"])
+
+    def test_GIVEN_an_hkl_trajectory_WHEN_solving_in_parallel_chunks_THEN_check_if_matches_serial_solving(
+        self,
+    ):
+        exp = self.build_experiment((2, 1, 5))
+        context = exp.solver_context()
+        hkl_array = np.linspace((1, 1, 1), (1, 1, 1.3), 9)
+        expected = [solution.angles for solution in iter_solve(context, hkl_array)]
+        for workers, diflimit in ((2, 0), (1, 0), (1, 1e-9)):
+            solutions = solve_trajectory_in_chunks(
+                context, hkl_array, workers=workers, chunks=3, diflimit=diflimit
+            )
+            np.testing.assert_allclose(
+                [solution.angles for solution in solutions], expected, atol=1e-4
+            )
+
+    def test_GIVEN_an_hkl_line_WHEN_solving_with_adaptive_steps_THEN_check_if_motor_steps_are_bounded(
+        self,
+    ):
+        exp = self.build_experiment((2, 1, 5))
+        context = exp.solver_context()
+        for points, max_step, min_step in ((4, 2, 0), (40, 2, 1.5)):
+            solutions = adaptive_hkl_trajectory(
+                context, (1, 1, 1), (1, 1, 1.5), points, max_step, min_step
+            )
+            steps = [motor_step(a, b) for a, b in zip(solutions, solutions[1:])]
+            hkl = np.array([solution.hkl for solution in solutions])
+            np.testing.assert_allclose(hkl[[0, -1]], [(1, 1, 1), (1, 1, 1.5)])
+            self.assertTrue(np.all(np.diff(hkl[:, 2]) > 0))
+            self.assertLessEqual(max(steps), max(max_step, min_step))
+            self.assertNotEqual(len(solutions), points + 1)
+            self.assertLess(max(solution.qerror for solution in solutions), 1e-5)
+
+    def test_GIVEN_an_hkl_grid_WHEN_solving_a_mesh_twice_THEN_check_if_snake_ordered_and_cached(
+        self,
+    ):
+        exp = self.build_experiment((2, 1, 5))
+        h, k, l = mesh_axis((1, 1.1, 2)), mesh_axis((1, 1, 0)), mesh_axis((1, 1.2, 3))
+        np.testing.assert_allclose(mesh_axis((1, 1.1, 2.0)), h)
+        with self.assertRaises(ValueError):
+            mesh_axis((1, 1.1, 2.5))
+        hkl_array = hkl_mesh(h, k, l)
+        self.assertEqual(len(hkl_array), 12)
+        self.assertEqual(len({tuple(hkl) for hkl in hkl_array}), 12)
+        # Every move changes a single axis by one step
+        self.assertTrue(
+            np.all(np.count_nonzero(np.diff(hkl_array, axis=0), axis=1) == 1)
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                exp.set_trajectory_cache(os.path.join(tmp, "trajectories"))
+                solved = exp.hkl_mesh_scan(h, k, l).copy()
+                self.assertFalse(exp.from_cache)
+                cached = exp.hkl_mesh_scan(h, k, l)
+                self.assertTrue(exp.from_cache)
+                exp.hkl_mesh_scan(h, k, l, startvalues=[0, 10, 0, 0, 0, 20])
+                self.assertFalse(exp.from_cache)
+            finally:
+                os.chdir(cwd)
+        np.testing.assert_allclose(
+            solved[["H", "K", "L"]].astype(float), hkl_array, atol=1e-4
+        )
+        self.assertTrue((solved.values == cached.values).all())
+
+    def test_GIVEN_a_trajectory_cache_WHEN_repeating_a_scan_THEN_check_if_reused_and_found_by_name_or_hash(
+        self,
+    ):
+        exp = self.build_experiment((2, 1, 5))
+        with tempfile.TemporaryDirectory() as tmp:
+            cwd = os.getcwd()
+            os.chdir(tmp)
+            try:
+                exp.set_trajectory_cache(os.path.join(tmp, "trajectories"))
+                solved = exp.scan(
+                    (1, 1, 1), (1, 1, 1.2), 4, diflimit=0, name="my_scan.csv"
+                ).copy()
+                self.assertFalse(exp.from_cache)
+                cached = exp.scan(
+                    (1, 1, 1), (1, 1, 1.2), 4, diflimit=0, name="my_scan.csv"
+                )
+                self.assertTrue(exp.from_cache)
+                exp.scan((1, 1, 1), (1, 1, 1.2), 5, diflimit=0)
+                self.assertFalse(exp.from_cache)
+                # Other start values may give other solutions
+                exp.scan(
+                    (1, 1, 1),
+                    (1, 1, 1.2),
+                    4,
+                    diflimit=0,
+                    startvalues=[0, 10, 0, 0, 0, 20],
+                )
+                self.assertFalse(exp.from_cache)
+
+                cache = TrajectoryCache(os.path.join(tmp, "trajectories"))
+                self.assertEqual(len(cache), 3)
+                by_name = cache.load("my_scan.csv")
+                key = cache.resolve("my_scan.csv")
+                self.assertIsInstance(by_name, np.memmap)
+                np.testing.assert_array_equal(cache.load(key[:12]), by_name)
+                self.assertIsNone(cache.load("unknown_scan"))
+            finally:
+                os.chdir(cwd)
+        self.assertTrue((solved.values == cached.values).all())
+        np.testing.assert_allclose(by_name["Mu"], solved["Mu"].astype(float), atol=1e-4)
+
+    def test_GIVEN_trajectory_files_WHEN_reading_in_chunks_THEN_check_if_every_format_gives_the_points(
+        self,
+    ):
+        angles = np.random.default_rng(0).uniform(-90, 90, (10, 6))
+        with tempfile.TemporaryDirectory() as tmp:
+            with TrajectoryWriter(4, progress_file=None) as writer:
+                for row in angles:
+                    writer.append(list(row) + [0] * 13)
+            for name in ("scan.csv", "scan.npy", "scan.h5"):
+                writer.write(os.path.join(tmp, name))
+            np.save(os.path.join(tmp, "plain.npy"), angles[:, ::-1])
+            np.savez(
+                os.path.join(tmp, "columns.npz"),
+                **{name: angles[:, i] for i, name in enumerate("abcdef")},
+            )
+            readers = [
+                TrajectoryReader(os.path.join(tmp, name), chunk_size=3)
+                for name in ("scan.csv", "scan.npy", "scan.h5")
+            ] + [
+                TrajectoryReader(
+                    os.path.join(tmp, "plain.npy"),
+                    dict(
+                        zip(("mu", "eta", "chi", "phi", "nu", "del"), range(5, -1, -1))
+                    ),
+                    chunk_size=4,
+                ),
+                TrajectoryReader(
+                    os.path.join(tmp, "columns.npz"),
+                    dict(zip(("mu", "eta", "chi", "phi", "nu", "del"), "abcdef")),
+                ),
+            ]
+            for reader in readers:
+                self.assertEqual(len(reader), 10)
+                np.testing.assert_allclose(list(reader), angles, atol=1e-4)
+            with self.assertRaises(KeyError):
+                list(TrajectoryReader(os.path.join(tmp, "columns.npz")))
+
+    def test_GIVEN_a_simulated_motor_WHEN_flying_THEN_check_if_counters_are_binned_by_position(
+        self,
+    ):
+        for monitor in (False, True):
+            motor = SimulatedMotor("eta", velocity=50)
+            counter = SimulatedSignal("roi", lambda: 2 * motor.user_readback.get())
+            motion = FlyMotion(
+                motor, [counter], 10, 12, 5, 0.4, period=0.002, monitor=monitor
+            )
+            motion.prepare()
+            self.assertAlmostEqual(motor.velocity.get(), 5)
+            if monitor:
+                motor.user_readback.subscribe(
+                    lambda **kwargs: counter.put(counter.value)
+                )
+            motion.start().wait()
+            motion.finish()
+            self.assertEqual(motor.velocity.get(), 50)
+            centres, means, counts = motion.bins()
+            np.testing.assert_allclose(centres, [10.2, 10.6, 11, 11.4, 11.8])
+            self.assertTrue(np.all(counts > 0))
+            np.testing.assert_allclose(means["roi"], 2 * centres, atol=0.2)
+
+    def test_GIVEN_scan_plans_WHEN_estimating_their_duration_THEN_check_if_follows_motor_kinematics(
+        self,
+    ):
+        np.testing.assert_allclose(trapezoid_time([10, 0.25], 2, 0.5), [5.5, 0.5])
+        backlash = {"velocity": 1, "acceleration": 0, "backlash": 0.5}
+        np.testing.assert_allclose(
+            move_time([2, -2, 0.2, 0], backlash), [2.0, 3.0, 0.2, 0.0]
+        )
+
+        motors, points = plan_points("grid_scan", ["eta", 0, 1, 2, "del", 0, 1, 3], {})
+        self.assertEqual(motors, ["eta", "del"])
+        np.testing.assert_allclose(
+            points, [[0, 0], [0, 0.5], [0, 1], [1, 0], [1, 0.5], [1, 1]]
+        )
+
+        motors, points = plan_points(
+            "relative", ["eta", 0, 10, "del", 0, 2, 11], {"eta": 5, "del": 1}
+        )
+        np.testing.assert_allclose(points[[0, -1]], [[5, 1], [15, 3]])
+        kinematics = {
+            "eta": {"velocity": 1, "acceleration": 0, "backlash": 0},
+            "del": {"velocity": 0.1, "acceleration": 0, "backlash": 0},
+        }
+        estimate = estimate_scan_duration(
+            points, motors, kinematics, 0.1, overhead=0.05, start=[0, 1]
+        )
+        self.assertEqual(estimate["points"], 11)
+        # eta moves 5 to the first point, then del needs 2 s for each 0.2 step
+        self.assertAlmostEqual(estimate["motion"], 25)
+        self.assertEqual(estimate["motor_times"], {"eta": 5.0, "del": 20.0})
+        self.assertEqual(estimate["dominant_motor"], "del")
+        self.assertAlmostEqual(estimate["total"], 25 + 1.1 + 0.55)
+
 
 if __name__ == "__main__":
     obj = TestDAF()
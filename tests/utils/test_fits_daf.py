@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+
+from daf.utils.fits_daf import fit_gauss_batch, gauss_guesses
+
+
+def gaussian_counters(x, centres, fwhms, seed=0):
+    rng = np.random.default_rng(seed)
+    sigmas = np.asarray(fwhms) / (2 * np.sqrt(2 * np.log(2)))
+    peaks = 100 * np.exp(
+        -((x - np.asarray(centres)[:, None]) ** 2) / (2 * sigmas[:, None] ** 2)
+    )
+    return 10 + 0.3 * x + peaks + rng.normal(0, 0.5, peaks.shape)
+
+
+class TestFitsDaf(unittest.TestCase):
+    x = np.linspace(-5, 5, 201)
+    centres = [-1.5, 0.0, 0.7, 2.2]
+    fwhms = [0.8, 1.0, 1.5, 2.0]
+
+    def test_GIVEN_many_counters_WHEN_computing_guesses_THEN_check_they_are_close_to_the_peaks(
+        self,
+    ):
+        guesses = gauss_guesses(
+            self.x, gaussian_counters(self.x, self.centres, self.fwhms)
+        )
+        np.testing.assert_allclose(guesses["center"], self.centres, atol=0.05)
+        np.testing.assert_allclose(
+            guesses["sigma"] * 2 * np.sqrt(2 * np.log(2)), self.fwhms, rtol=0.1
+        )
+
+    def test_GIVEN_many_counters_WHEN_fitting_in_a_pool_THEN_check_the_result_table(
+        self,
+    ):
+        counters = gaussian_counters(self.x, self.centres, self.fwhms)
+        names = ["roi{}".format(i + 1) for i in range(len(counters))]
+        table = fit_gauss_batch(self.x, dict(zip(names, counters)), workers=2)
+        self.assertEqual(list(table["counter"]), names)
+        self.assertEqual(list(table["status"]), ["ok"] * len(names))
+        np.testing.assert_allclose(table["center"], self.centres, atol=0.01)
+        np.testing.assert_allclose(table["fwhm"], self.fwhms, atol=0.02)
+        np.testing.assert_allclose(table["peak_position"], self.centres, atol=0.05)
+        np.testing.assert_allclose(table["com"], self.centres, atol=0.05)
+
+    def test_GIVEN_a_flat_counter_WHEN_fitting_THEN_check_it_is_not_fitted(self):
+        counters = np.vstack(
+            [gaussian_counters(self.x, [0.0], [1.0]), np.ones_like(self.x)]
+        )
+        table = fit_gauss_batch(self.x, counters, workers=1)
+        self.assertEqual(list(table["counter"]), ["0", "1"])
+        self.assertEqual(list(table["status"]), ["ok", "no_peak"])
+        self.assertTrue(np.isnan(table["center"][1]))
+        self.assertEqual(table["peak"][1], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()